@@ -0,0 +1,53 @@
+"""add portfolio membership indexes
+
+Revision ID: a1b8c3d9e2f4
+Revises: 67a2151d6269
+Create Date: 2020-01-14 10:12:31.512094
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "a1b8c3d9e2f4"  # pragma: allowlist secret
+down_revision = "67a2151d6269"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "portfolio_role_user_status_portfolio",
+        "portfolio_roles",
+        ["user_id", "status", "portfolio_id"],
+        unique=False,
+    )
+    op.create_index(
+        "application_role_user_status_application",
+        "application_roles",
+        ["user_id", "status", "application_id"],
+        unique=False,
+        postgresql_where=sa.text("deleted = false"),
+    )
+    op.create_index(
+        op.f("ix_applications_portfolio_id"),
+        "applications",
+        ["portfolio_id"],
+        unique=False,
+    )
+    op.create_index(
+        "portfolio_active_name",
+        "portfolios",
+        ["name", "id"],
+        unique=False,
+        postgresql_where=sa.text("deleted = false"),
+    )
+
+
+def downgrade():
+    op.drop_index("portfolio_active_name", table_name="portfolios")
+    op.drop_index(op.f("ix_applications_portfolio_id"), table_name="applications")
+    op.drop_index(
+        "application_role_user_status_application", table_name="application_roles"
+    )
+    op.drop_index("portfolio_role_user_status_portfolio", table_name="portfolio_roles")
@@ -0,0 +1,41 @@
+"""add job failure task_id indexes
+
+Revision ID: b4e7d2c91f03
+Revises: a1b8c3d9e2f4
+Create Date: 2020-01-16 15:42:08.103562
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "b4e7d2c91f03"  # pragma: allowlist secret
+down_revision = "a1b8c3d9e2f4"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        op.f("ix_environment_job_failures_task_id"),
+        "environment_job_failures",
+        ["task_id"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_environment_role_job_failures_task_id"),
+        "environment_role_job_failures",
+        ["task_id"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index(
+        op.f("ix_environment_role_job_failures_task_id"),
+        table_name="environment_role_job_failures",
+    )
+    op.drop_index(
+        op.f("ix_environment_job_failures_task_id"),
+        table_name="environment_job_failures",
+    )
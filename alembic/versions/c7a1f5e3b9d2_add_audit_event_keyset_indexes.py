@@ -0,0 +1,42 @@
+"""add audit event keyset indexes
+
+Revision ID: c7a1f5e3b9d2
+Revises: b4e7d2c91f03
+Create Date: 2020-01-21 10:12:44.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "c7a1f5e3b9d2"  # pragma: allowlist secret
+down_revision = "b4e7d2c91f03"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "audit_events_time_created_id",
+        "audit_events",
+        ["time_created", "id"],
+        unique=False,
+    )
+    op.create_index(
+        "audit_events_portfolio_time_created_id",
+        "audit_events",
+        ["portfolio_id", "time_created", "id"],
+        unique=False,
+    )
+    op.create_index(
+        "audit_events_application_time_created_id",
+        "audit_events",
+        ["application_id", "time_created", "id"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index("audit_events_application_time_created_id", table_name="audit_events")
+    op.drop_index("audit_events_portfolio_time_created_id", table_name="audit_events")
+    op.drop_index("audit_events_time_created_id", table_name="audit_events")
@@ -29,9 +29,15 @@ from atst.models.permissions import Permissions
 from atst.queue import celery, update_celery
 from atst.utils import mailer
 from atst.utils.form_cache import FormCache
+from atst.utils.error_notifier import ErrorNotifier
+from atst.utils.in_flight_registry import InFlightRegistry
 from atst.utils.json import CustomJSONEncoder, sqlalchemy_dumps
 from atst.utils.notification_sender import NotificationSender
+from atst.utils.provisioning_queue import ProvisioningQueue
+from atst.utils.queue_metrics import QueueMetrics
+from atst.utils.permission_cache import PermissionCache, PortfolioListCache
 from atst.utils.session_limiter import SessionLimiter
+from atst.utils.sql_statements import count_sql_statements
 
 from logging.config import dictConfig
 from atst.utils.logging import JsonFormatter, RequestContextFilter
@@ -62,6 +68,7 @@ def make_app(config):
 
     update_celery(celery, app)
 
+    count_sql_statements(app)
     make_flask_callbacks(app)
     register_filters(app)
     register_jinja_globals(app)
@@ -69,6 +76,7 @@ def make_app(config):
     make_crl_validator(app)
     make_mailer(app)
     make_notification_sender(app)
+    make_provisioning_queue(app)
 
     db.init_app(app)
     csrf.init_app(app)
@@ -88,6 +96,15 @@ def make_app(config):
         app.register_blueprint(dev_routes)
 
     app.form_cache = FormCache(app.redis)
+    app.permission_cache = PermissionCache(app.redis)
+    app.portfolio_list_cache = PortfolioListCache(app.redis)
+    app.in_flight_registry = InFlightRegistry(
+        app.redis, expiry_seconds=app.config.get("PROVISIONING_IN_FLIGHT_TTL")
+    )
+    app.queue_metrics = QueueMetrics(app.redis)
+    app.error_notifier = ErrorNotifier(
+        app.redis, window=app.config.get("ERROR_NOTIFICATION_WINDOW")
+    )
 
     apply_authentication(app)
     set_default_headers(app)
@@ -108,14 +125,33 @@ def make_flask_callbacks(app):
         g.modal = request.args.get("modal", None)
         g.Authorization = Authorization
         g.Permissions = Permissions
+        g.permission_cache = None
+        g.request_resources = None
 
     @app.context_processor
     def _portfolios():
         if not g.current_user:
             return {}
 
-        portfolios = Portfolios.for_user(g.current_user)
-        return {"portfolios": portfolios}
+        page = max(1, request.args.get("portfoliosPage", 1, type=int))
+        portfolios, more_portfolios = Portfolios.for_sidebar(g.current_user, page=page)
+        return {
+            "portfolios": portfolios,
+            "portfolios_page": page,
+            "more_portfolios": more_portfolios,
+            "portfolios_page_url": _portfolios_page_url,
+        }
+
+    def _portfolios_page_url(page):
+        """
+        The URL of the current page with the sidebar on another page of
+        portfolios. The rest of the query string, such as filters and
+        pagination cursors, is kept.
+        """
+        args = request.args.to_dict(flat=False)
+        args.update(request.view_args or {})
+        args["portfoliosPage"] = page
+        return flask_url_for(request.endpoint, **args)
 
     @app.after_request
     def _cleanup(response):
@@ -123,6 +159,8 @@ def make_flask_callbacks(app):
         g.portfolio = None
         g.application = None
         g.task_order = None
+        g.permission_cache = None
+        g.request_resources = None
         return response
 
 
@@ -176,16 +214,57 @@ def map_config(config):
         ),
         "DISABLE_CRL_CHECK": config.getboolean("default", "DISABLE_CRL_CHECK"),
         "CRL_FAIL_OPEN": config.getboolean("default", "CRL_FAIL_OPEN"),
+        "CSP_CIRCUIT_COOLDOWN": config.getint("default", "CSP_CIRCUIT_COOLDOWN"),
+        "CSP_CIRCUIT_FAILURE_THRESHOLD": config.getint(
+            "default", "CSP_CIRCUIT_FAILURE_THRESHOLD"
+        ),
+        "CSP_MAX_CONCURRENCY": config.getint("default", "CSP_MAX_CONCURRENCY"),
+        "CSP_RATE_BURST": config.getint("default", "CSP_RATE_BURST"),
+        "CSP_RATE_LIMIT": config.getfloat("default", "CSP_RATE_LIMIT"),
+        "CRL_RELOAD_INTERVAL": config.getint("default", "CRL_RELOAD_INTERVAL"),
+        "PROVISIONING_CHUNK_SIZE": config.getint("default", "PROVISIONING_CHUNK_SIZE"),
+        "PROVISIONING_IN_FLIGHT_TTL": config.getint(
+            "default", "PROVISIONING_IN_FLIGHT_TTL"
+        ),
+        "PROVISIONING_RECONCILE_INTERVAL": config.getint(
+            "default", "PROVISIONING_RECONCILE_INTERVAL"
+        ),
+        "ERROR_NOTIFICATION_FLUSH_INTERVAL": config.getint(
+            "default", "ERROR_NOTIFICATION_FLUSH_INTERVAL"
+        ),
+        "ERROR_NOTIFICATION_WINDOW": config.getint(
+            "default", "ERROR_NOTIFICATION_WINDOW"
+        ),
         "LOG_JSON": config.getboolean("default", "LOG_JSON"),
+        "MAIL_CONNECTION_IDLE_TIMEOUT": config.getint(
+            "default", "MAIL_CONNECTION_IDLE_TIMEOUT"
+        ),
+        "MAIL_MAX_MESSAGES_PER_CONNECTION": config.getint(
+            "default", "MAIL_MAX_MESSAGES_PER_CONNECTION"
+        ),
+        "MAIL_POOL_SIZE": config.getint("default", "MAIL_POOL_SIZE"),
         "LIMIT_CONCURRENT_SESSIONS": config.getboolean(
             "default", "LIMIT_CONCURRENT_SESSIONS"
         ),
         # Store the celery task results in a database table (celery_taskmeta)
         "CELERY_RESULT_BACKEND": "db+{}".format(config.get("default", "DATABASE_URI")),
         # Do not automatically delete results (by default, Celery will do this
-        # with a Beat job once a day)
+        # with a Beat job once a day). Results are deleted by the
+        # compact_task_results job instead, which keeps the ones that job
+        # failures link to.
         "CELERY_RESULT_EXPIRES": 0,
         "CELERY_RESULT_EXTENDED": True,
+        # Tasks that ignore their results still store them when they fail
+        "CELERY_STORE_ERRORS_EVEN_IF_IGNORED": True,
+        "CELERY_QUEUE_METRICS_INTERVAL": config.getint(
+            "default", "CELERY_QUEUE_METRICS_INTERVAL"
+        ),
+        "CELERY_RESULT_RETENTION_DAYS": config.getint(
+            "default", "CELERY_RESULT_RETENTION_DAYS"
+        ),
+        "CELERY_RESULT_DELETE_BATCH_SIZE": config.getint(
+            "default", "CELERY_RESULT_DELETE_BATCH_SIZE"
+        ),
         "CONTRACT_START_DATE": datetime.strptime(
             config.get("default", "CONTRACT_START_DATE"), "%Y-%m-%d"
         ).date(),
@@ -285,7 +364,12 @@ def make_crl_validator(app):
         if not os.path.isdir(crl_dir):
             os.makedirs(crl_dir, exist_ok=True)
 
-        app.crl_cache = CRLCache(app.config["CA_CHAIN"], crl_dir, logger=app.logger,)
+        app.crl_cache = CRLCache(
+            app.config["CA_CHAIN"],
+            crl_dir,
+            logger=app.logger,
+            reload_interval=app.config.get("CRL_RELOAD_INTERVAL"),
+        )
 
 
 def make_mailer(app):
@@ -298,6 +382,10 @@ def make_mailer(app):
             username=app.config.get("MAIL_SENDER"),
             password=app.config.get("MAIL_PASSWORD"),
             use_tls=app.config.get("MAIL_TLS"),
+            pool_size=app.config.get("MAIL_POOL_SIZE"),
+            max_messages=app.config.get("MAIL_MAX_MESSAGES_PER_CONNECTION"),
+            idle_timeout=app.config.get("MAIL_CONNECTION_IDLE_TIMEOUT"),
+            logger=app.logger,
         )
     sender = app.config.get("MAIL_SENDER")
     app.mailer = mailer.Mailer(mailer_connection, sender)
@@ -307,6 +395,10 @@ def make_notification_sender(app):
     app.notification_sender = NotificationSender()
 
 
+def make_provisioning_queue(app):
+    app.provisioning_queue = ProvisioningQueue()
+
+
 def make_session_limiter(app, session, config):
     app.session_limiter = SessionLimiter(config, session, app.redis)
 
@@ -1,4 +1,5 @@
 from sqlalchemy.orm.exc import NoResultFound
+from flask import current_app as app
 
 from atst.database import db
 from atst.domain.environment_roles import EnvironmentRoles
@@ -36,6 +37,10 @@ class ApplicationRoles(object):
         db.session.add(role)
         db.session.commit()
 
+        app.provisioning_queue.provision_users(
+            [env_role.id for env_role in role.environment_roles]
+        )
+
     @classmethod
     def get(cls, user_id, application_id):
         try:
@@ -8,26 +8,22 @@ class AuditEventQuery(Query):
 
     @classmethod
     def get_all(cls, pagination_opts):
-        query = db.session.query(cls.model).order_by(cls.model.time_created.desc())
-        return cls.paginate(query, pagination_opts)
+        query = db.session.query(cls.model)
+        return cls.paginate_by_keyset(query, pagination_opts)
 
     @classmethod
     def get_portfolio_events(cls, portfolio_id, pagination_opts):
-        query = (
-            db.session.query(cls.model)
-            .filter(cls.model.portfolio_id == portfolio_id)
-            .order_by(cls.model.time_created.desc())
+        query = db.session.query(cls.model).filter(
+            cls.model.portfolio_id == portfolio_id
         )
-        return cls.paginate(query, pagination_opts)
+        return cls.paginate_by_keyset(query, pagination_opts)
 
     @classmethod
     def get_application_events(cls, application_id, pagination_opts):
-        query = (
-            db.session.query(cls.model)
-            .filter(cls.model.application_id == application_id)
-            .order_by(cls.model.time_created.desc())
+        query = db.session.query(cls.model).filter(
+            cls.model.application_id == application_id
         )
-        return cls.paginate(query, pagination_opts)
+        return cls.paginate_by_keyset(query, pagination_opts)
 
 
 class AuditLog(object):
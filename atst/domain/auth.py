@@ -1,6 +1,6 @@
 from flask import g, redirect, url_for, session, request
 
-from atst.domain.users import Users
+from atst.utils.context_processors import get_user_and_resources_from_context
 
 
 UNPROTECTED_ROUTES = [
@@ -48,7 +48,10 @@ def should_redirect_to_user_profile(request, user):
 def get_current_user():
     user_id = session.get("user_id")
     if user_id:
-        return Users.get(user_id)
+        user, g.request_resources = get_user_and_resources_from_context(
+            user_id, request.view_args
+        )
+        return user
     else:
         return False
 
@@ -1,16 +1,27 @@
 import os
-import re
 import hashlib
 import logging
+import threading
 
 from OpenSSL import crypto, SSL
 from datetime import datetime
 from flask import current_app as app
 
-from .util import load_crl_locations_cache, serialize_crl_locations_cache, CRL_LIST
-
-# error codes from OpenSSL: https://github.com/openssl/openssl/blob/2c75f03b39de2fa7d006bc0f0d7c58235a54d9bb/include/openssl/x509_vfy.h#L111
-CRL_EXPIRED_ERROR_CODE = 12
+from .index import (
+    crl_stamp,
+    load_certificate_authorities,
+    load_revocation_index,
+    parse_revocation_entry,
+    refresh_revocation_entries,
+    sync_revocation_index,
+)
+from .util import (
+    crl_version_stamp,
+    load_crl_locations_cache,
+    serialize_crl_locations_cache,
+    CRLParseError,
+    CRL_LIST,
+)
 
 
 def get_common_name(x509_name_object):
@@ -63,12 +74,6 @@ class NoOpCRLCache(CRLInterface):
 
 
 class CRLCache(CRLInterface):
-
-    _PEM_RE = re.compile(
-        b"-----BEGIN CERTIFICATE-----\r?.+?\r?-----END CERTIFICATE-----\r?\n?",
-        re.DOTALL,
-    )
-
     def __init__(
         self,
         root_location,
@@ -76,69 +81,190 @@ class CRLCache(CRLInterface):
         store_class=crypto.X509Store,
         logger=None,
         crl_list=CRL_LIST,
+        reload_interval=None,
     ):
         self._crl_dir = crl_dir
         self.logger = logger
         self.store_class = store_class
-        self.certificate_authorities = {}
+        self.certificate_authorities = load_certificate_authorities(root_location)
         self.crl_list = crl_list
-        self._load_roots(root_location)
-        self._build_crl_cache()
+        self._stores = {}
+        self.store_hits = 0
+        self.store_rebuilds = 0
+        self._version = crl_version_stamp(self._crl_dir)
+        self.crl_cache = self._build_crl_cache()
+        self.revocation_index = self._build_revocation_index(self.crl_cache)
+        self._watcher = CRLWatcher(self, reload_interval) if reload_interval else None
+
+    def is_stale(self):
+        """
+        Whether the CRLs on disk have changed since they were loaded, either
+        because the sync job wrote a new version stamp or because a CRL file
+        itself was modified.
+        """
+        if crl_version_stamp(self._crl_dir) != self._version:
+            return True
 
-    def _get_store(self, cert):
-        return self._build_store(cert.get_issuer())
+        for issuer_der, crl_location in self.crl_cache.items():
+            revocations = self.revocation_index.get(issuer_der)
+            if crl_location and os.path.isfile(crl_location):
+                if not revocations or revocations.stamp != crl_stamp(crl_location):
+                    return True
 
-    def _load_roots(self, root_location):
-        with open(root_location, "rb") as f:
-            for raw_ca in self._parse_roots(f.read()):
-                ca = crypto.load_certificate(crypto.FILETYPE_PEM, raw_ca)
-                self.certificate_authorities[ca.get_subject().der()] = ca
+        return False
+
+    def reload(self):
+        """
+        Loads the current CRLs and builds a store for every issuer before
+        swapping them in, so checks that are already running keep using the
+        previous state and never wait on the reload.
+        """
+        version = crl_version_stamp(self._crl_dir)
+        crl_cache = self._build_crl_cache()
+        revocation_index = self._build_revocation_index(crl_cache)
+        stores = {}
+        for issuer_der, revocations in revocation_index.items():
+            ca = self.certificate_authorities.get(issuer_der)
+            if ca is not None and issuer_der in crl_cache:
+                store = self._build_store(ca.get_subject())
+                stores[issuer_der] = {"revocations": revocations, "store": store}
+
+        self.crl_cache = crl_cache
+        self.revocation_index = revocation_index
+        self._stores = stores
+        self._version = version
+        self.store_rebuilds += len(stores)
+        self._log("Reloaded CRLs for {} issuers.".format(len(stores)))
+
+    def refresh(self):
+        """
+        Reloads the CRLs if they have changed. Errors are logged and the
+        previous state is kept.
+        """
+        try:
+            if self.is_stale():
+                self.reload()
+                return True
+        except Exception as err:
+            self._log(
+                "Could not reload CRLs, continuing with the loaded CRLs. Error: {}".format(
+                    err
+                ),
+                level=logging.ERROR,
+            )
 
-    def _parse_roots(self, root_str):
-        return [match.group(0) for match in self._PEM_RE.finditer(root_str)]
+        return False
 
-    def _build_crl_cache(self):
-        try:
-            self.crl_cache = load_crl_locations_cache(self._crl_dir)
-        except FileNotFoundError:
-            self.crl_cache = serialize_crl_locations_cache(
-                self._crl_dir, crl_list=self.crl_list
+    def _get_issuer_cache(self, issuer):
+        """
+        Returns the revocation entry and a ready-to-use store for the issuer.
+        Both are kept in memory keyed by issuer DER and are only rebuilt when
+        the backing CRL file has changed on disk.
+        """
+        cached = self._stores.get(issuer.der())
+        if cached and self._watcher:
+            # changed CRLs are reloaded in the background
+            return self._store_hit(cached)
+
+        crl_location = self._get_crl_location(issuer)
+        stamp = crl_stamp(crl_location)
+
+        if cached and cached["revocations"].stamp == stamp:
+            return self._store_hit(cached)
+
+        revocations = self._get_revocations(issuer, crl_location, stamp)
+        if cached and cached["revocations"] is revocations:
+            return self._store_hit(cached)
+
+        cached = {"revocations": revocations, "store": self._build_store(issuer)}
+        self._stores[issuer.der()] = cached
+        self.store_rebuilds += 1
+        self._log(
+            "Built store for issuer with Common Name {}. Store hits: {}, rebuilds: {}.".format(
+                get_common_name(issuer), self.store_hits, self.store_rebuilds
             )
+        )
 
-    def _load_crl(self, crl_location):
-        with open(crl_location, "rb") as crl_file:
-            try:
-                return crypto.load_crl(crypto.FILETYPE_ASN1, crl_file.read())
-            except crypto.Error:
-                self._log(
-                    "Could not load CRL at location {}".format(crl_location),
-                    level=logging.WARNING,
-                )
+        return cached
 
-    def _build_store(self, issuer):
-        store = self.store_class()
-        self._log("STORE ID: {}. Building store.".format(id(store)))
-        store.set_flags(crypto.X509StoreFlags.CRL_CHECK)
+    def _store_hit(self, cached):
+        self.store_hits += 1
+        return cached
+
+    def _get_crl_location(self, issuer):
         crl_location = self.crl_cache.get(issuer.der())
-        issuer_name = get_common_name(issuer)
 
         if not crl_location:
             raise CRLInvalidException(
                 "Could not find matching CRL for issuer with Common Name {}".format(
-                    issuer_name
+                    get_common_name(issuer)
                 )
             )
 
-        crl = self._load_crl(crl_location)
-        store.add_crl(crl)
+        return crl_location
 
-        self._log(
-            "STORE ID: {}. Adding CRL with issuer Common Name {}".format(
-                id(store), issuer_name
+    def _get_revocations(self, issuer, crl_location, stamp):
+        revocations = self.revocation_index.get(issuer.der())
+        if revocations and revocations.stamp == stamp:
+            return revocations
+
+        with open(crl_location, "rb") as crl_file:
+            crl_bytes = crl_file.read()
+
+        if revocations and revocations.digest == hashlib.sha256(crl_bytes).hexdigest():
+            # the file was touched but its content is unchanged
+            revocations.stamp = stamp
+            return revocations
+
+        try:
+            _, revocations = parse_revocation_entry(
+                crl_location, crl_bytes, self.certificate_authorities
             )
-        )
+        except CRLParseError as err:
+            raise CRLInvalidException(str(err))
 
-        store = self._add_certificate_chain_to_store(store, crl.get_issuer())
+        self.revocation_index[issuer.der()] = revocations
+        return revocations
+
+    def _build_crl_cache(self):
+        try:
+            return load_crl_locations_cache(self._crl_dir)
+        except FileNotFoundError:
+            return serialize_crl_locations_cache(self._crl_dir, crl_list=self.crl_list)
+
+    def _build_revocation_index(self, crl_cache):
+        """
+        Maps the revocation index that is shared by every worker, creating it
+        if the sync job has not written one yet. CRLs that changed after the
+        index was written are parsed into this process's memory only.
+        """
+        try:
+            revocation_index = load_revocation_index(self._crl_dir)
+        except (FileNotFoundError, CRLParseError):
+            revocation_index, errors = sync_revocation_index(
+                self._crl_dir, crl_cache, self.certificate_authorities
+            )
+        else:
+            updated, errors = refresh_revocation_entries(
+                revocation_index, crl_cache, self.certificate_authorities
+            )
+            if updated:
+                self._log(
+                    "Revocation index is out of date for {} CRLs, parsed them in-process.".format(
+                        updated
+                    ),
+                    level=logging.WARNING,
+                )
+
+        for err in errors:
+            self._log(str(err), level=logging.WARNING)
+
+        return revocation_index
+
+    def _build_store(self, issuer):
+        store = self.store_class()
+        self._log("STORE ID: {}. Building store.".format(id(store)))
+        store = self._add_certificate_chain_to_store(store, issuer)
         return store
 
     # this _should_ happen just twice for the DoD PKI (intermediary, root) but
@@ -161,27 +287,84 @@ class CRLCache(CRLInterface):
             return self._add_certificate_chain_to_store(store, ca.get_issuer())
 
     def crl_check(self, cert):
+        if self._watcher:
+            self._watcher.ensure_running()
+
         parsed = crypto.load_certificate(crypto.FILETYPE_PEM, cert)
-        store = self._get_store(parsed)
-        context = crypto.X509StoreContext(store, parsed)
+        cached = self._get_issuer_cache(parsed.get_issuer())
+        revocations = cached["revocations"]
+
+        if revocations.is_expired():
+            if app.config.get("CRL_FAIL_OPEN"):
+                self._log(
+                    "Encountered expired CRL for certificate with CN {} and issuer CN {}, failing open.".format(
+                        parsed.get_subject().CN, parsed.get_issuer().CN
+                    ),
+                    level=logging.WARNING,
+                )
+            else:
+                raise CRLInvalidException(
+                    "CRL expired. Location: {}".format(revocations.crl_path)
+                )
+
+        if revocations.is_revoked(parsed.get_serial_number()):
+            raise CRLRevocationException(
+                "Certificate revoked. Serial: {}. Issuer CN: {}".format(
+                    parsed.get_serial_number(), parsed.get_issuer().CN
+                )
+            )
+
+        # revocation is answered by the index, so the store only verifies the
+        # certificate chain against the already-loaded CAs
+        context = crypto.X509StoreContext(cached["store"], parsed)
         try:
             context.verify_certificate()
             return True
 
         except crypto.X509StoreContextError as err:
-            if err.args[0][0] == CRL_EXPIRED_ERROR_CODE:
-                if app.config.get("CRL_FAIL_OPEN"):
-                    self._log(
-                        "Encountered expired CRL for certificate with CN {} and issuer CN {}, failing open.".format(
-                            parsed.get_subject().CN, parsed.get_issuer().CN
-                        ),
-                        level=logging.WARNING,
-                    )
-                    return True
-                else:
-                    raise CRLInvalidException("CRL expired. Args: {}".format(err.args))
             raise CRLRevocationException(
                 "Certificate revoked or errored. Error: {}. Args: {}".format(
                     type(err), err.args
                 )
             )
+
+
+class CRLWatcher:
+    """
+    Polls for changed CRLs on a background thread and reloads them into the
+    CRLCache without blocking logins.
+    """
+
+    def __init__(self, crl_cache, interval):
+        self.crl_cache = crl_cache
+        self.interval = interval
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def _is_running(self):
+        return self._pid == os.getpid() and self._thread.is_alive()
+
+    def ensure_running(self):
+        # threads do not survive a fork, so each uWSGI worker starts its own
+        if self._is_running():
+            return
+
+        with self._lock:
+            if self._is_running():
+                return
+
+            self._pid = os.getpid()
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="crl-watcher", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.crl_cache.refresh()
@@ -0,0 +1,306 @@
+import calendar
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import time
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from OpenSSL import crypto
+
+from .util import CRLParseError, _atomic_write
+
+
+REVOCATION_INDEX = "crl_revocations.idx"
+
+# RFC 5280 caps serial numbers at 20 octets; wider serials widen the table.
+SERIAL_WIDTH = 20
+
+_MAGIC = b"ATATCRL1"
+_HEADER_LENGTH = struct.Struct(">I")
+
+_PEM_RE = re.compile(
+    b"-----BEGIN CERTIFICATE-----\r?.+?\r?-----END CERTIFICATE-----\r?\n?", re.DOTALL,
+)
+
+
+def _revocation_index_location(crl_dir):
+    return os.path.join(crl_dir, REVOCATION_INDEX)
+
+
+def _serial_width(serial):
+    return max(1, (serial.bit_length() + 7) // 8)
+
+
+def crl_stamp(crl_location):
+    stat = os.stat(crl_location)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class RevocationEntry:
+    """
+    The revocation data extracted from a single issuer's CRL: the revoked
+    serial numbers, the CRL's nextUpdate time and the stamp (mtime, size) and
+    SHA-256 digest of the file it was built from.
+    """
+
+    def __init__(self, crl_path, stamp, digest, next_update):
+        self.crl_path = crl_path
+        self.stamp = tuple(stamp)
+        self.digest = digest
+        self.next_update = next_update
+
+    def is_revoked(self, serial):
+        raise NotImplementedError()
+
+    def serials(self):
+        raise NotImplementedError()
+
+    def is_expired(self, now=None):
+        if self.next_update is None:
+            return False
+
+        now = time.time() if now is None else now
+        return now > self.next_update
+
+
+class ParsedRevocationEntry(RevocationEntry):
+    def __init__(self, crl_path, stamp, digest, next_update, serials):
+        super().__init__(crl_path, stamp, digest, next_update)
+        self._serials = frozenset(serials)
+
+    def is_revoked(self, serial):
+        return serial in self._serials
+
+    def serials(self):
+        return self._serials
+
+
+class MappedRevocationEntry(RevocationEntry):
+    """
+    Looks serials up directly in the memory-mapped index, where each issuer's
+    revoked serials are stored as a sorted table of fixed-width big-endian
+    integers.
+    """
+
+    def __init__(
+        self, crl_path, stamp, digest, next_update, buffer, offset, count, width
+    ):
+        super().__init__(crl_path, stamp, digest, next_update)
+        self._buffer = buffer
+        self._offset = offset
+        self._count = count
+        self._width = width
+
+    def _serial_at(self, position):
+        start = self._offset + position * self._width
+        return self._buffer[start : start + self._width]
+
+    def is_revoked(self, serial):
+        if serial < 0 or _serial_width(serial) > self._width:
+            return False
+
+        key = serial.to_bytes(self._width, "big")
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            candidate = self._serial_at(middle)
+            if candidate < key:
+                low = middle + 1
+            elif candidate > key:
+                high = middle
+            else:
+                return True
+
+        return False
+
+    def serials(self):
+        return [
+            int.from_bytes(self._serial_at(position), "big")
+            for position in range(self._count)
+        ]
+
+
+def load_certificate_authorities(root_location):
+    """
+    Loads the CA certificates in a PEM bundle, keyed by their DER-encoded
+    subject.
+    """
+    certificate_authorities = {}
+    with open(root_location, "rb") as f:
+        for match in _PEM_RE.finditer(f.read()):
+            ca = crypto.load_certificate(crypto.FILETYPE_PEM, match.group(0))
+            certificate_authorities[ca.get_subject().der()] = ca
+
+    return certificate_authorities
+
+
+def parse_revocation_entry(crl_path, crl_bytes, certificate_authorities):
+    """
+    Parses a DER-encoded CRL into a `ParsedRevocationEntry`, keyed by the
+    issuer's DER-encoded name. The CRL's signature is checked against the
+    matching CA in `certificate_authorities`, since the index replaces the
+    CRL check OpenSSL would otherwise do against a store.
+    """
+    try:
+        crl = x509.load_der_x509_crl(crl_bytes, default_backend())
+    except ValueError:
+        raise CRLParseError("Could not parse CRL at location {}".format(crl_path))
+
+    issuer_der = crl.issuer.public_bytes(default_backend())
+    ca = certificate_authorities.get(issuer_der)
+    if ca is None:
+        raise CRLParseError(
+            "Could not find CA for the issuer of the CRL at location {}".format(
+                crl_path
+            )
+        )
+
+    if not crl.is_signature_valid(ca.to_cryptography().public_key()):
+        raise CRLParseError("Invalid signature for CRL at location {}".format(crl_path))
+
+    next_update = (
+        calendar.timegm(crl.next_update.utctimetuple()) if crl.next_update else None
+    )
+    serials = [revoked.serial_number for revoked in crl if revoked.serial_number >= 0]
+    entry = ParsedRevocationEntry(
+        str(crl_path),
+        crl_stamp(crl_path),
+        hashlib.sha256(crl_bytes).hexdigest(),
+        next_update,
+        serials,
+    )
+
+    return (issuer_der, entry)
+
+
+def serialize_revocation_index(crl_dir, entries):
+    """
+    Writes the revocation entries (a dict of issuer DER to `RevocationEntry`)
+    to the index file in `crl_dir`. The file is written to a temporary
+    location and renamed into place, so processes that already mapped the old
+    index keep a consistent view.
+    """
+    tables = {der: sorted(entry.serials()) for der, entry in entries.items()}
+    width = max(
+        [SERIAL_WIDTH]
+        + [_serial_width(serials[-1]) for serials in tables.values() if serials]
+    )
+
+    issuers = {}
+    offset = 0
+    for der, entry in entries.items():
+        count = len(tables[der])
+        issuers[der.hex()] = {
+            "crl": entry.crl_path,
+            "mtime_ns": entry.stamp[0],
+            "size": entry.stamp[1],
+            "digest": entry.digest,
+            "next_update": entry.next_update,
+            "offset": offset,
+            "count": count,
+        }
+        offset += count * width
+
+    header = json.dumps({"width": width, "issuers": issuers}).encode()
+    with _atomic_write(_revocation_index_location(crl_dir)) as index_file:
+        index_file.write(_MAGIC)
+        index_file.write(_HEADER_LENGTH.pack(len(header)))
+        index_file.write(header)
+        for der in entries:
+            for serial in tables[der]:
+                index_file.write(serial.to_bytes(width, "big"))
+
+
+def load_revocation_index(crl_dir):
+    """
+    Maps the index file in `crl_dir` into memory read-only and returns a dict
+    of issuer DER to `MappedRevocationEntry`.
+    """
+    with open(_revocation_index_location(crl_dir), "rb") as index_file:
+        if os.fstat(index_file.fileno()).st_size == 0:
+            raise CRLParseError("Revocation index is empty")
+        buffer = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if buffer[: len(_MAGIC)] != _MAGIC:
+        raise CRLParseError("Revocation index has an unrecognized format")
+
+    header_start = len(_MAGIC) + _HEADER_LENGTH.size
+    (header_length,) = _HEADER_LENGTH.unpack(buffer[len(_MAGIC) : header_start])
+    header = json.loads(buffer[header_start : header_start + header_length])
+    data_start = header_start + header_length
+
+    return {
+        bytes.fromhex(der): MappedRevocationEntry(
+            data["crl"],
+            (data["mtime_ns"], data["size"]),
+            data["digest"],
+            data["next_update"],
+            buffer,
+            data_start + data["offset"],
+            data["count"],
+            header["width"],
+        )
+        for der, data in header["issuers"].items()
+    }
+
+
+def refresh_revocation_entries(revocation_index, crl_cache, certificate_authorities):
+    """
+    Re-parses every CRL in `crl_cache` whose file no longer matches its entry
+    in `revocation_index` and updates the index in place. Returns the number
+    of updated entries and the errors for any CRLs that could not be used.
+    """
+    updated = 0
+    errors = []
+    for issuer_der, crl_location in crl_cache.items():
+        revocations = revocation_index.get(issuer_der)
+        if (
+            not crl_location
+            or not os.path.isfile(crl_location)
+            or (revocations and revocations.stamp == crl_stamp(crl_location))
+        ):
+            continue
+
+        with open(crl_location, "rb") as crl_file:
+            try:
+                _, revocation_index[issuer_der] = parse_revocation_entry(
+                    crl_location, crl_file.read(), certificate_authorities
+                )
+                updated += 1
+            except CRLParseError as err:
+                errors.append(err)
+
+    return (updated, errors)
+
+
+def sync_revocation_index(crl_dir, crl_cache, certificate_authorities):
+    """
+    Brings the shared index in `crl_dir` up to date with the CRLs in
+    `crl_cache` and maps it. Entries for unchanged CRLs are copied over from
+    the existing index instead of being parsed again. Returns the mapped index
+    and the errors for any CRLs that could not be used.
+    """
+    try:
+        revocation_index = load_revocation_index(crl_dir)
+        exists = True
+    except (FileNotFoundError, CRLParseError):
+        revocation_index = {}
+        exists = False
+
+    revocation_index = {
+        issuer_der: revocations
+        for issuer_der, revocations in revocation_index.items()
+        if issuer_der in crl_cache
+    }
+    updated, errors = refresh_revocation_entries(
+        revocation_index, crl_cache, certificate_authorities
+    )
+    if updated or not exists:
+        serialize_revocation_index(crl_dir, revocation_index)
+        revocation_index = load_revocation_index(crl_dir)
+
+    return (revocation_index, errors)
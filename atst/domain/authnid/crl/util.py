@@ -1,6 +1,11 @@
 import json
+import logging
 import os
 import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import pendulum
 import requests
@@ -16,6 +21,9 @@ class CRLParseError(Exception):
 
 MODIFIED_TIME_BUFFER = 15 * 60
 
+# CRLs are tens of MB, so stream them in large chunks
+CHUNK_SIZE = 256 * 1024
+
 
 CRL_LIST = [
     (
@@ -239,6 +247,9 @@ CRL_LIST = [
 
 JSON_CACHE = "crl_locations.json"
 
+# rewritten at the end of every sync so running apps know to reload
+VERSION_STAMP = "crl_version"
+
 
 def _deserialize_cache_items(cache):
     return {bytes.fromhex(der): data for (der, data) in cache.items()}
@@ -258,11 +269,54 @@ def serialize_crl_locations_cache(crl_dir, crl_list=CRL_LIST):
         if os.path.isfile(crl_path):
             crl_cache[crl_issuer] = crl_path
 
+    write_crl_locations_cache(crl_dir, crl_cache)
+
+    return {bytes.fromhex(k): v for k, v in crl_cache.items()}
+
+
+def crl_version_stamp(crl_dir):
+    version_location = os.path.join(crl_dir, VERSION_STAMP)
+    if os.path.isfile(version_location):
+        with open(version_location, "r") as version_file:
+            return version_file.read()
+
+
+def write_crl_version_stamp(crl_dir):
+    version_location = os.path.join(crl_dir, VERSION_STAMP)
+    with _atomic_write(version_location, "w") as version_file:
+        version_file.write(pendulum.now().to_iso8601_string())
+
+
+def write_crl_locations_cache(crl_dir, crl_cache):
     json_location = "{}/{}".format(crl_dir, JSON_CACHE)
-    with open(json_location, "w") as json_file:
+    with _atomic_write(json_location, "w") as json_file:
         json.dump(crl_cache, json_file)
 
-    return {bytes.fromhex(k): v for k, v in crl_cache.items()}
+
+# The mode of the files that the sync writes.
+FILE_MODE = 0o644
+
+
+@contextmanager
+def _atomic_write(location, mode="wb"):
+    """
+    Writes to a temporary file next to `location` and renames it into place
+    once the write completes, so readers never see a partial file.
+
+    The file is made world-readable, because `mkstemp` creates it readable by
+    its owner only and the sync may run as a different user from the app.
+    """
+    fd, tmp_location = tempfile.mkstemp(
+        dir=os.path.dirname(location) or ".", prefix=".", suffix=".part"
+    )
+    try:
+        os.fchmod(fd, FILE_MODE)
+        with os.fdopen(fd, mode) as tmp_file:
+            yield tmp_file
+        os.replace(tmp_location, location)
+    except BaseException:
+        os.remove(tmp_location)
+        raise
 
 
 def crl_local_path(out_dir, crl_location):
@@ -283,7 +337,9 @@ def existing_crl_modification_time(crl):
         return False
 
 
-def write_crl(out_dir, target_dir, crl_location):
+def write_crl(
+    out_dir, target_dir, crl_location, session=requests, chunk_size=CHUNK_SIZE
+):
     crl = crl_local_path(out_dir, crl_location)
     existing = crl_local_path(target_dir, crl_location)
     options = {"stream": True}
@@ -291,77 +347,125 @@ def write_crl(out_dir, target_dir, crl_location):
     if mod_time:
         options["headers"] = {"If-Modified-Since": mod_time}
 
-    with requests.get(crl_location, **options) as response:
+    bytes_written = 0
+    with session.get(crl_location, **options) as response:
         if response.status_code > 399:
             raise CRLNotFoundError()
 
         if response.status_code == 304:
-            return (False, existing)
+            return (False, existing, bytes_written)
 
-        with open(crl, "wb") as crl_file:
-            for chunk in response.iter_content(chunk_size=1024):
+        with _atomic_write(crl) as crl_file:
+            for chunk in response.iter_content(chunk_size=chunk_size):
                 if chunk:
                     crl_file.write(chunk)
+                    bytes_written += len(chunk)
 
-    return (True, existing)
-
-
-def remove_bad_crl(out_dir, crl_location):
-    crl = crl_local_path(out_dir, crl_location)
-    os.remove(crl)
+    return (True, existing, bytes_written)
 
 
 def log_error(logger, crl_location):
     if logger:
         logger.error(
-            "Error downloading {}, removing file and continuing anyway".format(
-                crl_location
-            )
+            "Error downloading {}, skipping and continuing anyway".format(crl_location)
         )
 
 
-def refresh_crl(out_dir, target_dir, crl_uri, logger):
+def refresh_crl(out_dir, target_dir, crl_uri, logger, session=requests):
     logger.info("updating CRL from {}".format(crl_uri))
+    start = time.monotonic()
     try:
-        was_updated, crl_path = write_crl(out_dir, target_dir, crl_uri)
+        was_updated, crl_path, bytes_written = write_crl(
+            out_dir, target_dir, crl_uri, session=session
+        )
+        elapsed = time.monotonic() - start
         if was_updated:
-            logger.info("successfully synced CRL from {}".format(crl_uri))
+            logger.info(
+                "successfully synced CRL from {} ({} bytes in {:.2f}s)".format(
+                    crl_uri, bytes_written, elapsed
+                )
+            )
         else:
-            logger.info("no updates for CRL from {}".format(crl_uri))
+            logger.info(
+                "no updates for CRL from {} (checked in {:.2f}s)".format(
+                    crl_uri, elapsed
+                )
+            )
 
         return crl_path
-    except requests.exceptions.ChunkedEncodingError:
-        log_error(logger, crl_uri)
-        remove_bad_crl(out_dir, crl_uri)
-    except CRLNotFoundError:
+    except (requests.exceptions.ChunkedEncodingError, CRLNotFoundError):
         log_error(logger, crl_uri)
 
 
-def sync_crls(tmp_location, final_location):
-    crl_cache = {}
-    for crl_uri, crl_issuer in CRL_LIST:
-        crl_path = refresh_crl(tmp_location, final_location, crl_uri, logger)
-        crl_cache[crl_issuer] = crl_path
+def _sync_revocation_index(crl_dir, crl_cache, root_location, logger):
+    # imported here because the index module depends on this one
+    from atst.domain.authnid.crl.index import (
+        load_certificate_authorities,
+        sync_revocation_index,
+    )
 
-    json_location = "{}/{}".format(final_location, JSON_CACHE)
-    with open(json_location, "w") as json_file:
-        json.dump(crl_cache, json_file)
+    start = time.monotonic()
+    _, errors = sync_revocation_index(
+        crl_dir,
+        _deserialize_cache_items(crl_cache),
+        load_certificate_authorities(root_location),
+    )
+    for err in errors:
+        logger.warning(str(err))
+
+    logger.info("wrote revocation index in {:.2f}s".format(time.monotonic() - start))
+
+
+def sync_crls(
+    tmp_location,
+    final_location,
+    logger=None,
+    max_workers=1,
+    crl_list=CRL_LIST,
+    root_location=None,
+):
+    """
+    Downloads every CRL in `crl_list` and writes the locations cache. With
+    `max_workers` greater than one, CRLs are fetched concurrently over a
+    shared HTTP session.
+
+    If `root_location` points to the CA bundle, the shared revocation index
+    that every app worker maps read-only is rebuilt as well.
+    """
+    logger = logger or logging.getLogger(__name__)
+    start = time.monotonic()
+
+    with requests.Session() as session:
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=max_workers, pool_maxsize=max_workers
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
 
+        def _refresh(crl_uri):
+            return refresh_crl(
+                tmp_location, final_location, crl_uri, logger, session=session
+            )
 
-if __name__ == "__main__":
-    import sys
-    import logging
+        crl_uris = [crl_uri for crl_uri, _ in crl_list]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            crl_paths = list(executor.map(_refresh, crl_uris))
+
+    crl_cache = {
+        crl_issuer: crl_path for (_, crl_issuer), crl_path in zip(crl_list, crl_paths)
+    }
+    write_crl_locations_cache(final_location, crl_cache)
+    if root_location and os.path.isfile(root_location):
+        _sync_revocation_index(final_location, crl_cache, root_location, logger)
+    elif root_location:
+        logger.warning(
+            "CA bundle {} not found, skipping the revocation index".format(
+                root_location
+            )
+        )
+    # written last so that running apps reload once everything is in place
+    write_crl_version_stamp(final_location)
 
-    logging.basicConfig(
-        level=logging.INFO, format="[%(asctime)s]:%(levelname)s: %(message)s"
+    logger.info(
+        "synced {} CRLs in {:.2f}s".format(len(crl_list), time.monotonic() - start)
     )
-    logger = logging.getLogger()
-    logger.info("Updating CRLs")
-    try:
-        tmp_location = sys.argv[1]
-        final_location = sys.argv[2]
-        sync_crls(tmp_location, final_location)
-    except Exception as err:
-        logger.exception("Fatal error encountered, stopping")
-        sys.exit(1)
-    logger.info("Finished updating CRLs")
@@ -1,42 +1,175 @@
-from atst.utils import first_or_none
+from itertools import chain
+
+from flask import current_app, g, has_app_context, has_request_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session, selectinload
+
+from atst.database import db
 from atst.models.permissions import Permissions
 from atst.domain.exceptions import UnauthorizedError
+from atst.models.application_role import ApplicationRole
+from atst.models.permission_set import PermissionSet
+from atst.models.portfolio_role import PortfolioRole
+from atst.models.user import User
 from atst.models.portfolio_role import Status as PortfolioRoleStatus
 from atst.models.application_role import Status as ApplicationRoleStatus
+from atst.utils.permission_cache import (
+    has_permission_changes,
+    mark_permissions_changed,
+)
+
+
+def _memoize(key, resolve):
+    """
+    Memoizes a permission lookup for the rest of the current request. Outside
+    of a request the lookup is always resolved.
+    """
+    if not has_request_context() or None in key:
+        return resolve()
+
+    cache = getattr(g, "permission_cache", None)
+    if cache is None:
+        cache = g.permission_cache = {}
+
+    if key not in cache:
+        cache[key] = resolve()
+
+    return cache[key]
+
+
+def clear_permission_cache():
+    if has_request_context():
+        g.permission_cache = None
+
+
+def _shared_permission_cache(user):
+    if user.id is not None and has_app_context():
+        return getattr(current_app, "permission_cache", None)
+
+
+@event.listens_for(Session, "after_flush")
+def _clear_permission_cache_on_role_changes(session, _flush_context):
+    changed = False
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, User):
+            mark_permissions_changed(session, obj.id)
+        elif isinstance(obj, (PortfolioRole, ApplicationRole)):
+            if obj.user_id is not None:
+                mark_permissions_changed(session, obj.user_id)
+        elif isinstance(obj, PermissionSet):
+            mark_permissions_changed(session)
+        else:
+            continue
+
+        changed = True
+
+    if changed:
+        clear_permission_cache()
 
 
 class Authorization(object):
     @classmethod
-    def has_atat_permission(cls, user, permission):
-        return permission in user.permissions
+    def permission_snapshot(cls, user):
+        """
+        Returns the user's effective permissions as stored by the shared
+        `PermissionCache`, building and storing the snapshot on a miss.
+        """
+
+        def _resolve():
+            permission_cache = _shared_permission_cache(user)
+            snapshot = None
+            if permission_cache:
+                version = permission_cache.version(user.id)
+                snapshot = permission_cache.read(user.id, version)
+            if snapshot is None:
+                snapshot = cls._build_permission_snapshot(user)
+                # a snapshot built from uncommitted changes may be rolled back
+                if permission_cache and not has_permission_changes(db.session):
+                    permission_cache.write(user.id, snapshot, version)
+
+            return snapshot
+
+        return _memoize(("snapshot", user.id), _resolve)
 
     @classmethod
-    def has_portfolio_permission(cls, user, portfolio, permission):
-        if Authorization.has_atat_permission(user, permission):
-            return True
+    def _load_role_graph(cls, user):
+        """
+        Loads the user's permission sets and roles in a fixed number of
+        queries instead of lazy-loading the permission sets of every role.
+        """
+        if user.id is None:
+            return
 
-        port_role = first_or_none(
-            lambda pr: pr.portfolio == portfolio, user.portfolio_roles
-        )
-        if port_role and port_role.status is not PortfolioRoleStatus.DISABLED:
-            return permission in port_role.permissions
-        else:
-            return False
+        db.session.query(User).options(
+            selectinload(User.permission_sets),
+            selectinload(User.portfolio_roles).selectinload(
+                PortfolioRole.permission_sets
+            ),
+            selectinload(User.application_roles).selectinload(
+                ApplicationRole.permission_sets
+            ),
+        ).filter(User.id == user.id).all()
 
     @classmethod
-    def has_application_permission(cls, user, application, permission):
-        if Authorization.has_portfolio_permission(
-            user, application.portfolio, permission
-        ):
-            return True
+    def _build_permission_snapshot(cls, user):
+        cls._load_role_graph(user)
+        return {
+            "atat": sorted(set(user.permissions)),
+            "portfolios": {
+                str(port_role.portfolio_id): sorted(set(port_role.permissions))
+                for port_role in user.portfolio_roles
+                if port_role.status is not PortfolioRoleStatus.DISABLED
+            },
+            "applications": {
+                str(app_role.application_id): sorted(set(app_role.permissions))
+                for app_role in user.application_roles
+                if app_role.status is not ApplicationRoleStatus.DISABLED
+            },
+        }
 
-        app_role = first_or_none(
-            lambda app_role: app_role.application == application, user.application_roles
+    @classmethod
+    def atat_permissions(cls, user):
+        return _memoize(
+            ("atat", user.id), lambda: frozenset(cls.permission_snapshot(user)["atat"]),
         )
-        if app_role and app_role.status is not ApplicationRoleStatus.DISABLED:
-            return permission in app_role.permissions
-        else:
-            return False
+
+    @classmethod
+    def portfolio_permissions(cls, user, portfolio):
+        return cls._portfolio_permissions(user, portfolio.id)
+
+    @classmethod
+    def _portfolio_permissions(cls, user, portfolio_id):
+        def _resolve():
+            role_permissions = cls.permission_snapshot(user)["portfolios"].get(
+                str(portfolio_id), []
+            )
+            return cls.atat_permissions(user).union(role_permissions)
+
+        return _memoize(("portfolio", user.id, portfolio_id), _resolve)
+
+    @classmethod
+    def application_permissions(cls, user, application):
+        def _resolve():
+            role_permissions = cls.permission_snapshot(user)["applications"].get(
+                str(application.id), []
+            )
+            return cls._portfolio_permissions(user, application.portfolio_id).union(
+                role_permissions
+            )
+
+        return _memoize(("application", user.id, application.id), _resolve)
+
+    @classmethod
+    def has_atat_permission(cls, user, permission):
+        return permission in Authorization.atat_permissions(user)
+
+    @classmethod
+    def has_portfolio_permission(cls, user, portfolio, permission):
+        return permission in Authorization.portfolio_permissions(user, portfolio)
+
+    @classmethod
+    def has_application_permission(cls, user, application, permission):
+        return permission in Authorization.application_permissions(user, application)
 
     @classmethod
     def check_atat_permission(cls, user, permission, message):
@@ -1,3 +1,8 @@
+import base64
+from datetime import datetime
+from uuid import UUID
+
+from sqlalchemy import tuple_
 from sqlalchemy.exc import DataError
 from sqlalchemy.orm.exc import NoResultFound
 
@@ -45,6 +50,102 @@ class Paginator(object):
         return self.items.__len__()
 
 
+class KeysetPaginator(object):
+    """
+    Paginates a query set newest first by its `(time_created, id)` keyset.
+
+    Instead of a page number, a page is requested with the cursor of the row
+    it comes after (older rows) or before (newer rows), so that every page
+    is one indexed range scan however deep it is, and the query set is never
+    counted. The rows are ordered by id as well as time_created because the
+    rows created in one transaction share their time_created.
+
+    Also acts as a proxy object so that the results can be iterated over
+    without needing to call `.items`.
+    """
+
+    def __init__(self, items, per_page, has_next, has_prev):
+        self.items = items
+        self.per_page = per_page
+        self.has_next = has_next
+        self.has_prev = has_prev
+
+    @classmethod
+    def get_pagination_opts(cls, request, default_per_page=100):
+        return {
+            "after": request.args.get("after"),
+            "before": request.args.get("before"),
+            "per_page": int(request.args.get("perPage", default_per_page)),
+        }
+
+    @classmethod
+    def paginate(cls, query, model, pagination_opts=None):
+        keyset = tuple_(model.time_created, model.id)
+        newest_first = [model.time_created.desc(), model.id.desc()]
+        if pagination_opts is None:
+            return query.order_by(*newest_first).all()
+
+        per_page = pagination_opts["per_page"]
+        before = cls.decode_cursor(pagination_opts.get("before"))
+        after = cls.decode_cursor(pagination_opts.get("after"))
+
+        if before is not None:
+            items = (
+                query.filter(keyset > tuple_(*before))
+                .order_by(model.time_created, model.id)
+                .limit(per_page + 1)
+                .all()
+            )
+            if len(items) <= per_page:
+                # There is less than a page of newer rows, so show the
+                # first page in full instead.
+                return cls.paginate(query, model, {"per_page": per_page})
+            return cls(list(reversed(items[:per_page])), per_page, True, True)
+
+        if after is not None:
+            query = query.filter(keyset < tuple_(*after))
+        items = query.order_by(*newest_first).limit(per_page + 1).all()
+        return cls(items[:per_page], per_page, len(items) > per_page, after is not None)
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.items:
+            return self.encode_cursor(self.items[-1])
+
+    @property
+    def prev_cursor(self):
+        if self.has_prev and self.items:
+            return self.encode_cursor(self.items[0])
+
+    @staticmethod
+    def encode_cursor(row):
+        keyset = "{} {}".format(row.time_created.isoformat(), row.id)
+        return base64.urlsafe_b64encode(keyset.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """
+        The `(time_created, id)` of a cursor, or None if there is no cursor
+        or it is malformed, in which case the first page is shown.
+        """
+        if not cursor:
+            return None
+
+        try:
+            time_created, id_ = (
+                base64.urlsafe_b64decode(cursor.encode()).decode().split(" ")
+            )
+            return (datetime.fromisoformat(time_created), UUID(id_))
+        except ValueError:
+            return None
+
+    def __iter__(self):
+        return self.items.__iter__()
+
+    def __len__(self):
+        return self.items.__len__()
+
+
 class Query(object):
 
     model = None
@@ -79,3 +180,7 @@ class Query(object):
     @classmethod
     def paginate(cls, query, pagination_opts):
         return Paginator.paginate(query, pagination_opts)
+
+    @classmethod
+    def paginate_by_keyset(cls, query, pagination_opts):
+        return KeysetPaginator.paginate(query, cls.model, pagination_opts)
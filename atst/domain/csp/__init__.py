@@ -1,6 +1,7 @@
 from .cloud import MockCloudProvider
 from .file_uploads import AzureUploader, MockUploader
 from .reports import MockReportingProvider
+from .throttle import ThrottledCloudProvider
 
 
 class MockCSP:
@@ -29,3 +30,14 @@ def make_csp_provider(app, csp=None):
         app.csp = MockCSP(app, test_mode=True)
     else:
         app.csp = MockCSP(app)
+
+    app.csp.cloud = ThrottledCloudProvider(
+        app.csp.cloud,
+        app.redis,
+        csp or "mock",
+        max_concurrency=app.config.get("CSP_MAX_CONCURRENCY"),
+        rate=app.config.get("CSP_RATE_LIMIT"),
+        burst=app.config.get("CSP_RATE_BURST"),
+        failure_threshold=app.config.get("CSP_CIRCUIT_FAILURE_THRESHOLD"),
+        cooldown=app.config.get("CSP_CIRCUIT_COOLDOWN"),
+    )
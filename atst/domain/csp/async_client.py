@@ -0,0 +1,246 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .cloud import (
+    AZURE_ROLE_DEFINITION_IDS,
+    AuthenticationException,
+    AuthorizationException,
+    ConnectionException,
+    GeneralCSPException,
+    UnknownServerException,
+)
+
+
+AZURE_AUTHORITY_URL = "https://login.microsoftonline.com"
+AZURE_MANAGEMENT_URL = "https://management.azure.com"
+AZURE_GRAPH_URL = "https://graph.windows.net"
+
+
+class OAuthTokenCache(object):
+    """
+    Caches client-credential OAuth tokens per resource and reuses them until
+    shortly before they expire. Concurrent requests for the same resource
+    wait for a single token request.
+    """
+
+    def __init__(self, fetch_token, expiry_margin=300, clock=time.time):
+        self._fetch_token = fetch_token
+        self._expiry_margin = expiry_margin
+        self._clock = clock
+        self._tokens = {}
+        self._locks = {}
+        self._loop = None
+
+    async def get(self, resource):
+        token = self._cached(resource)
+        if token:
+            return token
+
+        # The tokens outlive the event loop, but the locks can't be shared
+        # between loops.
+        loop = asyncio.get_event_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._locks = {}
+
+        lock = self._locks.setdefault(resource, asyncio.Lock())
+        async with lock:
+            token = self._cached(resource)
+            if token:
+                return token
+
+            access_token, expires_in = await self._fetch_token(resource)
+            self._tokens[resource] = (access_token, self._clock() + expires_in)
+            return access_token
+
+    def _cached(self, resource):
+        token, expires_at = self._tokens.get(resource, (None, 0))
+        if token and self._clock() < expires_at - self._expiry_margin:
+            return token
+
+
+class AsyncAzureClient(object):
+    """
+    An asyncio client for the Azure REST endpoints that provisioning uses.
+
+    Every request goes through one `requests` session, whose connection pool
+    holds up to `pool_size` keep-alive connections, and is run on a thread
+    pool of the same size so that the event loop is never blocked. OAuth
+    tokens are fetched once per resource and cached until they expire.
+    """
+
+    def __init__(
+        self,
+        tenant_id,
+        client_id,
+        secret_key,
+        pool_size=10,
+        timeout=30,
+        authority_url=AZURE_AUTHORITY_URL,
+        management_url=AZURE_MANAGEMENT_URL,
+        graph_url=AZURE_GRAPH_URL,
+    ):
+        self.tenant_id = tenant_id
+        self.client_id = client_id
+        self.secret_key = secret_key
+        self.timeout = timeout
+        self.authority_url = authority_url
+        self.management_url = management_url
+        self.graph_url = graph_url
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size)
+        self.tokens = OAuthTokenCache(self._fetch_token)
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        return cls(
+            config["AZURE_TENANT_ID"],
+            config["AZURE_CLIENT_ID"],
+            config["AZURE_SECRET_KEY"],
+            **kwargs,
+        )
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+    async def create_user(self, display_name):
+        user = await self.request(
+            "POST",
+            self.graph_url,
+            "/{}/users?api-version=1.6".format(self.tenant_id),
+            json={
+                "accountEnabled": True,
+                "displayName": display_name,
+                "mailNickname": "?",  # needs to be unique in the tenant
+                "userPrincipalName": "?",  # depends on the tenant's domain
+                "passwordProfile": "?",
+            },
+        )
+        return user["objectId"]
+
+    async def create_role_assignment(
+        self, subscription_id, principal_id, role_definition_id
+    ):
+        return await self.request(
+            "PUT",
+            self.management_url,
+            "/subscriptions/{}/providers/Microsoft.Authorization/roleAssignments/{}"
+            "?api-version=2015-07-01".format(subscription_id, uuid4()),
+            json={
+                "properties": {
+                    "roleDefinitionId": role_definition_id,
+                    "principalId": principal_id,
+                }
+            },
+        )
+
+    async def create_or_update_user(
+        self, subscription_id, environment_role, on_user_created=None
+    ):
+        """
+        Creates the environment role's user if it has none and assigns it the
+        role. `on_user_created`, if given, is called with the new user's id
+        as soon as the user is created, so that the caller has it even if the
+        role assignment fails.
+        """
+        csp_user_id = environment_role.csp_user_id
+        if not csp_user_id:
+            csp_user_id = await self.create_user(
+                environment_role.application_role.user_name
+            )
+            if on_user_created is not None:
+                on_user_created(csp_user_id)
+
+        await self.create_role_assignment(
+            subscription_id,
+            csp_user_id,
+            AZURE_ROLE_DEFINITION_IDS.get(environment_role.role, "?"),
+        )
+        return csp_user_id
+
+    async def request(self, method, base_url, path, json=None):
+        token = await self.tokens.get(base_url)
+        response = await self._send(
+            method,
+            base_url + path,
+            json=json,
+            headers={"Authorization": "Bearer {}".format(token)},
+        )
+        return response.json() if response.content else None
+
+    async def _fetch_token(self, resource):
+        response = await self._send(
+            "POST",
+            "{}/{}/oauth2/token".format(self.authority_url, self.tenant_id),
+            data={
+                "grant_type": "client_credentials",
+                "client_id": self.client_id,
+                "client_secret": self.secret_key,
+                "resource": resource,
+            },
+        )
+        body = response.json()
+        return (body["access_token"], int(body["expires_in"]))
+
+    async def _send(self, method, url, **kwargs):
+        loop = asyncio.get_event_loop()
+        try:
+            response = await loop.run_in_executor(
+                self._executor,
+                lambda: self.session.request(
+                    method, url, timeout=self.timeout, **kwargs
+                ),
+            )
+        except (requests.ConnectionError, requests.Timeout) as err:
+            raise ConnectionException(str(err))
+
+        if response.status_code == 401:
+            raise AuthenticationException(response.text)
+        elif response.status_code == 403:
+            raise AuthorizationException(response.text)
+        elif response.status_code >= 500:
+            raise UnknownServerException(response.text)
+        elif response.status_code >= 400:
+            raise GeneralCSPException(response.text)
+
+        return response
+
+
+class AsyncJobRunner(object):
+    """
+    Runs many CSP operations concurrently from one process, with at most
+    `concurrency` of them in progress at once.
+    """
+
+    def __init__(self, concurrency=10):
+        self.concurrency = concurrency
+
+    def run(self, operations):
+        """
+        Runs the operations, which are functions that return coroutines, and
+        returns their results in order. An operation that failed has its
+        exception as its result, so that one failure does not cancel the
+        others.
+        """
+        return asyncio.run(self._run(operations))
+
+    async def _run(self, operations):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def limited(operation):
+            async with semaphore:
+                return await operation()
+
+        return await asyncio.gather(
+            *[limited(operation) for operation in operations], return_exceptions=True
+        )
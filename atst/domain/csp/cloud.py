@@ -1,4 +1,5 @@
-from typing import Dict
+from functools import partial
+from typing import Dict, List
 import re
 from uuid import uuid4
 
@@ -109,6 +110,26 @@ class UserProvisioningException(GeneralCSPException):
         )
 
 
+class PartialUserProvisioningException(GeneralCSPException):
+    """Some of a batch of environment roles were provisioned before `error`
+    stopped the batch. For each role, in order, `csp_user_ids` has the
+    csp_user_id of the role's user if it exists in the CSP, or None, and
+    `provisioned` has whether the role was fully provisioned.
+    """
+
+    def __init__(self, error, csp_user_ids, provisioned):
+        super().__init__(error)
+        self.error = error
+        self.csp_user_ids = csp_user_ids
+        self.provisioned = provisioned
+
+    @property
+    def message(self):
+        return "{} of {} users were provisioned: {}".format(
+            sum(self.provisioned), len(self.provisioned), self.error
+        )
+
+
 class UserRemovalException(GeneralCSPException):
     """Failed to remove a user
     """
@@ -140,7 +161,28 @@ class BaselineProvisionException(GeneralCSPException):
         )
 
 
+def _raise_partial(error, csp_user_ids, provisioned, environment_roles):
+    """
+    Re-raises an error that stopped a batch of environment roles, with the
+    progress made on the batch if any. The first `provisioned` roles were
+    provisioned, and users exist for the first `len(csp_user_ids)` roles.
+    """
+    if not csp_user_ids:
+        raise error
+
+    remaining = len(environment_roles) - len(csp_user_ids)
+    raise PartialUserProvisioningException(
+        error,
+        csp_user_ids + [None] * remaining,
+        [index < provisioned for index in range(len(environment_roles))],
+    ) from error
+
+
 class CloudProviderInterface:
+    # The most CSP calls that create_or_update_users can usefully have in
+    # progress at once.
+    batch_concurrency = 1
+
     def root_creds(self) -> Dict:
         raise NotImplementedError()
 
@@ -216,6 +258,50 @@ class CloudProviderInterface:
         """
         raise NotImplementedError()
 
+    def create_or_update_users(
+        self,
+        auth_credentials: Dict,
+        environment_roles: List[EnvironmentRole],
+        concurrency: int = 1,
+    ) -> List[str]:
+        """Creates users or updates existing users' roles for many roles in one
+        environment. Providers that can batch these calls should override this.
+
+        Arguments:
+            auth_credentials -- Object containing CSP account credentials
+            environment_roles -- EnvironmentRoles that all belong to the same
+                                 environment. Each role's `role` is the role the
+                                 user should be given in the CSP.
+            concurrency -- The most CSP calls to have in progress at once.
+                           Providers that make their calls one at a time
+                           ignore it.
+
+        Returns:
+            list: The internal csp_user_ids of the created/updated user accounts,
+                  in the same order as the environment roles
+
+        Raises:
+            AuthenticationException: Problem with the credentials
+            AuthorizationException: Credentials not authorized for current action(s)
+            ConnectionException: Issue with the CSP API connection
+            UnknownServerException: Unknown issue on the CSP side
+            UserProvisioningException: A user couldn't be created or modified
+            PartialUserProvisioningException: Some of the roles were provisioned
+                                              before one of the errors above
+        """
+        csp_user_ids = []
+        try:
+            for environment_role in environment_roles:
+                csp_user_ids.append(
+                    self.create_or_update_user(
+                        auth_credentials, environment_role, environment_role.role
+                    )
+                )
+        except Exception as err:
+            _raise_partial(err, csp_user_ids, len(csp_user_ids), environment_roles)
+
+        return csp_user_ids
+
     def disable_user(self, auth_credentials: Dict, csp_user_id: str) -> bool:
         """Revoke all privileges for a user. Used to prevent user access while a full
         delete is being processed.
@@ -341,6 +427,33 @@ class MockCloudProvider(CloudProviderInterface):
         self._maybe_raise(self.UNAUTHORIZED_RATE, self.AUTHORIZATION_EXCEPTION)
         return self._id()
 
+    def create_or_update_users(
+        self, auth_credentials, environment_roles, concurrency=1
+    ):
+        self._authorize(auth_credentials)
+
+        self._delay(1, 5)
+        self._maybe_raise(self.NETWORK_FAILURE_PCT, self.NETWORK_EXCEPTION)
+        self._maybe_raise(self.SERVER_FAILURE_PCT, self.SERVER_EXCEPTION)
+        self._maybe_raise(self.UNAUTHORIZED_RATE, self.AUTHORIZATION_EXCEPTION)
+
+        csp_user_ids = []
+        try:
+            for environment_role in environment_roles:
+                self._maybe_raise(
+                    self.ATAT_ADMIN_CREATE_FAILURE_PCT,
+                    UserProvisioningException(
+                        environment_role.environment.id,
+                        environment_role.application_role.user_id,
+                        "Could not create user.",
+                    ),
+                )
+                csp_user_ids.append(environment_role.csp_user_id or self._id())
+        except UserProvisioningException as err:
+            _raise_partial(err, csp_user_ids, len(csp_user_ids), environment_roles)
+
+        return csp_user_ids
+
     def disable_user(self, auth_credentials, csp_user_id):
         self._authorize(auth_credentials)
         self._maybe_raise(self.NETWORK_FAILURE_PCT, self.NETWORK_EXCEPTION)
@@ -396,6 +509,9 @@ SUBSCRIPTION_ID_REGEX = re.compile(
 # This needs to be a fully pathed role definition identifier, not just a UUID
 REMOTE_ROOT_ROLE_DEF_ID = "/providers/Microsoft.Authorization/roleDefinitions/00000000-0000-4000-8000-000000000000"
 
+# The role definitions that ATAT's CSP roles map to. TBD
+AZURE_ROLE_DEFINITION_IDS = {}
+
 
 class AzureSDKProvider(object):
     def __init__(self):
@@ -413,8 +529,17 @@ class AzureSDKProvider(object):
 
 
 class AzureCloudProvider(CloudProviderInterface):
-    def __init__(self, config, azure_sdk_provider=None):
+    def __init__(
+        self, config, azure_sdk_provider=None, async_client=None, batch_concurrency=10
+    ):
         self.config = config
+        # An AsyncAzureClient. It is opt-in: batch operations are run
+        # concurrently with it, up to `batch_concurrency` calls at once, only
+        # when one is given. Otherwise they are run one call at a time with
+        # the SDK clients.
+        self.async_client = async_client
+        if async_client is not None:
+            self.batch_concurrency = batch_concurrency
 
         self.client_id = config["AZURE_CLIENT_ID"]
         self.secret_key = config["AZURE_SECRET_KEY"]
@@ -502,7 +627,104 @@ class AzureCloudProvider(CloudProviderInterface):
             "role_name": role_assignment_id,
         }
 
-    def _get_management_service_principal(self):
+    def create_or_update_user(
+        self, auth_credentials: Dict, user_info: EnvironmentRole, csp_role_id: str
+    ) -> str:
+        return self.create_or_update_users(auth_credentials, [user_info])[0]
+
+    def create_or_update_users(
+        self,
+        auth_credentials: Dict,
+        environment_roles: List[EnvironmentRole],
+        concurrency: int = 1,
+    ) -> List[str]:
+        if not environment_roles:
+            return []
+
+        if self.async_client is not None:
+            return self._create_or_update_users_concurrently(
+                environment_roles, concurrency
+            )
+
+        # All of the roles share one set of clients scoped to the environment's
+        # subscription.
+        subscription_id = environment_roles[0].environment.cloud_id
+        credentials = self._get_credential_obj(self._root_creds)
+        auth_client = self.sdk.authorization.AuthorizationManagementClient(
+            credentials, subscription_id
+        )
+        graph_client = self._get_graph_client()
+
+        # A user is created before its role is assigned, so a failure can
+        # leave the last user created but not provisioned.
+        csp_user_ids = []
+        provisioned = 0
+        try:
+            for environment_role in environment_roles:
+                csp_user_ids.append(
+                    environment_role.csp_user_id
+                    or self._create_user(graph_client, environment_role)
+                )
+
+                role_assignment_create_params = auth_client.role_assignments.models.RoleAssignmentCreateParameters(
+                    role_definition_id=AZURE_ROLE_DEFINITION_IDS.get(
+                        environment_role.role, "?"
+                    ),
+                    principal_id=csp_user_ids[-1],
+                )
+                auth_client.role_assignments.create(
+                    scope=f"/subscriptions/{subscription_id}/",
+                    role_assignment_name=str(uuid4()),
+                    parameters=role_assignment_create_params,
+                )
+                provisioned += 1
+        except Exception as err:
+            _raise_partial(err, csp_user_ids, provisioned, environment_roles)
+
+        return csp_user_ids
+
+    def _create_or_update_users_concurrently(self, environment_roles, concurrency):
+        from .async_client import AsyncJobRunner
+
+        subscription_id = environment_roles[0].environment.cloud_id
+        # Users are recorded as soon as they are created, so that a user whose
+        # role assignment fails is not lost.
+        csp_user_ids = [role.csp_user_id for role in environment_roles]
+        results = AsyncJobRunner(concurrency).run(
+            [
+                partial(
+                    self.async_client.create_or_update_user,
+                    subscription_id,
+                    environment_role,
+                    on_user_created=partial(csp_user_ids.__setitem__, index),
+                )
+                for index, environment_role in enumerate(environment_roles)
+            ]
+        )
+        errors = [result for result in results if isinstance(result, Exception)]
+        if not errors:
+            return csp_user_ids
+        if not any(csp_user_ids):
+            raise errors[0]
+
+        raise PartialUserProvisioningException(
+            errors[0],
+            csp_user_ids,
+            [not isinstance(result, Exception) for result in results],
+        ) from errors[0]
+
+    def _create_user(self, graph_client, environment_role):
+        user_create_params = self.sdk.graphrbac.models.UserCreateParameters(
+            account_enabled=True,
+            display_name=environment_role.application_role.user_name,
+            mail_nickname="?",  # needs to be unique in the tenant
+            user_principal_name="?",  # depends on the tenant's domain
+            password_profile="?",
+        )
+        user = graph_client.users.create(user_create_params)
+        return user.object_id
+
+    def _get_graph_client(self):
         # we really should be using graph.microsoft.com, but i'm getting
         # "expired token" errors for that
         # graph_resource = "https://graph.microsoft.com"
@@ -515,10 +737,13 @@ class AzureCloudProvider(CloudProviderInterface):
 
         # how do we scope the graph client to the new subscription rather than
         # the cloud0 subscription? tenant id seems to be separate from subscription id
-        graph_client = self.sdk.graphrbac.GraphRbacManagementClient(
+        return self.sdk.graphrbac.GraphRbacManagementClient(
             graph_creds, self._root_creds.get("tenant_id")
         )
 
+    def _get_management_service_principal(self):
+        graph_client = self._get_graph_client()
+
         # do we need to create a new application to manage each subscripition
         # or should we manage access to each subscription from a single service
         # principal with multiple role assignments?
@@ -0,0 +1,298 @@
+import random
+import time
+from uuid import uuid4
+
+from .cloud import (
+    AuthenticationException,
+    AuthorizationException,
+    ConnectionException,
+    GeneralCSPException,
+    PartialUserProvisioningException,
+    UnknownServerException,
+)
+
+
+class ThrottledException(GeneralCSPException):
+    """A CSP call was not made because the CSP is being throttled. The call
+    can be retried after `retry_after` seconds.
+    """
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def message(self):
+        return "The CSP call was throttled: {}".format(self.reason)
+
+
+class RateLimitedException(ThrottledException):
+    pass
+
+
+class ConcurrencyLimitedException(ThrottledException):
+    pass
+
+
+class CircuitOpenException(ThrottledException):
+    pass
+
+
+# (base, cap) in seconds of the exponential backoff for each kind of failure.
+# The first matching class wins, so subclasses must come before their parents.
+RETRY_BACKOFF = [
+    (ConnectionException, (5, 300)),
+    (UnknownServerException, (15, 600)),
+    (AuthenticationException, (60, 3600)),
+    (AuthorizationException, (60, 3600)),
+]
+DEFAULT_RETRY_BACKOFF = (10, 600)
+
+
+def retry_countdown(exc, retries, random=random):
+    """
+    The number of seconds to wait before retrying a CSP call that raised
+    `exc` for the `retries` time. Throttled calls wait until the throttle
+    allows them. Other failures back off exponentially, with a base and cap
+    that depend on the kind of failure. Half of the delay is random, so that
+    workers that failed together do not retry together.
+    """
+    if isinstance(exc, ThrottledException):
+        return exc.retry_after + random.uniform(0, max(exc.retry_after, 1))
+
+    base, cap = next(
+        (backoff for cls, backoff in RETRY_BACKOFF if isinstance(exc, cls)),
+        DEFAULT_RETRY_BACKOFF,
+    )
+    delay = min(cap, base * 2 ** retries)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+# Refills the bucket for the time since it was last used, then takes as many
+# of the tokens asked for as there are. Returns the number of tokens taken
+# and, if none were, how long to wait for one.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local wanted = tonumber(ARGV[4])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "timestamp")
+local tokens = tonumber(bucket[1]) or capacity
+local timestamp = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - timestamp) * rate)
+local taken = math.min(wanted, math.floor(tokens))
+local wait = 0
+if taken >= 1 then
+    tokens = tokens - taken
+else
+    wait = (1 - tokens) / rate
+end
+redis.call("HMSET", KEYS[1], "tokens", tostring(tokens), "timestamp", ARGV[3])
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate) + 1)
+return {taken, tostring(wait)}
+"""
+
+# Drops the slots whose holders have expired, then takes a slot if fewer than
+# the limit are held.
+ACQUIRE_SLOT_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local now = tonumber(ARGV[2])
+local expires_in = tonumber(ARGV[3])
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", now)
+if redis.call("ZCARD", KEYS[1]) < limit then
+    redis.call("ZADD", KEYS[1], now + expires_in, ARGV[4])
+    redis.call("EXPIRE", KEYS[1], math.ceil(expires_in))
+    return 1
+end
+return 0
+"""
+
+
+class ThrottledCloudProvider(object):
+    """
+    Wraps a CloudProviderInterface so that every worker calling the same CSP
+    shares, through Redis:
+
+    - a cap on the number of CSP calls in progress at once,
+    - a token bucket limiting the rate of CSP calls,
+    - a circuit breaker that opens after `failure_threshold` connection or
+      server failures within `failure_window` seconds. While it is open,
+      calls fail immediately and the provisioning dispatchers pause.
+
+    Calls that are throttled raise a ThrottledException instead of being
+    made. A batch of user provisioning takes a token for each role in it.
+    Other methods are passed through to the wrapped provider.
+    """
+
+    THROTTLED_METHODS = {
+        "create_environment",
+        "create_atat_admin_user",
+        "create_or_update_user",
+        "disable_user",
+    }
+    CIRCUIT_BREAKING_EXCEPTIONS = (ConnectionException, UnknownServerException)
+
+    def __init__(
+        self,
+        provider,
+        redis,
+        name,
+        max_concurrency=10,
+        rate=5,
+        burst=10,
+        failure_threshold=5,
+        failure_window=60,
+        cooldown=120,
+        call_timeout=300,
+    ):
+        self.provider = provider
+        self.redis = redis
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = burst
+        self.failure_threshold = failure_threshold
+        self.failure_window = failure_window
+        self.cooldown = cooldown
+        self.call_timeout = call_timeout
+        self._take_token = redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self._acquire_slot = redis.register_script(ACQUIRE_SLOT_SCRIPT)
+
+    def __getattr__(self, name):
+        attr = getattr(self.provider, name)
+        if name not in self.THROTTLED_METHODS:
+            return attr
+
+        def throttled(*args, **kwargs):
+            return self._call(attr, *args, **kwargs)
+
+        return throttled
+
+    @property
+    def circuit_open(self):
+        return bool(self.redis.exists(self._key("circuit")))
+
+    def create_or_update_users(self, auth_credentials, environment_roles):
+        """
+        Provisions as many of the environment roles as there are tokens for.
+        The wrapped provider makes CSP calls for each role, so each role takes
+        a token. A provider that can make its calls concurrently is given a
+        slot for each call it may have in progress, up to its
+        `batch_concurrency`. If there were not enough tokens for every role,
+        the roles that were provisioned are reported in a
+        PartialUserProvisioningException whose error is a
+        RateLimitedException.
+        """
+        if not environment_roles:
+            return []
+
+        self._check_circuit()
+        slots = [self._check_concurrency()]
+        try:
+            allowed = self._check_rate(len(environment_roles))
+            slots += self._acquire_more_slots(
+                min(allowed, self.provider.batch_concurrency) - 1
+            )
+            csp_user_ids = self.provider.create_or_update_users(
+                auth_credentials, environment_roles[:allowed], concurrency=len(slots)
+            )
+        except PartialUserProvisioningException as err:
+            if isinstance(err.error, self.CIRCUIT_BREAKING_EXCEPTIONS):
+                self._record_failure()
+            raise self._pad_partial(err, environment_roles) from err.error
+        except self.CIRCUIT_BREAKING_EXCEPTIONS:
+            self._record_failure()
+            raise
+        finally:
+            self.redis.zrem(self._key("slots"), *slots)
+
+        self.redis.delete(self._key("failures"))
+        if allowed < len(environment_roles):
+            remaining = len(environment_roles) - allowed
+            raise self._pad_partial(
+                PartialUserProvisioningException(
+                    RateLimitedException(
+                        "the rate limit was reached",
+                        min(remaining, self.burst) / self.rate,
+                    ),
+                    csp_user_ids,
+                    [True] * allowed,
+                ),
+                environment_roles,
+            )
+
+        return csp_user_ids
+
+    def _pad_partial(self, err, environment_roles):
+        remaining = len(environment_roles) - len(err.provisioned)
+        return PartialUserProvisioningException(
+            err.error,
+            err.csp_user_ids + [None] * remaining,
+            err.provisioned + [False] * remaining,
+        )
+
+    def _call(self, method, *args, **kwargs):
+        self._check_circuit()
+        # Take a slot before a token, so that a call turned away for lack of
+        # a slot does not use up a token.
+        slot = self._check_concurrency()
+        try:
+            self._check_rate()
+            result = method(*args, **kwargs)
+        except self.CIRCUIT_BREAKING_EXCEPTIONS:
+            self._record_failure()
+            raise
+        finally:
+            self.redis.zrem(self._key("slots"), slot)
+
+        self.redis.delete(self._key("failures"))
+        return result
+
+    def _check_circuit(self):
+        ttl = self.redis.ttl(self._key("circuit"))
+        if ttl is not None and ttl > 0:
+            raise CircuitOpenException("the circuit is open", ttl)
+
+    def _check_rate(self, tokens=1):
+        taken, wait = self._take_token(
+            keys=[self._key("tokens")],
+            args=[self.rate, self.burst, time.time(), tokens],
+        )
+        if not taken:
+            raise RateLimitedException("the rate limit was reached", float(wait))
+
+        return taken
+
+    def _check_concurrency(self):
+        slot = uuid4().hex
+        if not self._acquire_slot(
+            keys=[self._key("slots")],
+            args=[self.max_concurrency, time.time(), self.call_timeout, slot],
+        ):
+            raise ConcurrencyLimitedException("too many calls are in progress", 1)
+
+        return slot
+
+    def _acquire_more_slots(self, count):
+        """Takes up to `count` more slots, as many as are free."""
+        slots = []
+        for _ in range(count):
+            try:
+                slots.append(self._check_concurrency())
+            except ConcurrencyLimitedException:
+                break
+
+        return slots
+
+    def _record_failure(self):
+        failures = self.redis.incr(self._key("failures"))
+        if failures == 1:
+            self.redis.expire(self._key("failures"), self.failure_window)
+
+        if failures >= self.failure_threshold:
+            self.redis.setex(self._key("circuit"), self.cooldown, "open")
+            self.redis.delete(self._key("failures"))
+
+    def _key(self, name):
+        return "csp_throttle:{}:{}".format(self.name, name)
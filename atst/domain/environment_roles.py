@@ -90,16 +90,25 @@ class EnvironmentRoles(object):
         )
 
     @classmethod
-    def get_environment_roles_pending_creation(cls) -> List[UUID]:
-        results = (
+    def pending_creation_query(cls):
+        return (
             db.session.query(EnvironmentRole.id)
             .join(Environment)
             .join(ApplicationRole)
             .filter(Environment.deleted == False)
             .filter(EnvironmentRole.status == EnvironmentRole.Status.PENDING)
             .filter(ApplicationRole.status == ApplicationRoleStatus.ACTIVE)
-            .all()
         )
+
+    @classmethod
+    def get_environment_roles_pending_creation(cls, environment_ids=None) -> List[UUID]:
+        query = cls.pending_creation_query()
+        if environment_ids is not None:
+            query = query.filter(EnvironmentRole.environment_id.in_(environment_ids))
+
+        # Keep the roles of an environment together, so that they are
+        # dispatched in the same chunks and provisioned in one batch.
+        results = query.order_by(EnvironmentRole.environment_id).all()
         return [id_ for id_, in results]
 
     @classmethod
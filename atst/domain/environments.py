@@ -1,3 +1,4 @@
+from flask import current_app as app
 from sqlalchemy import func, or_
 from sqlalchemy.orm.exc import NoResultFound
 from typing import List
@@ -22,6 +23,9 @@ class Environments(object):
         environment = Environment(application=application, name=name, creator=user)
         db.session.add(environment)
         db.session.commit()
+
+        app.provisioning_queue.create_environments([environment.id])
+
         return environment
 
     @classmethod
@@ -77,6 +81,9 @@ class Environments(object):
 
         db.session.commit()
 
+        if env_role and new_role:
+            app.provisioning_queue.provision_users([env_role.id])
+
     @classmethod
     def revoke_access(cls, environment, target_user):
         EnvironmentRoles.delete(environment.id, target_user.id)
@@ -116,14 +123,37 @@ class Environments(object):
             )
         )
 
+    @classmethod
+    def pending_creation_query(cls, now):
+        return cls.base_provision_query(now).filter(Environment.cloud_id == None)
+
+    @classmethod
+    def pending_atat_user_creation_query(cls, now):
+        return (
+            cls.base_provision_query(now)
+            .filter(Environment.cloud_id != None)
+            .filter(Environment.root_user_info == None)
+        )
+
+    @classmethod
+    def get_environments_pending_creation_for_portfolio(
+        cls, now, portfolio_id
+    ) -> List[UUID]:
+        results = (
+            cls.pending_creation_query(now)
+            .filter(Application.portfolio_id == portfolio_id)
+            .distinct()
+            .all()
+        )
+        return [id_ for id_, in results]
+
     @classmethod
     def get_environments_pending_creation(cls, now) -> List[UUID]:
         """
         Any environment with an active CLIN that doesn't yet have a `cloud_id`.
         """
-        results = (
-            cls.base_provision_query(now).filter(Environment.cloud_id == None).all()
-        )
+        # An environment is joined once for each of its active CLINs.
+        results = cls.pending_creation_query(now).distinct().all()
         return [id_ for id_, in results]
 
     @classmethod
@@ -131,9 +161,5 @@ class Environments(object):
         """
         Any environment with an active CLIN that has a cloud_id but no `root_user_info`.
         """
-        results = (
-            cls.base_provision_query(now)
-            .filter(Environment.cloud_id != None)
-            .filter(Environment.root_user_info == None)
-        ).all()
+        results = cls.pending_atat_user_creation_query(now).distinct().all()
         return [id_ for id_, in results]
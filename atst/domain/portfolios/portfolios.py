@@ -1,14 +1,35 @@
+from collections import namedtuple
+from itertools import chain
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
 from atst.database import db
 from atst.domain.permission_sets import PermissionSets
 from atst.domain.authz import Authorization
 from atst.domain.portfolio_roles import PortfolioRoles
 from atst.domain.invitations import PortfolioInvitations
-from atst.models import Permissions, PortfolioRole, PortfolioRoleStatus
+from atst.models import Permissions, Portfolio, PortfolioRole, PortfolioRoleStatus
+from atst.utils.permission_cache import has_portfolio_changes, mark_portfolios_changed
 
 from .query import PortfoliosQuery
 from .scopes import ScopedPortfolio
 
 
+PortfolioSummary = namedtuple("PortfolioSummary", ["id", "name"])
+
+SIDEBAR_PAGE_SIZE = 100
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_portfolio_lists_changed(session, _flush_context):
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Portfolio):
+            mark_portfolios_changed(session)
+            return
+
+
 class PortfolioError(Exception):
     pass
 
@@ -65,6 +86,56 @@ class Portfolios(object):
             portfolios = PortfoliosQuery.get_for_user(user)
         return portfolios
 
+    @classmethod
+    def for_sidebar(cls, user, page=1):
+        """
+        Returns the portfolios to list in the user's sidebar as
+        `PortfolioSummary` tuples, and whether there are more to show. Users
+        who can view every portfolio get them a page at a time. The lists are
+        cached in the app's `PortfolioListCache`.
+        """
+        if Authorization.has_atat_permission(user, Permissions.VIEW_PORTFOLIO):
+            cache_key = "all:{}".format(page)
+
+            def _load():
+                summaries = PortfoliosQuery.get_summaries(
+                    offset=(page - 1) * SIDEBAR_PAGE_SIZE, limit=SIDEBAR_PAGE_SIZE + 1
+                )
+                return (
+                    summaries[:SIDEBAR_PAGE_SIZE],
+                    len(summaries) > SIDEBAR_PAGE_SIZE,
+                )
+
+        else:
+            cache_key = user.id
+
+            def _load():
+                return (PortfoliosQuery.get_summaries_for_user(user), False)
+
+        portfolio_list_cache = (
+            getattr(current_app, "portfolio_list_cache", None)
+            if has_app_context()
+            else None
+        )
+        cached = None
+        if portfolio_list_cache:
+            version = portfolio_list_cache.version(cache_key)
+            cached = portfolio_list_cache.read(cache_key, version)
+        if cached is None:
+            summaries, has_next = _load()
+            cached = {
+                "portfolios": [[str(id_), name] for (id_, name) in summaries],
+                "has_next": has_next,
+            }
+            # a list loaded from uncommitted changes may be rolled back
+            if portfolio_list_cache and not has_portfolio_changes(db.session):
+                portfolio_list_cache.write(cache_key, cached, version)
+
+        return (
+            [PortfolioSummary(*summary) for summary in cached["portfolios"]],
+            cached["has_next"],
+        )
+
     @classmethod
     def add_member(cls, portfolio, member, permission_sets=None):
         portfolio_role = PortfolioRoles.add(member, portfolio.id, permission_sets)
@@ -1,4 +1,4 @@
-from sqlalchemy import or_
+from sqlalchemy import union
 from atst.database import db
 from atst.domain.common import Query
 from atst.models.portfolio import Portfolio
@@ -15,45 +15,58 @@ class PortfoliosQuery(Query):
 
     @classmethod
     def get_for_user(cls, user):
+        return cls._for_user(user, Portfolio).all()
+
+    @classmethod
+    def get_summaries_for_user(cls, user):
+        return cls._for_user(user, Portfolio.id, Portfolio.name).all()
+
+    @classmethod
+    def get_summaries(cls, offset, limit):
         return (
-            db.session.query(Portfolio)
-            .filter(
-                or_(
-                    Portfolio.id.in_(
-                        db.session.query(Portfolio.id)
-                        .join(Application)
-                        .filter(Portfolio.id == Application.portfolio_id)
-                        .filter(
-                            Application.id.in_(
-                                db.session.query(Application.id)
-                                .join(ApplicationRole)
-                                .filter(
-                                    ApplicationRole.application_id == Application.id
-                                )
-                                .filter(ApplicationRole.user_id == user.id)
-                                .filter(
-                                    ApplicationRole.status
-                                    == ApplicationRoleStatus.ACTIVE
-                                )
-                                .filter(ApplicationRole.deleted == False)
-                                .subquery()
-                            )
-                        )
-                    ),
-                    Portfolio.id.in_(
-                        db.session.query(Portfolio.id)
-                        .join(PortfolioRole)
-                        .filter(PortfolioRole.user == user)
-                        .filter(PortfolioRole.status == PortfolioRoleStatus.ACTIVE)
-                        .subquery()
-                    ),
-                )
-            )
+            db.session.query(Portfolio.id, Portfolio.name)
             .filter(Portfolio.deleted == False)
-            .order_by(Portfolio.name.asc())
+            .order_by(Portfolio.name.asc(), Portfolio.id.asc())
+            .offset(offset)
+            .limit(limit)
             .all()
         )
 
+    @classmethod
+    def portfolio_ids_for_user(cls, user):
+        """
+        The ids of the portfolios the user has an active role in, either
+        directly or through one of the portfolio's applications, as a UNION of
+        two joins that are each served by an index on the role's user id.
+        """
+        portfolio_role_ids = (
+            db.session.query(PortfolioRole.portfolio_id.label("portfolio_id"))
+            .filter(PortfolioRole.user_id == user.id)
+            .filter(PortfolioRole.status == PortfolioRoleStatus.ACTIVE)
+        )
+        application_role_ids = (
+            db.session.query(Application.portfolio_id.label("portfolio_id"))
+            .join(ApplicationRole, ApplicationRole.application_id == Application.id)
+            .filter(ApplicationRole.user_id == user.id)
+            .filter(ApplicationRole.status == ApplicationRoleStatus.ACTIVE)
+            .filter(ApplicationRole.deleted == False)
+        )
+
+        return union(
+            portfolio_role_ids.statement, application_role_ids.statement
+        ).alias("user_portfolio_ids")
+
+    @classmethod
+    def _for_user(cls, user, *entities):
+        portfolio_ids = cls.portfolio_ids_for_user(user)
+        return (
+            db.session.query(*entities)
+            .select_from(Portfolio)
+            .join(portfolio_ids, portfolio_ids.c.portfolio_id == Portfolio.id)
+            .filter(Portfolio.deleted == False)
+            .order_by(Portfolio.name.asc())
+        )
+
     @classmethod
     def create_portfolio_role(cls, user, portfolio, **kwargs):
         return PortfolioRole(user=user, portfolio=portfolio, **kwargs)
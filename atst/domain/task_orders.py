@@ -1,6 +1,8 @@
 import datetime
+from flask import current_app as app
 
 from atst.database import db
+from atst.domain.environments import Environments
 from atst.models.clin import CLIN
 from atst.models.task_order import TaskOrder, SORT_ORDERING
 from . import BaseDomainClass
@@ -46,6 +48,12 @@ class TaskOrders(BaseDomainClass):
         db.session.add(task_order)
         db.session.commit()
 
+        app.provisioning_queue.create_environments(
+            Environments.get_environments_pending_creation_for_portfolio(
+                datetime.datetime.now(), task_order.portfolio_id
+            )
+        )
+
         return task_order
 
     @classmethod
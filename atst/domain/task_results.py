@@ -0,0 +1,66 @@
+from celery import states
+from sqlalchemy import and_, exists, select
+from sqlalchemy.sql import column, table
+
+from atst.database import db
+from atst.models import EnvironmentJobFailure, EnvironmentRoleJobFailure
+
+
+# The result table that Celery's database backend creates and manages itself.
+celery_taskmeta = table(
+    "celery_taskmeta",
+    column("id"),
+    column("task_id"),
+    column("status"),
+    column("date_done"),
+)
+
+
+class TaskResults(object):
+    FAILURE_MODELS = [EnvironmentJobFailure, EnvironmentRoleJobFailure]
+
+    @classmethod
+    def expired_query(cls, cutoff):
+        """
+        Finished task results from before the cutoff, except for the ones that
+        a job failure links to.
+        """
+        return (
+            select([celery_taskmeta.c.id])
+            .where(celery_taskmeta.c.date_done < cutoff)
+            .where(celery_taskmeta.c.status.in_(states.READY_STATES))
+            .where(
+                and_(
+                    *[
+                        ~exists().where(Model.task_id == celery_taskmeta.c.task_id)
+                        for Model in cls.FAILURE_MODELS
+                    ]
+                )
+            )
+        )
+
+    @classmethod
+    def delete_expired(cls, cutoff, batch_size=1000):
+        """
+        Deletes the expired task results in batches of `batch_size`, committing
+        after each batch so that no lock is held for longer than one batch.
+        Rows that another transaction has locked are skipped and left for the
+        next run.
+
+        Returns the number of deleted results.
+        """
+        deleted = 0
+        while True:
+            batch = (
+                cls.expired_query(cutoff)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            result = db.session.execute(
+                celery_taskmeta.delete().where(celery_taskmeta.c.id.in_(batch))
+            )
+            db.session.commit()
+
+            deleted += result.rowcount
+            if result.rowcount < batch_size:
+                return deleted
@@ -1,38 +1,116 @@
+from celery import states
+from celery.exceptions import Retry
 from flask import current_app as app
 import pendulum
+from sqlalchemy.orm import joinedload
 
 from atst.database import db
-from atst.queue import celery
+from atst.queue import celery, queue_names
 from atst.models import (
+    Environment,
     EnvironmentJobFailure,
     EnvironmentRoleJobFailure,
     EnvironmentRole,
 )
-from atst.domain.csp.cloud import CloudProviderInterface, GeneralCSPException
+from atst.domain.csp.cloud import (
+    CloudProviderInterface,
+    GeneralCSPException,
+    PartialUserProvisioningException,
+)
+from atst.domain.csp.throttle import ThrottledException, retry_countdown
 from atst.domain.environments import Environments
 from atst.domain.environment_roles import EnvironmentRoles
-from atst.models.utils import claim_for_update
+from atst.domain.task_results import TaskResults
+from atst.models.utils import claim_for_update, claim_many_for_update
+from atst.utils import chunks
 from atst.utils.localization import translate
+from atst.utils.provisioning_queue import ProvisioningQueue
+
+
+def _task_ids(kwargs, key):
+    if kwargs.get(key) is not None:
+        return [kwargs[key]]
+    else:
+        return kwargs.get("{}s".format(key)) or []
+
+
+class ReleaseInFlight(celery.Task):
+    """
+    Releases the resources a task was given from the in-flight registry once
+    the task stops running. Tasks set `in_flight` to the task type they are
+    registered under and the name of their id keyword argument.
+    """
+
+    in_flight = None
+
+    def after_return(self, status, retval, task_id, args, kwargs, einfo):
+        # A pending retry is still in flight.
+        if self.in_flight is not None and status != states.RETRY:
+            task_type, key = self.in_flight
+            app.in_flight_registry.release(task_type, _task_ids(kwargs, key))
 
 
-class RecordEnvironmentFailure(celery.Task):
+class RecordEnvironmentFailure(ReleaseInFlight):
+    """
+    Records a job failure for each environment the task was given. Tasks
+    registered under a provisioning step only record failures for the
+    environments that the step had not finished, so that a chunk that fails
+    part of the way through does not record failures for the environments it
+    provisioned.
+    """
+
+    # The environments that each step has not finished.
+    UNFINISHED = {
+        ProvisioningQueue.CREATE_ENVIRONMENT: Environment.cloud_id == None,
+        ProvisioningQueue.CREATE_ATAT_ADMIN_USER: Environment.root_user_info == None,
+    }
+
     def on_failure(self, exc, task_id, args, kwargs, einfo):
-        if "environment_id" in kwargs:
+        environment_ids = _task_ids(kwargs, "environment_id")
+        if self.in_flight is not None and environment_ids:
+            environment_ids = _ids_matching(
+                Environment, environment_ids, self.UNFINISHED[self.in_flight[0]]
+            )
+
+        for environment_id in environment_ids:
             failure = EnvironmentJobFailure(
-                environment_id=kwargs["environment_id"], task_id=task_id
+                environment_id=environment_id, task_id=task_id
             )
             db.session.add(failure)
-            db.session.commit()
+        db.session.commit()
+
 
+class RecordEnvironmentRoleFailure(ReleaseInFlight):
+    """
+    Records a job failure for each environment role the task was given that
+    is still pending.
+    """
 
-class RecordEnvironmentRoleFailure(celery.Task):
     def on_failure(self, exc, task_id, args, kwargs, einfo):
-        if "environment_role_id" in kwargs:
+        environment_role_ids = _task_ids(kwargs, "environment_role_id")
+        if self.in_flight is not None and environment_role_ids:
+            environment_role_ids = _ids_matching(
+                EnvironmentRole,
+                environment_role_ids,
+                EnvironmentRole.status == EnvironmentRole.Status.PENDING,
+            )
+
+        for environment_role_id in environment_role_ids:
             failure = EnvironmentRoleJobFailure(
-                environment_role_id=kwargs["environment_role_id"], task_id=task_id
+                environment_role_id=environment_role_id, task_id=task_id
             )
             db.session.add(failure)
-            db.session.commit()
+        db.session.commit()
+
+
+def _ids_matching(Model, ids, criterion):
+    return [
+        id_
+        for id_, in db.session.query(Model.id)
+        .filter(Model.id.in_(ids))
+        .filter(criterion)
+        .all()
+    ]
 
 
 @celery.task(ignore_result=True)
@@ -40,6 +118,44 @@ def send_mail(recipients, subject, body):
     app.mailer.send(recipients, subject, body)
 
 
+@celery.task(ignore_result=True)
+def compact_task_results():
+    cutoff = pendulum.now().subtract(
+        days=app.config.get("CELERY_RESULT_RETENTION_DAYS")
+    )
+    deleted = TaskResults.delete_expired(
+        cutoff, batch_size=app.config.get("CELERY_RESULT_DELETE_BATCH_SIZE")
+    )
+    app.logger.info(
+        "Deleted {} task results from before {}".format(deleted, cutoff),
+        extra={"tags": ["queue"]},
+    )
+
+
+@celery.task(ignore_result=True)
+def flush_error_notifications():
+    app.error_notifier.flush()
+
+
+@celery.task(ignore_result=True)
+def record_queue_metrics():
+    for queue in queue_names(app.config.get("CELERY_DEFAULT_QUEUE")):
+        summary = app.queue_metrics.summary(queue)
+        app.logger.info(
+            "Queue {}: {} tasks waiting, recent waits p50 {} p99 {}".format(
+                queue,
+                summary["depth"],
+                _format_wait(summary["wait_p50"]),
+                _format_wait(summary["wait_p99"]),
+            ),
+            extra={"tags": ["queue", "metrics"]},
+        )
+
+
+def _format_wait(seconds):
+    return "n/a" if seconds is None else "{:.2f}s".format(seconds)
+
+
 @celery.task(ignore_result=True)
 def send_notification_mail(recipients, subject, body):
     app.logger.info(
@@ -50,119 +166,374 @@ def send_notification_mail(recipients, subject, body):
     app.mailer.send(recipients, subject, body)
 
 
-def do_create_environment(csp: CloudProviderInterface, environment_id=None):
-    environment = Environments.get(environment_id)
+def _claim_query(Model, ids, pending_query):
+    # Given ids are still filtered by the pending query, so a resource that
+    # was enqueued more than once, or that the reconciler already picked up,
+    # is not provisioned twice.
+    if ids is None:
+        return pending_query
+    else:
+        return pending_query.filter(Model.id.in_(ids))
 
-    with claim_for_update(environment) as environment:
 
-        if environment.cloud_id is not None:
-            # TODO: Return value for this?
-            return
+def _create_environment(csp: CloudProviderInterface, environment, atat_root_creds):
+    if environment.cloud_id is not None:
+        # TODO: Return value for this?
+        return
 
-        user = environment.creator
+    user = environment.creator
 
-        # we'll need to do some checking in this job for cases where it's retrying
-        # when a failure occured after some successful steps
-        # (e.g. if environment.cloud_id is not None, then we can skip first step)
+    # we'll need to do some checking in this job for cases where it's retrying
+    # when a failure occured after some successful steps
+    # (e.g. if environment.cloud_id is not None, then we can skip first step)
 
+    # user is needed because baseline root account in the environment will
+    # be assigned to the requesting user, open question how to handle duplicate
+    # email addresses across new environments
+    csp_environment_id = csp.create_environment(atat_root_creds, user, environment)
+    environment.cloud_id = csp_environment_id
+    db.session.add(environment)
+    db.session.commit()
+
+    body = render_email(
+        "emails/application/environment_ready.txt", {"environment": environment}
+    )
+    app.mailer.send(
+        [environment.creator.email], translate("email.environment_ready"), body
+    )
+
+
+def do_create_environment(csp: CloudProviderInterface, environment_id=None):
+    environment = Environments.get(environment_id)
+
+    with claim_for_update(environment) as environment:
         # credentials either from a given user or pulled from config?
         # if using global creds, do we need to log what user authorized action?
-        atat_root_creds = csp.root_creds()
-
-        # user is needed because baseline root account in the environment will
-        # be assigned to the requesting user, open question how to handle duplicate
-        # email addresses across new environments
-        csp_environment_id = csp.create_environment(atat_root_creds, user, environment)
-        environment.cloud_id = csp_environment_id
-        db.session.add(environment)
-        db.session.commit()
-
-        body = render_email(
-            "emails/application/environment_ready.txt", {"environment": environment}
-        )
-        app.mailer.send(
-            [environment.creator.email], translate("email.environment_ready"), body
-        )
+        _create_environment(csp, environment, csp.root_creds())
+
+    # The next step skips claimed environments, so it is only enqueued once
+    # the claim is released.
+    app.provisioning_queue.create_atat_admin_users([environment_id])
+
+
+def do_create_environments(
+    csp: CloudProviderInterface, environment_ids=None, limit=None
+):
+    """
+    Creates the given environments, or up to `limit` of the environments
+    pending creation if no ids are given. Environments that another worker has
+    claimed are skipped. The environments are claimed and loaded together and
+    share one lookup of the root credentials.
+    """
+    query = _claim_query(
+        Environment,
+        environment_ids,
+        Environments.pending_creation_query(pendulum.now()),
+    )
+    created = []
+    try:
+        with claim_many_for_update(
+            query, limit=limit, options=[joinedload(Environment.creator)]
+        ) as environments:
+            if not environments:
+                return
+
+            atat_root_creds = csp.root_creds()
+            for environment in environments:
+                _create_environment(csp, environment, atat_root_creds)
+                created.append(environment.id)
+    finally:
+        # The next step skips claimed environments, so it is only enqueued
+        # once the claims are released.
+        if created:
+            app.provisioning_queue.create_atat_admin_users(created)
+
+
+def _create_atat_admin_user(csp: CloudProviderInterface, environment, atat_root_creds):
+    atat_remote_root_user = csp.create_atat_admin_user(
+        atat_root_creds, environment.cloud_id
+    )
+    environment.root_user_info = atat_remote_root_user
+    db.session.add(environment)
+    db.session.commit()
 
 
 def do_create_atat_admin_user(csp: CloudProviderInterface, environment_id=None):
     environment = Environments.get(environment_id)
 
     with claim_for_update(environment) as environment:
-        atat_root_creds = csp.root_creds()
+        _create_atat_admin_user(csp, environment, csp.root_creds())
 
-        atat_remote_root_user = csp.create_atat_admin_user(
-            atat_root_creds, environment.cloud_id
+    app.provisioning_queue.provision_users(
+        EnvironmentRoles.get_environment_roles_pending_creation(
+            environment_ids=[environment_id]
         )
-        environment.root_user_info = atat_remote_root_user
-        db.session.add(environment)
-        db.session.commit()
+    )
+
+
+def do_create_atat_admin_users(
+    csp: CloudProviderInterface, environment_ids=None, limit=None
+):
+    """
+    Creates the ATAT admin user for the given environments, or for up to
+    `limit` of the environments pending one if no ids are given. Environments
+    that another worker has claimed are skipped. The environments share one
+    lookup of the root credentials.
+    """
+    query = _claim_query(
+        Environment,
+        environment_ids,
+        Environments.pending_atat_user_creation_query(pendulum.now()),
+    )
+    created = []
+    try:
+        with claim_many_for_update(query, limit=limit) as environments:
+            if not environments:
+                return
+
+            atat_root_creds = csp.root_creds()
+            for environment in environments:
+                _create_atat_admin_user(csp, environment, atat_root_creds)
+                created.append(environment.id)
+    finally:
+        if created:
+            app.provisioning_queue.provision_users(
+                EnvironmentRoles.get_environment_roles_pending_creation(
+                    environment_ids=created
+                )
+            )
 
 
 def render_email(template_path, context):
     return app.jinja_env.get_template(template_path).render(context)
 
 
+def _provision_user(csp: CloudProviderInterface, environment_role, credentials):
+    csp_user_id = csp.create_or_update_user(
+        credentials, environment_role, environment_role.role
+    )
+    environment_role.csp_user_id = csp_user_id
+    environment_role.status = EnvironmentRole.Status.COMPLETED
+    db.session.add(environment_role)
+    db.session.commit()
+
+
 def do_provision_user(csp: CloudProviderInterface, environment_role_id=None):
     environment_role = EnvironmentRoles.get_by_id(environment_role_id)
 
     with claim_for_update(environment_role) as environment_role:
-        credentials = environment_role.environment.csp_credentials
+        _provision_user(
+            csp, environment_role, environment_role.environment.csp_credentials
+        )
 
-        csp_user_id = csp.create_or_update_user(
-            credentials, environment_role, environment_role.role
+
+def _provision_users(csp: CloudProviderInterface, environment, environment_roles):
+    """
+    Provisions a batch of environment roles. If the batch fails part of the
+    way through, the progress made is saved before the error is raised, so
+    that a retry does not provision those roles or create their users again.
+    """
+    error = None
+    try:
+        csp_user_ids = csp.create_or_update_users(
+            environment.csp_credentials, environment_roles
         )
-        environment_role.csp_user_id = csp_user_id
-        environment_role.status = EnvironmentRole.Status.COMPLETED
+        provisioned = [True] * len(environment_roles)
+    except PartialUserProvisioningException as err:
+        error = err.error
+        csp_user_ids, provisioned = err.csp_user_ids, err.provisioned
+
+    for environment_role, csp_user_id, done in zip(
+        environment_roles, csp_user_ids, provisioned
+    ):
+        if csp_user_id:
+            environment_role.csp_user_id = csp_user_id
+        if done:
+            environment_role.status = EnvironmentRole.Status.COMPLETED
         db.session.add(environment_role)
-        db.session.commit()
+    db.session.commit()
+
+    if error is not None:
+        raise error
+
+
+def do_provision_users(
+    csp: CloudProviderInterface, environment_role_ids=None, limit=None
+):
+    """
+    Provisions the given environment roles, or up to `limit` of the
+    environment roles pending creation if no ids are given. Environment roles
+    that another worker has claimed are skipped. The roles are grouped by
+    environment and each group is provisioned with one batch call to the CSP.
+    """
+    query = _claim_query(
+        EnvironmentRole,
+        environment_role_ids,
+        EnvironmentRoles.pending_creation_query(),
+    )
+    with claim_many_for_update(
+        query, limit=limit, options=[joinedload(EnvironmentRole.environment)]
+    ) as environment_roles:
+        by_environment = {}
+        for environment_role in environment_roles:
+            by_environment.setdefault(environment_role.environment, []).append(
+                environment_role
+            )
+
+        for environment, roles in by_environment.items():
+            _provision_users(csp, environment, roles)
 
 
 def do_work(fn, task, csp, **kwargs):
     try:
         fn(csp, **kwargs)
+    except ThrottledException as e:
+        _retry_throttled(task, e)
     except GeneralCSPException as e:
-        raise task.retry(exc=e)
+        raise task.retry(exc=e, countdown=retry_countdown(e, task.request.retries))
+
+
+def _retry_throttled(task, exc):
+    """
+    Retries a task whose CSP call was throttled. Being throttled is not a CSP
+    failure, so the task is sent again with the same retry count instead of
+    using up one of the retries that are kept for CSP errors.
+    """
+    countdown = retry_countdown(exc, task.request.retries)
+    if task.request.is_eager:
+        # There is no broker to send an eager task to.
+        raise task.retry(exc=exc, countdown=countdown, max_retries=None)
+
+    task.apply_async(
+        args=task.request.args,
+        kwargs=task.request.kwargs,
+        countdown=countdown,
+        retries=task.request.retries,
+    )
+    raise Retry(exc=exc, when=countdown)
 
 
-@celery.task(bind=True, base=RecordEnvironmentFailure)
+@celery.task(
+    bind=True,
+    ignore_result=True,
+    base=RecordEnvironmentFailure,
+    in_flight=(ProvisioningQueue.CREATE_ENVIRONMENT, "environment_id"),
+)
 def create_environment(self, environment_id=None):
     do_work(do_create_environment, self, app.csp.cloud, environment_id=environment_id)
 
 
-@celery.task(bind=True, base=RecordEnvironmentFailure)
+@celery.task(
+    bind=True,
+    ignore_result=True,
+    base=RecordEnvironmentFailure,
+    in_flight=(ProvisioningQueue.CREATE_ATAT_ADMIN_USER, "environment_id"),
+)
 def create_atat_admin_user(self, environment_id=None):
     do_work(
         do_create_atat_admin_user, self, app.csp.cloud, environment_id=environment_id
     )
 
 
-@celery.task(bind=True)
+@celery.task(
+    bind=True,
+    ignore_result=True,
+    base=ReleaseInFlight,
+    in_flight=(ProvisioningQueue.PROVISION_USER, "environment_role_id"),
+)
 def provision_user(self, environment_role_id=None):
     do_work(
         do_provision_user, self, app.csp.cloud, environment_role_id=environment_role_id
     )
 
 
-@celery.task(bind=True)
+@celery.task(
+    bind=True,
+    ignore_result=True,
+    base=RecordEnvironmentFailure,
+    in_flight=(ProvisioningQueue.CREATE_ENVIRONMENT, "environment_id"),
+)
+def create_environments(self, environment_ids=None):
+    do_work(
+        do_create_environments, self, app.csp.cloud, environment_ids=environment_ids
+    )
+
+
+@celery.task(
+    bind=True,
+    ignore_result=True,
+    base=RecordEnvironmentFailure,
+    in_flight=(ProvisioningQueue.CREATE_ATAT_ADMIN_USER, "environment_id"),
+)
+def create_atat_admin_users(self, environment_ids=None):
+    do_work(
+        do_create_atat_admin_users, self, app.csp.cloud, environment_ids=environment_ids
+    )
+
+
+@celery.task(
+    bind=True,
+    ignore_result=True,
+    base=RecordEnvironmentRoleFailure,
+    in_flight=(ProvisioningQueue.PROVISION_USER, "environment_role_id"),
+)
+def provision_users(self, environment_role_ids=None):
+    do_work(
+        do_provision_users,
+        self,
+        app.csp.cloud,
+        environment_role_ids=environment_role_ids,
+    )
+
+
+def _dispatch(task_type, ids):
+    """
+    Registers the ids as in flight for the task type and returns the ones
+    that do not already have a job queued or running, split into chunks of
+    PROVISIONING_CHUNK_SIZE ids. Nothing is dispatched while the CSP circuit
+    breaker is open.
+    """
+    if getattr(app.csp.cloud, "circuit_open", False):
+        app.logger.info(
+            "Not dispatching {} jobs while the CSP circuit is open".format(task_type),
+            extra={"tags": ["provisioning"]},
+        )
+        return []
+
+    ids = list(dict.fromkeys(ids))
+    registered = app.in_flight_registry.register(task_type, ids)
+    dropped = len(ids) - len(registered)
+    if dropped:
+        app.logger.info(
+            "Dropped {} duplicate {} jobs".format(dropped, task_type),
+            extra={"tags": ["provisioning"]},
+        )
+
+    return chunks(registered, app.config.get("PROVISIONING_CHUNK_SIZE"))
+
+
+@celery.task(bind=True, ignore_result=True)
 def dispatch_create_environment(self):
-    for environment_id in Environments.get_environments_pending_creation(
-        pendulum.now()
+    for environment_ids in _dispatch(
+        ProvisioningQueue.CREATE_ENVIRONMENT,
+        Environments.get_environments_pending_creation(pendulum.now()),
     ):
-        create_environment.delay(environment_id=environment_id)
+        create_environments.delay(environment_ids=environment_ids)
 
 
-@celery.task(bind=True)
+@celery.task(bind=True, ignore_result=True)
 def dispatch_create_atat_admin_user(self):
-    for environment_id in Environments.get_environments_pending_atat_user_creation(
-        pendulum.now()
+    for environment_ids in _dispatch(
+        ProvisioningQueue.CREATE_ATAT_ADMIN_USER,
+        Environments.get_environments_pending_atat_user_creation(pendulum.now()),
     ):
-        create_atat_admin_user.delay(environment_id=environment_id)
+        create_atat_admin_users.delay(environment_ids=environment_ids)
 
 
-@celery.task(bind=True)
+@celery.task(bind=True, ignore_result=True)
 def dispatch_provision_user(self):
-    for (
-        environment_role_id
-    ) in EnvironmentRoles.get_environment_roles_pending_creation():
-        provision_user.delay(environment_role_id=environment_role_id)
+    for environment_role_ids in _dispatch(
+        ProvisioningQueue.PROVISION_USER,
+        EnvironmentRoles.get_environment_roles_pending_creation(),
+    ):
+        provision_users.delay(environment_role_ids=environment_role_ids)
@@ -17,7 +17,7 @@ class Application(
     name = Column(String, nullable=False)
     description = Column(String)
 
-    portfolio_id = Column(ForeignKey("portfolios.id"), nullable=False)
+    portfolio_id = Column(ForeignKey("portfolios.id"), index=True, nullable=False)
     portfolio = relationship("Portfolio")
     environments = relationship(
         "Environment",
@@ -39,6 +39,16 @@ class ApplicationInvitation(
     def event_details(self):
         return {"email": self.email, "dod_id": self.user_dod_id}
 
+    def audit_fields(self, lookup):
+        role = lookup.get("ApplicationRole", self.application_role_id, "application_id")
+        application = lookup.get("Application", role["application_id"], "portfolio_id")
+        return {
+            "portfolio_id": application["portfolio_id"],
+            "application_id": role["application_id"],
+            "display_name": self.displayname,
+            "event_details": self.event_details,
+        }
+
     @property
     def history(self):
         changes = self.get_changes()
@@ -104,6 +104,38 @@ class ApplicationRole(
             "portfolio": self.application.portfolio.name,
         }
 
+    def audit_fields(self, lookup):
+        application = lookup.get(
+            "Application", self.application_id, "name", "portfolio_id"
+        )
+        portfolio = lookup.get("Portfolio", application["portfolio_id"], "name")
+        return {
+            "portfolio_id": application["portfolio_id"],
+            "application_id": self.application_id,
+            "display_name": self.displayname,
+            "event_details": {
+                "updated_user_name": ApplicationRole.audit_user_name(lookup, self.id)
+                or self.user_name,
+                "updated_user_id": str(self.user_id),
+                "application": application["name"],
+                "portfolio": portfolio["name"],
+            },
+        }
+
+    @staticmethod
+    def audit_user_name(lookup, application_role_id):
+        """
+        The full name of the user of an application role, read through an
+        AuditLookup, or None if the role is for an invitation that has not
+        been accepted yet.
+        """
+        user_id = lookup.get("ApplicationRole", application_role_id, "user_id")[
+            "user_id"
+        ]
+        if user_id:
+            user = lookup.get("User", user_id, "first_name", "last_name")
+            return "{} {}".format(user["first_name"], user["last_name"])
+
     @property
     def is_pending(self):
         return self.status == Status.PENDING
@@ -141,6 +173,14 @@ Index(
     unique=True,
 )
 
+Index(
+    "application_role_user_status_application",
+    ApplicationRole.user_id,
+    ApplicationRole.status,
+    ApplicationRole.application_id,
+    postgresql_where=ApplicationRole.deleted == False,
+)
+
 
 listen(
     ApplicationRole.permission_sets,
@@ -1,4 +1,4 @@
-from sqlalchemy import String, Column, ForeignKey, inspect
+from sqlalchemy import String, Column, ForeignKey, Index
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 
@@ -45,12 +45,33 @@ class AuditEvent(Base, TimestampsMixin):
             "action": self.action,
         }
 
-    def save(self, connection):
-        attrs = inspect(self).dict
-
-        connection.execute(self.__table__.insert(), **attrs)
+    @classmethod
+    def insert_many(cls, connection, audit_events):
+        """
+        Inserts the audit events, which are dicts of column values with the
+        same keys, in a single statement.
+        """
+        connection.execute(cls.__table__.insert().values(audit_events))
 
     def __repr__(self):  # pragma: no cover
         return "<AuditEvent(name='{}', action='{}', id='{}')>".format(
             self.display_name, self.action, self.id
         )
+
+
+# The keysets that the audit log is paginated by, in each of its lists.
+Index("audit_events_time_created_id", AuditEvent.time_created, AuditEvent.id)
+
+Index(
+    "audit_events_portfolio_time_created_id",
+    AuditEvent.portfolio_id,
+    AuditEvent.time_created,
+    AuditEvent.id,
+)
+
+Index(
+    "audit_events_application_time_created_id",
+    AuditEvent.application_id,
+    AuditEvent.time_created,
+    AuditEvent.id,
+)
@@ -86,6 +86,15 @@ class Environment(
     def history(self):
         return self.get_changes()
 
+    def audit_fields(self, lookup):
+        application = lookup.get("Application", self.application_id, "portfolio_id")
+        return {
+            "portfolio_id": application["portfolio_id"],
+            "application_id": self.application_id,
+            "display_name": self.displayname,
+            "event_details": self.event_details,
+        }
+
     @property
     def csp_credentials(self):
         return (
@@ -4,6 +4,7 @@ from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 
 from atst.models.base import Base
+from atst.models.application_role import ApplicationRole
 import atst.models.mixins as mixins
 import atst.models.types as types
 
@@ -90,6 +91,34 @@ class EnvironmentRole(
             "portfolio_id": str(self.environment.application.portfolio.id),
         }
 
+    def audit_fields(self, lookup):
+        environment = lookup.get(
+            "Environment", self.environment_id, "name", "application_id"
+        )
+        application = lookup.get(
+            "Application", environment["application_id"], "name", "portfolio_id"
+        )
+        portfolio = lookup.get("Portfolio", application["portfolio_id"], "name")
+        return {
+            "portfolio_id": application["portfolio_id"],
+            "application_id": environment["application_id"],
+            "display_name": self.displayname,
+            "event_details": {
+                "updated_user_name": ApplicationRole.audit_user_name(
+                    lookup, self.application_role_id
+                )
+                or self.application_role.user_name,
+                "updated_application_role_id": str(self.application_role_id),
+                "role": self.role,
+                "environment": environment["name"],
+                "environment_id": str(self.environment_id),
+                "application": application["name"],
+                "application_id": str(environment["application_id"]),
+                "portfolio": portfolio["name"],
+                "portfolio_id": str(application["portfolio_id"]),
+            },
+        }
+
 
 Index(
     "environments_role_user_environment",
@@ -1,13 +1,80 @@
-from sqlalchemy import event, inspect
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.orm.util import identity_key
 from flask import g, current_app as app
 
 from atst.models.audit_event import AuditEvent
+from atst.models.base import Base
 from atst.utils import camel_to_snake, getattr_path
 
 ACTION_CREATE = "create"
 ACTION_UPDATE = "update"
 ACTION_DELETE = "delete"
 
+# The key in `Session.info` of the audit events waiting to be written.
+AUDIT_EVENT_BUFFER = "audit_events"
+
+# The key in `Session.info` of the number of audit events that were buffered
+# when each open savepoint began.
+AUDIT_EVENT_SAVEPOINTS = "audit_event_savepoints"
+
+# The key in `Session.info` of the related rows that audit events refer to.
+AUDIT_LOOKUP_CACHE = "audit_lookups"
+
+
+class AuditLookup(object):
+    """
+    Reads the names and ids of the rows that an audit event refers to, such
+    as the application and portfolio of an environment role, without lazy
+    loading the relationships between them.
+
+    A row's values are taken from the session's identity map when the row is
+    loaded, and selected otherwise. They are cached in the session until the
+    row is audited as changed, so that auditing many rows with the same
+    parents, across several commits, reads each parent only once.
+    """
+
+    def __init__(self, session, connection):
+        self.session = session
+        self.connection = connection
+        if session is None:
+            self.cache = {}
+        else:
+            self.cache = session.info.setdefault(AUDIT_LOOKUP_CACHE, {})
+
+    def get(self, model_name, id_, *keys):
+        """
+        Returns a dictionary of the values of the columns `keys` of the row
+        of the model named `model_name` whose id is `id_`.
+        """
+        if id_ is None:
+            return dict.fromkeys(keys)
+
+        values = self.cache.setdefault((model_name, id_), {})
+        missing = [key for key in keys if key not in values]
+        if missing:
+            values.update(
+                self._load(Base._decl_class_registry[model_name], id_, missing)
+            )
+        return values
+
+    def evict(self, model_name, id_):
+        self.cache.pop((model_name, id_), None)
+
+    def _load(self, Model, id_, keys):
+        if self.session is not None:
+            instance = self.session.identity_map.get(identity_key(Model, id_))
+            if instance is not None:
+                loaded = inspect(instance).dict
+                if all(key in loaded for key in keys):
+                    return {key: loaded[key] for key in keys}
+
+        table = Model.__table__
+        row = self.connection.execute(
+            select([table.c[key] for key in keys]).where(table.c.id == id_)
+        ).first()
+        return dict(zip(keys, row)) if row else dict.fromkeys(keys)
+
 
 class AuditableMixin(object):
     @staticmethod
@@ -17,16 +84,15 @@ class AuditableMixin(object):
         if changed_state is None:
             changed_state = resource.history if action == ACTION_UPDATE else None
 
+        session = object_session(resource)
+        lookup = AuditLookup(session, connection)
         log_data = {
             "user_id": user_id,
-            "portfolio_id": resource.portfolio_id,
-            "application_id": resource.application_id,
             "resource_type": resource.resource_type,
             "resource_id": resource.id,
-            "display_name": resource.displayname,
             "action": action,
             "changed_state": changed_state,
-            "event_details": resource.event_details,
+            **resource.audit_fields(lookup),
         }
 
         app.logger.info(
@@ -38,11 +104,17 @@ class AuditableMixin(object):
         )
 
         if app.config.get("USE_AUDIT_LOG", False):
-            audit_event = AuditEvent(**log_data)
-            audit_event.save(connection)
+            if session is None:
+                AuditEvent.insert_many(connection, [log_data])
+            else:
+                session.info.setdefault(AUDIT_EVENT_BUFFER, []).append(log_data)
 
     @classmethod
     def __declare_last__(cls):
+        # Evict first, so that the audit events of a changed row read its new
+        # values.
+        event.listen(cls, "after_update", cls.evict_audit_lookup)
+        event.listen(cls, "after_delete", cls.evict_audit_lookup)
         event.listen(cls, "after_insert", cls.audit_insert)
         event.listen(cls, "after_delete", cls.audit_delete)
         event.listen(cls, "after_update", cls.audit_update)
@@ -57,6 +129,16 @@ class AuditableMixin(object):
         """Listen for the `after_delete` event and create an AuditLog entry"""
         target.create_audit_event(connection, target, ACTION_DELETE)
 
+    @staticmethod
+    def evict_audit_lookup(mapper, connection, target):
+        """
+        Drops the values of a changed row from the audit lookup cache, whether
+        or not the change was audited.
+        """
+        session = object_session(target)
+        if session is not None:
+            AuditLookup(session, connection).evict(type(target).__name__, target.id)
+
     @staticmethod
     def audit_update(mapper, connection, target):
         if AuditableMixin.get_changes(target):
@@ -71,16 +153,35 @@ class AuditableMixin(object):
 
         There may be more than one item in the dictionary, but that is not expected.
         """
+        state = inspect(self)
+        column_keys = set(state.mapper.column_attrs.keys())
         previous_state = {}
-        attrs = inspect(self).mapper.column_attrs
-        for attr in attrs:
-            history = getattr(inspect(self).attrs, attr.key).history
+        # Only the attributes that were set since the last flush have their
+        # original values in `committed_state`, so there is no need to look
+        # at the history of every column.
+        for key in state.committed_state:
+            if key not in column_keys:
+                continue
+            history = state.attrs[key].history
             if history.has_changes():
-                deleted = history.deleted.pop() if history.deleted else None
-                added = history.added.pop() if history.added else None
-                previous_state[attr.key] = [deleted, added]
+                deleted = history.deleted[-1] if history.deleted else None
+                added = history.added[-1] if history.added else None
+                previous_state[key] = [deleted, added]
         return previous_state
 
+    def audit_fields(self, lookup):
+        """
+        The fields of an audit event that describe the resource. Resources
+        whose fields come from related rows override this to read them
+        through `lookup` instead of their relationships.
+        """
+        return {
+            "portfolio_id": self.portfolio_id,
+            "application_id": self.application_id,
+            "display_name": self.displayname,
+            "event_details": self.event_details,
+        }
+
     @property
     def history(self):
         return None
@@ -106,6 +207,54 @@ class AuditableMixin(object):
         return None
 
 
+@event.listens_for(Session, "before_commit")
+def write_audit_events(session):
+    """
+    Writes the audit events that the session's flushes have buffered in one
+    multi-row INSERT, instead of one INSERT per audited row.
+    """
+    # The commit only flushes after this hook, so flush here to buffer the
+    # audit events of any pending changes as well.
+    session.flush()
+
+    audit_events = session.info.pop(AUDIT_EVENT_BUFFER, None)
+    if audit_events:
+        AuditEvent.insert_many(session.connection(), audit_events)
+
+
+@event.listens_for(Session, "after_transaction_create")
+def mark_audit_event_savepoint(session, transaction):
+    if transaction.nested:
+        savepoints = session.info.setdefault(AUDIT_EVENT_SAVEPOINTS, {})
+        savepoints[transaction] = len(session.info.get(AUDIT_EVENT_BUFFER, []))
+
+
+@event.listens_for(Session, "after_transaction_end")
+def clear_audit_event_savepoint(session, transaction):
+    session.info.get(AUDIT_EVENT_SAVEPOINTS, {}).pop(transaction, None)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_audit_events(session):
+    """
+    Discards the audit events of the changes that were rolled back. Rolling
+    back a savepoint only discards the events buffered since it began.
+    """
+    session.info.pop(AUDIT_LOOKUP_CACHE, None)
+
+    # The transaction rolled back is the innermost savepoint, or the whole
+    # transaction if there is none.
+    transaction = session.transaction
+    while transaction is not None and not transaction.nested:
+        transaction = transaction.parent
+
+    mark = session.info.get(AUDIT_EVENT_SAVEPOINTS, {}).get(transaction)
+    if mark is None:
+        session.info.pop(AUDIT_EVENT_BUFFER, None)
+    else:
+        del session.info.get(AUDIT_EVENT_BUFFER, [])[mark:]
+
+
 def record_permission_sets_updates(instance_state, permission_sets, initiator):
     old_perm_sets = instance_state.attrs.get("permission_sets").value
     if instance_state.persistent and old_perm_sets != permission_sets:
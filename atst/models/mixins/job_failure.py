@@ -4,7 +4,7 @@ from sqlalchemy import Column, String, Integer
 
 class JobFailureMixin(object):
     id = Column(Integer(), primary_key=True)
-    task_id = Column(String(), nullable=False)
+    task_id = Column(String(), nullable=False, index=True)
 
     @property
     def task(self):
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String
+from sqlalchemy import Column, Index, String
 from sqlalchemy.orm import relationship
 from sqlalchemy.types import ARRAY
 from itertools import chain
@@ -148,3 +148,11 @@ class Portfolio(
         return "<Portfolio(name='{}', user_count='{}', id='{}')>".format(
             self.name, self.user_count, self.id
         )
+
+
+Index(
+    "portfolio_active_name",
+    Portfolio.name,
+    Portfolio.id,
+    postgresql_where=Portfolio.deleted == False,
+)
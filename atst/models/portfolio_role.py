@@ -150,6 +150,13 @@ Index(
     unique=True,
 )
 
+Index(
+    "portfolio_role_user_status_portfolio",
+    PortfolioRole.user_id,
+    PortfolioRole.status,
+    PortfolioRole.portfolio_id,
+)
+
 
 listen(
     PortfolioRole.permission_sets,
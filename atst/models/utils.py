@@ -1,10 +1,14 @@
-from sqlalchemy import func, sql, Interval, and_, or_
+from sqlalchemy import func, select, sql, Interval, or_
 from contextlib import contextmanager
 
 from atst.database import db
 from atst.domain.exceptions import ClaimFailedException
 
 
+def _claim_until(minutes):
+    return func.now() + func.cast(sql.functions.concat(minutes, " MINUTES"), Interval)
+
+
 @contextmanager
 def claim_for_update(resource, minutes=30):
     """
@@ -16,35 +20,81 @@ def claim_for_update(resource, minutes=30):
         minutes:    The maximum amount of time, in minutes, to hold the claim.
     """
     Model = resource.__class__
+    query = db.session.query(Model).filter(Model.id == resource.id)
 
-    claim_until = func.now() + func.cast(
-        sql.functions.concat(minutes, " MINUTES"), Interval
-    )
+    with claim_many_for_update(query, minutes=minutes) as claimed:
+        if not claimed:
+            raise ClaimFailedException(resource)
 
-    # Optimistically query for and update the resource in question. If it's
-    # already claimed, `rows_updated` will be 0 and we can give up.
-    rows_updated = (
-        db.session.query(Model)
-        .filter(
-            and_(
-                Model.id == resource.id,
-                or_(Model.claimed_until == None, Model.claimed_until <= func.now()),
-            )
-        )
-        .update({"claimed_until": claim_until}, synchronize_session="fetch")
+        # Give the resource to the caller.
+        yield claimed[0]
+
+
+@contextmanager
+def claim_many_for_update(query, limit=None, minutes=30, options=()):
+    """
+    Claim expiring holds on up to `limit` of the resources matched by a query
+    in a single statement. Resources that are already claimed, or that another
+    worker is claiming at the same moment, are skipped instead of waited on,
+    so concurrent workers each get a disjoint batch.
+
+    Args:
+        query:      A query whose first entity is a SQLAlchemy model (or one of
+                    its columns) with `id` and `claimed_until` attributes.
+        limit:      The maximum number of resources to claim. All of the
+                    matching resources are claimed if it is None.
+        minutes:    The maximum amount of time, in minutes, to hold the claims.
+        options:    Loader options, such as `joinedload`, to apply when loading
+                    the claimed resources.
+
+    Yields the list of claimed resources, which is empty if none could be
+    claimed.
+
+    The claims are committed as soon as they are made and again when they are
+    released, using the scoped session. Anything the caller had pending in
+    that session is committed with them, so callers should commit or roll
+    back their own changes before claiming.
+    """
+    Model = query.column_descriptions[0]["entity"]
+
+    # Lock the unclaimed candidates, skipping rows that are locked by another
+    # claim, and mark them as claimed. The claims are committed right away so
+    # that the row locks are released while the resources are processed.
+    # The caller's query can match a resource more than once through its
+    # joins, and can't be made DISTINCT while it is locked, so the limit and
+    # the lock apply to the model's own table, filtered by the query's ids.
+    matching = query.with_entities(Model.id).subquery()
+    candidates = (
+        db.session.query(Model.id)
+        .filter(Model.id.in_(select([matching.c.id])))
+        .filter(or_(Model.claimed_until == None, Model.claimed_until <= func.now()))
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .subquery()
     )
-    if rows_updated < 1:
-        raise ClaimFailedException(resource)
+    claimed_ids = [
+        id_
+        for id_, in db.session.execute(
+            Model.__table__.update()
+            .where(Model.id.in_(select([candidates.c.id])))
+            .values(claimed_until=_claim_until(minutes))
+            .returning(Model.id)
+        )
+    ]
+    db.session.commit()
 
-    # Fetch the claimed resource
-    claimed = db.session.query(Model).filter_by(id=resource.id).one()
+    if not claimed_ids:
+        yield []
+        return
 
     try:
-        # Give the resource to the caller.
-        yield claimed
+        # Give the resources to the caller.
+        yield db.session.query(Model).options(*options).filter(
+            Model.id.in_(claimed_ids)
+        ).all()
     finally:
-        # Release the claim.
-        db.session.query(Model).filter(Model.id == resource.id).filter(
+        # Release the claims.
+        db.session.query(Model).filter(Model.id.in_(claimed_ids)).filter(
             Model.claimed_until != None
         ).update({"claimed_until": None}, synchronize_session="fetch")
         db.session.commit()
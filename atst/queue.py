@@ -1,23 +1,121 @@
+import time
+from datetime import datetime
+
 from celery import Celery
+from celery.schedules import crontab
+from celery.signals import before_task_publish, task_prerun
+from flask import current_app as app
+from kombu import Queue
 
 
 celery = Celery(__name__)
 
+# Each class of task has its own queue, so that a backlog in one class can't
+# delay the others, and each queue can have its own pool of workers. The
+# queues are named after CELERY_DEFAULT_QUEUE, which stays the queue for
+# everything else.
+MAIL_QUEUE = "mail"
+DISPATCH_QUEUE = "dispatch"
+PROVISIONING_QUEUE = "provisioning"
+
+# The queue and priority of each task. With the Redis broker 0 is the highest
+# priority, and priorities are grouped into the steps 0, 3, 6 and 9. The later
+# provisioning steps come first, so that resources that are partly provisioned
+# are finished before new ones are started.
+TASK_ROUTES = {
+    "atst.jobs.send_mail": (MAIL_QUEUE, 0),
+    "atst.jobs.send_notification_mail": (MAIL_QUEUE, 3),
+    "atst.jobs.dispatch_*": (DISPATCH_QUEUE, 0),
+    "atst.jobs.provision_user*": (PROVISIONING_QUEUE, 0),
+    "atst.jobs.create_atat_admin_user*": (PROVISIONING_QUEUE, 3),
+    "atst.jobs.create_environment*": (PROVISIONING_QUEUE, 6),
+}
+
+
+def queue_name(default_queue, queue):
+    return "{}-{}".format(default_queue, queue)
+
+
+def queue_names(default_queue):
+    return [default_queue] + [
+        queue_name(default_queue, queue)
+        for queue in [MAIL_QUEUE, DISPATCH_QUEUE, PROVISIONING_QUEUE]
+    ]
+
+
+def task_routes(default_queue):
+    return {
+        task: {"queue": queue_name(default_queue, queue), "priority": priority}
+        for task, (queue, priority) in TASK_ROUTES.items()
+    }
+
+
+@before_task_publish.connect
+def _stamp_sent_at(headers=None, **kwargs):
+    if headers is not None:
+        headers["sent_at"] = time.time()
+
+
+@task_prerun.connect
+def _record_queue_wait(task=None, **kwargs):
+    request = task.request
+    queue = (request.delivery_info or {}).get("routing_key")
+    sent_at = getattr(request, "sent_at", None) or (request.headers or {}).get(
+        "sent_at"
+    )
+    if queue is None or sent_at is None:
+        return
+
+    # A task with an ETA, such as a retry, was not waiting on a worker until
+    # its ETA passed.
+    ready_at = sent_at
+    if request.eta:
+        ready_at = max(sent_at, _timestamp(request.eta))
+
+    app.queue_metrics.record_wait(queue, max(0, time.time() - ready_at))
+
+
+def _timestamp(eta):
+    if isinstance(eta, str):
+        eta = datetime.fromisoformat(eta)
+    return eta.timestamp()
+
 
 def update_celery(celery, app):
     celery.conf.update(app.config)
+    default_queue = app.config.get("CELERY_DEFAULT_QUEUE", "celery")
+    # Workers consume every queue unless they are given some with -Q.
+    celery.conf.CELERY_QUEUES = [
+        Queue(name, routing_key=name) for name in queue_names(default_queue)
+    ]
+    celery.conf.CELERY_ROUTES = task_routes(default_queue)
+    # Provisioning jobs are enqueued by the domain classes as soon as work is
+    # ready, so these only reconcile anything that was missed.
+    reconcile_interval = app.config.get("PROVISIONING_RECONCILE_INTERVAL", 900)
     celery.conf.CELERYBEAT_SCHEDULE = {
         "beat-dispatch_create_environment": {
             "task": "atst.jobs.dispatch_create_environment",
-            "schedule": 60,
+            "schedule": reconcile_interval,
         },
         "beat-dispatch_create_atat_admin_user": {
             "task": "atst.jobs.dispatch_create_atat_admin_user",
-            "schedule": 60,
+            "schedule": reconcile_interval,
         },
         "beat-dispatch_provision_user": {
             "task": "atst.jobs.dispatch_provision_user",
-            "schedule": 60,
+            "schedule": reconcile_interval,
+        },
+        "beat-record_queue_metrics": {
+            "task": "atst.jobs.record_queue_metrics",
+            "schedule": app.config.get("CELERY_QUEUE_METRICS_INTERVAL", 60),
+        },
+        "beat-flush_error_notifications": {
+            "task": "atst.jobs.flush_error_notifications",
+            "schedule": app.config.get("ERROR_NOTIFICATION_FLUSH_INTERVAL", 60),
+        },
+        "beat-compact_task_results": {
+            "task": "atst.jobs.compact_task_results",
+            "schedule": crontab(hour=4, minute=0),
         },
     }
 
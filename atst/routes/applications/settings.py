@@ -7,7 +7,7 @@ from atst.domain.applications import Applications
 from atst.domain.application_roles import ApplicationRoles
 from atst.domain.audit_log import AuditLog
 from atst.domain.csp.cloud import GeneralCSPException
-from atst.domain.common import Paginator
+from atst.domain.common import KeysetPaginator
 from atst.domain.environment_roles import EnvironmentRoles
 from atst.domain.invitations import ApplicationInvitations
 from atst.forms.application_member import NewForm as NewMemberForm, UpdateMemberForm
@@ -147,7 +147,7 @@ def get_new_member_form(application):
 def render_settings_page(application, **kwargs):
     environments_obj = get_environments_obj_for_app(application=application)
     new_env_form = EditEnvironmentForm()
-    pagination_opts = Paginator.get_pagination_opts(http_request)
+    pagination_opts = KeysetPaginator.get_pagination_opts(http_request)
     audit_events = AuditLog.get_application_events(application, pagination_opts)
     new_member_form = get_new_member_form(application)
     members = get_members_data(application)
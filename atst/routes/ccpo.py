@@ -8,7 +8,7 @@ from flask import (
 )
 from atst.domain.users import Users
 from atst.domain.audit_log import AuditLog
-from atst.domain.common import Paginator
+from atst.domain.common import KeysetPaginator
 from atst.domain.exceptions import NotFoundError
 from atst.domain.authz.decorator import user_can_access_decorator as user_can
 from atst.forms.ccpo_user import CCPOUserForm
@@ -25,7 +25,7 @@ bp.context_processor(atat_context_processor)
 @user_can(Permissions.VIEW_AUDIT_LOG, message="view activity log")
 def activity_history():
     if app.config.get("USE_AUDIT_LOG", False):
-        pagination_opts = Paginator.get_pagination_opts(request)
+        pagination_opts = KeysetPaginator.get_pagination_opts(request)
         audit_events = AuditLog.get_all_events(pagination_opts)
         return render_template("audit_log/audit_log.html", audit_events=audit_events)
     else:
@@ -14,6 +14,9 @@ from atst.utils.flash import formatted_flash as flash
 from atst.utils.localization import translate
 
 NO_NOTIFY_STATUS_CODES = set([404, 401])
+# Requests that did not match a route are notified under this route rather
+# than their path, so that they can't create a fingerprint for every path.
+UNMATCHED_ROUTE = "<unmatched>"
 
 
 def log_error(e):
@@ -22,8 +25,15 @@ def log_error(e):
 
 
 def notify(e, message, code):
-    if code not in NO_NOTIFY_STATUS_CODES:
-        current_app.notification_sender.send(message)
+    if code in NO_NOTIFY_STATUS_CODES:
+        return
+
+    route = request.url_rule.rule if request.url_rule else UNMATCHED_ROUTE
+    try:
+        current_app.error_notifier.notify(e, route, message)
+    except Exception:
+        # The error page must still be shown if Redis is unavailable.
+        current_app.logger.exception("Could not send an error notification")
 
 
 def handle_error(e, message=translate("errors.not_found"), code=404):
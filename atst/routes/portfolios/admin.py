@@ -7,7 +7,7 @@ from atst.models.portfolio_role import Status as PortfolioRoleStatus
 from atst.domain.invitations import PortfolioInvitations
 from atst.domain.permission_sets import PermissionSets
 from atst.domain.audit_log import AuditLog
-from atst.domain.common import Paginator
+from atst.domain.common import KeysetPaginator
 from atst.forms.portfolio import PortfolioForm
 import atst.forms.portfolio_member as member_forms
 from atst.models.permissions import Permissions
@@ -65,7 +65,7 @@ def get_members_data(portfolio):
 
 
 def render_admin_page(portfolio, form=None):
-    pagination_opts = Paginator.get_pagination_opts(http_request)
+    pagination_opts = KeysetPaginator.get_pagination_opts(http_request)
     audit_events = AuditLog.get_portfolio_events(portfolio, pagination_opts)
     members_data = get_members_data(portfolio)
     portfolio_form = PortfolioForm(data={"name": portfolio.name})
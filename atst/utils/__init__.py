@@ -23,3 +23,8 @@ def camel_to_snake(camel_cased):
 def pick(keys, dct):
     _keys = set(keys)
     return {k: v for (k, v) in dct.items() if k in _keys}
+
+
+def chunks(lst, size):
+    lst = list(lst)
+    return [lst[start : start + size] for start in range(0, len(lst), size)]
@@ -5,6 +5,7 @@ from atst.database import db
 from atst.domain.authz import Authorization
 from atst.domain.exceptions import NotFoundError
 from atst.domain.portfolios.scopes import ScopedPortfolio
+from atst.domain.users import Users
 from atst.models import (
     Application,
     Environment,
@@ -13,10 +14,11 @@ from atst.models import (
     PortfolioInvitation,
     PortfolioRole,
     TaskOrder,
+    User,
 )
 
 
-def get_resources_from_context(view_args):
+def _resources_query(view_args):
     query = None
 
     if "portfolio_token" in view_args:
@@ -57,6 +59,12 @@ def get_resources_from_context(view_args):
             .filter(TaskOrder.id == view_args["task_order_id"])
         )
 
+    return query
+
+
+def get_resources_from_context(view_args):
+    query = _resources_query(view_args)
+
     if query:
         try:
             return query.only_return_tuples(True).one()
@@ -64,12 +72,39 @@ def get_resources_from_context(view_args):
             raise NotFoundError("portfolio")
 
 
+def get_user_and_resources_from_context(user_id, view_args):
+    """
+    Loads the current user together with the resources named in the view
+    args in a single query. If the resources do not exist, only the user is
+    returned and the resources are left for `assign_resources` to look up,
+    so that the usual not-found error is raised there.
+    """
+    query = _resources_query(view_args or {})
+    if query is None:
+        return (Users.get(user_id), ())
+
+    try:
+        *resources, user = (
+            query.add_entity(User)
+            .filter(User.id == user_id)
+            .only_return_tuples(True)
+            .one()
+        )
+    except NoResultFound:
+        return (Users.get(user_id), None)
+
+    return (user, tuple(resources))
+
+
 def assign_resources(view_args):
     g.portfolio = None
     g.application = None
     g.task_order = None
 
-    resources = get_resources_from_context(view_args)
+    resources = getattr(g, "request_resources", None)
+    if resources is None:
+        resources = get_resources_from_context(view_args)
+
     if resources:
         for resource in resources:
             if isinstance(resource, Portfolio):
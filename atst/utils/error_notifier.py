@@ -0,0 +1,103 @@
+from hashlib import sha256
+import json
+
+from flask import current_app as app
+
+
+class ErrorNotifier(object):
+    """
+    Aggregates error notifications so that an incident does not send an
+    email for every failed request. Errors are fingerprinted by their type
+    and route and counted in Redis. The first error of a fingerprint is
+    notified right away and after that at most one notification is sent per
+    fingerprint every `window` seconds, with the number of errors since the
+    last one. `flush` notifies the errors counted during windows that have
+    since closed, and is run periodically so that the last errors of an
+    incident are notified even if no error follows them. Errors that are not
+    notified before their count expires, after `count_expiry_seconds`, are
+    only in the logs.
+    """
+
+    def __init__(
+        self, redis, window=300, count_expiry_seconds=86400, key_prefix="errors"
+    ):
+        self.redis = redis
+        self.window = window
+        self.count_expiry_seconds = count_expiry_seconds
+        self.key_prefix = key_prefix
+
+    def notify(self, error, route, message):
+        fingerprint = self.fingerprint(error, route)
+        count_key = self._key(fingerprint, "count")
+
+        pipeline = self.redis.pipeline()
+        pipeline.incr(count_key)
+        pipeline.expire(count_key, self.count_expiry_seconds)
+        pipeline.hset(
+            self._pending_key,
+            fingerprint,
+            json.dumps([type(error).__name__, route, message]),
+        )
+        pipeline.expire(self._pending_key, self.count_expiry_seconds)
+        pipeline.set(self._key(fingerprint, "notified"), "1", nx=True, ex=self.window)
+        *_, due = pipeline.execute()
+        if not due:
+            return
+
+        # A flush or another process may have notified the count already.
+        count = int(self.redis.getset(count_key, 0) or 0)
+        if count:
+            app.notification_sender.send(
+                self._digest(type(error).__name__, route, message, count)
+            )
+
+    def flush(self):
+        """
+        Notifies the errors that were counted after the last notification of
+        their fingerprint, once that notification's window has closed.
+        """
+        for fingerprint, details in self.redis.hgetall(self._pending_key).items():
+            fingerprint = fingerprint.decode()
+            count_key = self._key(fingerprint, "count")
+            if not int(self.redis.get(count_key) or 0):
+                # Nothing to notify. Starting a window now would hold back the
+                # notification of the next error.
+                self.redis.hdel(self._pending_key, fingerprint)
+                continue
+
+            if not self.redis.set(
+                self._key(fingerprint, "notified"), "1", nx=True, ex=self.window
+            ):
+                continue
+
+            count = int(self.redis.getset(count_key, 0) or 0)
+            if count:
+                error_type, route, message = json.loads(details)
+                app.notification_sender.send(
+                    self._digest(error_type, route, message, count)
+                )
+
+    def fingerprint(self, error, route):
+        error_type = "{}.{}".format(type(error).__module__, type(error).__qualname__)
+        return sha256("{}:{}".format(error_type, route).encode()).hexdigest()[:16]
+
+    def _digest(self, error_type, route, message, count):
+        return (
+            "{}\n\n{} on {} occurred {} {} since the last notification. Further "
+            "occurrences will be summarized in at most one notification every "
+            "{} seconds.".format(
+                message,
+                error_type,
+                route,
+                count,
+                "time" if count == 1 else "times",
+                self.window,
+            )
+        )
+
+    @property
+    def _pending_key(self):
+        return "{}:pending".format(self.key_prefix)
+
+    def _key(self, fingerprint, name):
+        return "{}:{}:{}".format(self.key_prefix, fingerprint, name)
@@ -0,0 +1,62 @@
+class InFlightRegistry(object):
+    """
+    Tracks which resources already have a job queued or running for them, so
+    the same work is not enqueued again while it is still in flight. Entries
+    expire after `expiry_seconds` in case a worker dies before releasing them.
+    """
+
+    def __init__(self, redis, expiry_seconds=1800, key_prefix="in_flight"):
+        self.redis = redis
+        self.expiry_seconds = expiry_seconds
+        self.key_prefix = key_prefix
+
+    def register(self, task_type, resource_ids):
+        """
+        Registers the resources as in flight for the task type and returns the
+        ids that were not already in flight. The other ids are counted as
+        dropped duplicates.
+        """
+        # Ids repeated in one call are only registered, and counted, once.
+        resource_ids = list(dict.fromkeys(resource_ids))
+        if not resource_ids:
+            return []
+
+        pipeline = self.redis.pipeline()
+        for resource_id in resource_ids:
+            pipeline.set(
+                self._key(task_type, resource_id), "1", nx=True, ex=self.expiry_seconds,
+            )
+        results = pipeline.execute()
+
+        registered = [
+            resource_id
+            for resource_id, was_set in zip(resource_ids, results)
+            if was_set
+        ]
+        dropped = len(resource_ids) - len(registered)
+        if dropped:
+            self.redis.incrby(self._dropped_key(task_type), dropped)
+
+        return registered
+
+    def release(self, task_type, resource_ids):
+        keys = [self._key(task_type, resource_id) for resource_id in resource_ids]
+        if keys:
+            self.redis.delete(*keys)
+
+    def is_in_flight(self, task_type, resource_id):
+        return bool(self.redis.exists(self._key(task_type, resource_id)))
+
+    def dropped(self, task_type):
+        """
+        The number of duplicate enqueues that have been dropped for the task
+        type.
+        """
+        count = self.redis.get(self._dropped_key(task_type))
+        return int(count) if count is not None else 0
+
+    def _key(self, task_type, resource_id):
+        return "{}:{}:{}".format(self.key_prefix, task_type, resource_id)
+
+    def _dropped_key(self, task_type):
+        return "{}:dropped:{}".format(self.key_prefix, task_type)
@@ -1,5 +1,8 @@
-from contextlib import contextmanager
+from collections import deque
+import os
 import smtplib
+import threading
+import time
 from email.message import EmailMessage
 
 
@@ -13,36 +16,178 @@ class MailConnection(object):
 
 
 class SMTPConnection(MailConnection):
-    def __init__(self, server, port, username, password, use_tls=False):
+    """
+    Sends mail over authenticated SMTP sessions that are kept open and reused,
+    so that a run of emails does not pay for a TLS handshake and login each.
+    Up to `pool_size` idle sessions are kept per process. A session is
+    retired after it has sent `max_messages` messages or been idle for
+    `idle_timeout` seconds, and a message that fails because the server
+    dropped the session is sent again on a new one.
+
+    `stats` counts the messages sent, sessions opened and reconnects, and
+    keeps the most recent send latencies in seconds. It is updated under the
+    same lock as the pool, since sends can come from many threads. Each send is also
+    logged to `logger`, if one is given.
+    """
+
+    DISCONNECTED_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError)
+    # "Service not available, closing transmission channel", which servers
+    # also send when they time out an idle session.
+    SERVICE_NOT_AVAILABLE = 421
+
+    def __init__(
+        self,
+        server,
+        port,
+        username,
+        password,
+        use_tls=False,
+        pool_size=2,
+        max_messages=100,
+        idle_timeout=60,
+        timeout=30,
+        logger=None,
+        clock=time.monotonic,
+    ):
         self.server = server
         self.port = port
         self.username = username
         self.password = password
         self.use_tls = use_tls
-
-    @contextmanager
-    def _connected_host(self):
-        host = None
-
-        if self.use_tls:
-            host = smtplib.SMTP(self.server, self.port)
-            host.starttls()
-        else:
-            host = smtplib.SMTP_SSL(self.server, self.port)
-
-        host.login(self.username, self.password)
-
-        yield host
-
-        host.quit()
+        self.pool_size = pool_size
+        self.max_messages = max_messages
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.logger = logger
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._idle = []
+        self.stats = {
+            "sent": 0,
+            "connections": 0,
+            "reconnects": 0,
+            "latencies": deque(maxlen=1000),
+        }
 
     @property
     def messages(self):
         return []
 
     def send(self, message):
-        with self._connected_host() as host:
-            host.send_message(message)
+        start = self._clock()
+        session = self._checkout()
+        reused = session.sent > 0
+        try:
+            session.host.send_message(message)
+        except Exception as err:
+            self._close(session)
+            if not self._disconnected(err):
+                raise
+
+            # The server timed the session out or went away. Try once more
+            # on a new session.
+            with self._lock:
+                self.stats["reconnects"] += 1
+            reused = False
+            session = self._connect()
+            try:
+                session.host.send_message(message)
+            except Exception:
+                self._close(session)
+                raise
+
+        session.sent += 1
+        self._checkin(session)
+        self._record(self._clock() - start, reused)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for session in idle:
+            self._close(session)
+
+    def _checkout(self):
+        with self._lock:
+            # Sessions can't be shared with a forked process, such as a
+            # Celery worker forked after mail was sent.
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._idle = []
+
+            while self._idle:
+                session = self._idle.pop()
+                if self._clock() - session.last_used < self.idle_timeout:
+                    return session
+                self._close(session)
+
+        return self._connect()
+
+    def _checkin(self, session):
+        session.last_used = self._clock()
+        if session.sent >= self.max_messages:
+            self._close(session)
+            return
+
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(session)
+                return
+
+        self._close(session)
+
+    def _connect(self):
+        host = self._open()
+        try:
+            host.login(self.username, self.password)
+        except Exception:
+            host.close()
+            raise
+
+        with self._lock:
+            self.stats["connections"] += 1
+
+        return _SMTPSession(host, self._clock())
+
+    def _open(self):
+        if self.use_tls:
+            host = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+            host.starttls()
+        else:
+            host = smtplib.SMTP_SSL(self.server, self.port, timeout=self.timeout)
+
+        return host
+
+    def _disconnected(self, err):
+        return isinstance(err, self.DISCONNECTED_ERRORS) or (
+            isinstance(err, smtplib.SMTPResponseException)
+            and err.smtp_code == self.SERVICE_NOT_AVAILABLE
+        )
+
+    def _close(self, session):
+        try:
+            session.host.quit()
+        except (smtplib.SMTPException, OSError):
+            session.host.close()
+
+    def _record(self, seconds, reused):
+        with self._lock:
+            self.stats["sent"] += 1
+            self.stats["latencies"].append(seconds)
+        if self.logger:
+            self.logger.info(
+                "Sent mail in {:.3f}s on a {} SMTP connection".format(
+                    seconds, "reused" if reused else "new"
+                ),
+                extra={"tags": ["mail", "metrics"]},
+            )
+
+
+class _SMTPSession(object):
+    def __init__(self, host, last_used):
+        self.host = host
+        self.last_used = last_used
+        self.sent = 0
 
 
 class RedisConnection(MailConnection):
@@ -1,3 +1,5 @@
+import time
+
 from sqlalchemy import select
 
 from atst.jobs import send_notification_mail
@@ -6,12 +8,28 @@ from atst.models.notification_recipient import NotificationRecipient
 
 
 class NotificationSender(object):
+    """
+    Sends notifications to the notification recipients. The recipients are
+    cached for `recipients_ttl` seconds, so that sending notifications in
+    bulk does not query for them each time.
+    """
+
     EMAIL_SUBJECT = "ATST notification"
 
+    def __init__(self, recipients_ttl=300, clock=time.monotonic):
+        self.recipients_ttl = recipients_ttl
+        self._clock = clock
+        self._recipients = None
+        self._recipients_expire_at = 0
+
     def send(self, body, type_=None):
         recipients = self._get_recipients(type_)
         send_notification_mail.delay(recipients, self.EMAIL_SUBJECT, body)
 
     def _get_recipients(self, type_):
-        query = select([NotificationRecipient.email])
-        return db.session.execute(query).fetchone()
+        if self._recipients is None or self._clock() >= self._recipients_expire_at:
+            query = select([NotificationRecipient.email])
+            self._recipients = [email for email, in db.session.execute(query)]
+            self._recipients_expire_at = self._clock() + self.recipients_ttl
+
+        return self._recipients
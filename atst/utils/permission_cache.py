@@ -0,0 +1,145 @@
+import json
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+DEFAULT_CACHE_NAME = "permissions"
+
+_CHANGED_USERS = "permission_cache_changed_users"
+_CHANGED_PORTFOLIOS = "permission_cache_changed_portfolios"
+_ALL_USERS = "all"
+
+
+class PermissionCache(object):
+    """
+    Stores a snapshot of each user's effective permissions in Redis so that
+    authorization checks do not have to load the user's roles and permission
+    sets on every request.
+
+    A snapshot is a dict with the user's ATAT-level permissions under "atat"
+    and the permissions granted by their portfolio and application roles
+    under "portfolios" and "applications", keyed by the resource id.
+    """
+
+    def __init__(self, redis, expiry_seconds=3600, key_prefix=DEFAULT_CACHE_NAME):
+        self.redis = redis
+        self.expiry_seconds = expiry_seconds
+        self.key_prefix = key_prefix
+
+    def version(self, user_id):
+        """
+        The version of the user's snapshot, which changes whenever it is
+        invalidated. Get the version before building a snapshot and write the
+        snapshot with it, so that a snapshot built from permissions that
+        changed in the meantime is written under a version nobody reads.
+        """
+        generations = self.redis.mget(
+            self._generation_key(), self._generation_key(user_id)
+        )
+        return ".".join(str(int(generation or 0)) for generation in generations)
+
+    def read(self, user_id, version=None):
+        version = version or self.version(user_id)
+        data = self.redis.get(self._key(user_id, version))
+        return json.loads(data) if data is not None else None
+
+    def write(self, user_id, snapshot, version=None):
+        version = version or self.version(user_id)
+        self.redis.setex(
+            name=self._key(user_id, version),
+            value=json.dumps(snapshot),
+            time=self.expiry_seconds,
+        )
+
+    def invalidate(self, *user_ids):
+        # The old snapshots are left to expire.
+        if user_ids:
+            pipeline = self.redis.pipeline()
+            for user_id in user_ids:
+                pipeline.incr(self._generation_key(user_id))
+            pipeline.execute()
+
+    def invalidate_all(self):
+        self.redis.incr(self._generation_key())
+
+    def _generation_key(self, user_id=None):
+        if user_id is None:
+            return "{}:generation".format(self.key_prefix)
+        return "{}:generation:{}".format(self.key_prefix, user_id)
+
+    def _key(self, user_id, version):
+        return "{}:{}:{}".format(self.key_prefix, version, user_id)
+
+
+class PortfolioListCache(PermissionCache):
+    """
+    Stores the id and name of the portfolios listed in each user's sidebar.
+    Lists that do not depend on the user's roles, like the list of every
+    portfolio shown to CCPO users, are stored under a shared key instead of a
+    user id.
+    """
+
+    def __init__(self, redis, expiry_seconds=3600, key_prefix="portfolio_list"):
+        super().__init__(redis, expiry_seconds=expiry_seconds, key_prefix=key_prefix)
+
+
+def mark_permissions_changed(session, user_id=None):
+    """
+    Records that a user's permissions changed in this session. Their cached
+    snapshot is dropped once the session commits, so that a snapshot rebuilt
+    in the meantime cannot outlive the change. Without a user id every
+    snapshot is dropped.
+    """
+    changed = session.info.setdefault(_CHANGED_USERS, set())
+    changed.add(_ALL_USERS if user_id is None else str(user_id))
+
+
+def mark_portfolios_changed(session):
+    """
+    Records that a portfolio was created, renamed or removed in this session,
+    which drops every cached portfolio list once the session commits.
+    """
+    session.info[_CHANGED_PORTFOLIOS] = True
+
+
+def has_permission_changes(session):
+    return bool(session.info.get(_CHANGED_USERS))
+
+
+def has_portfolio_changes(session):
+    return has_permission_changes(session) or session.info.get(
+        _CHANGED_PORTFOLIOS, False
+    )
+
+
+def _invalidate(cache, changed, invalidate_all=False):
+    if cache is None:
+        return
+
+    if invalidate_all or _ALL_USERS in changed:
+        cache.invalidate_all()
+    else:
+        cache.invalidate(*changed)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_permissions(session):
+    changed = session.info.pop(_CHANGED_USERS, set())
+    portfolios_changed = session.info.pop(_CHANGED_PORTFOLIOS, False)
+    if not (changed or portfolios_changed) or not has_app_context():
+        return
+
+    _invalidate(getattr(current_app, "permission_cache", None), changed)
+    _invalidate(
+        getattr(current_app, "portfolio_list_cache", None),
+        changed,
+        invalidate_all=portfolios_changed,
+    )
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_permissions(session):
+    session.info.pop(_CHANGED_USERS, None)
+    session.info.pop(_CHANGED_PORTFOLIOS, None)
@@ -0,0 +1,76 @@
+from flask import current_app as app
+
+from atst.queue import celery
+from atst.utils import chunks
+
+
+class ProvisioningQueue(object):
+    """
+    Enqueues provisioning jobs as soon as a write makes resources ready for
+    them, instead of waiting for the periodic reconciler in `atst.jobs`. The
+    jobs only act on resources that are still pending, and resources that
+    are already in flight for a step are not enqueued again. The ids are
+    sent in chunks of PROVISIONING_CHUNK_SIZE, one job per chunk.
+
+    Tasks are sent by name because `atst.jobs` imports the domain classes
+    that use this queue.
+    """
+
+    # The provisioning steps, which are also the task types used in the
+    # in-flight registry.
+    CREATE_ENVIRONMENT = "create_environment"
+    CREATE_ATAT_ADMIN_USER = "create_atat_admin_user"
+    PROVISION_USER = "provision_user"
+
+    TASKS = {
+        CREATE_ENVIRONMENT: ("atst.jobs.create_environments", "environment_ids"),
+        CREATE_ATAT_ADMIN_USER: (
+            "atst.jobs.create_atat_admin_users",
+            "environment_ids",
+        ),
+        PROVISION_USER: ("atst.jobs.provision_users", "environment_role_ids"),
+    }
+
+    def create_environments(self, environment_ids):
+        self._enqueue(self.CREATE_ENVIRONMENT, environment_ids)
+
+    def create_atat_admin_users(self, environment_ids):
+        self._enqueue(self.CREATE_ATAT_ADMIN_USER, environment_ids)
+
+    def provision_users(self, environment_role_ids):
+        self._enqueue(self.PROVISION_USER, environment_role_ids)
+
+    def _enqueue(self, step, ids):
+        task_name, kwarg = self.TASKS[step]
+        try:
+            ids = app.in_flight_registry.register(step, ids)
+        except Exception as err:
+            # The write that made the resources ready is already committed, so
+            # leave them to the reconciler instead of failing the request.
+            self._log_failure(task_name, err)
+            return
+
+        for chunk in chunks(ids, app.config.get("PROVISIONING_CHUNK_SIZE")):
+            try:
+                self._send(task_name, {kwarg: [str(id_) for id_ in chunk]})
+            except Exception as err:
+                # Anything that could not be enqueued is picked up by the
+                # reconciler.
+                self._release(step, chunk)
+                self._log_failure(task_name, err)
+
+    def _release(self, step, ids):
+        try:
+            app.in_flight_registry.release(step, ids)
+        except Exception:
+            # The entries expire on their own.
+            pass
+
+    def _log_failure(self, task_name, err):
+        app.logger.warning(
+            "Could not enqueue {}: {}".format(task_name, err),
+            extra={"tags": ["provisioning"]},
+        )
+
+    def _send(self, task_name, kwargs):
+        celery.send_task(task_name, kwargs=kwargs)
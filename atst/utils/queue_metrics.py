@@ -0,0 +1,63 @@
+class QueueMetrics(object):
+    """
+    Reports the depth of each Celery queue and how long tasks waited in it
+    before a worker started them, so that a backlog in one queue can be told
+    apart from a backlog in another. The most recent `sample_size` waits are
+    kept for each queue.
+    """
+
+    # kombu's Redis transport keeps each priority step of a queue in its own
+    # list, named after the queue.
+    PRIORITY_STEPS = [0, 3, 6, 9]
+    PRIORITY_SEPARATOR = "\x06\x16"
+
+    def __init__(self, redis, sample_size=1000, key_prefix="queue_metrics"):
+        self.redis = redis
+        self.sample_size = sample_size
+        self.key_prefix = key_prefix
+
+    def record_wait(self, queue, seconds):
+        key = self._key(queue)
+        pipeline = self.redis.pipeline()
+        pipeline.lpush(key, seconds)
+        pipeline.ltrim(key, 0, self.sample_size - 1)
+        pipeline.execute()
+
+    def wait_times(self, queue):
+        return sorted(
+            float(wait) for wait in self.redis.lrange(self._key(queue), 0, -1)
+        )
+
+    def depth(self, queue):
+        pipeline = self.redis.pipeline()
+        for step in self.PRIORITY_STEPS:
+            pipeline.llen(self._priority_list(queue, step))
+        return sum(pipeline.execute())
+
+    def summary(self, queue):
+        """
+        The depth of the queue and the median and 99th percentile of its
+        recent waits, in seconds. The waits are None if none were recorded.
+        """
+        waits = self.wait_times(queue)
+        return {
+            "depth": self.depth(queue),
+            "wait_p50": _percentile(waits, 50),
+            "wait_p99": _percentile(waits, 99),
+        }
+
+    def _priority_list(self, queue, step):
+        if step:
+            return "{}{}{}".format(queue, self.PRIORITY_SEPARATOR, step)
+        else:
+            return queue
+
+    def _key(self, queue):
+        return "{}:wait:{}".format(self.key_prefix, queue)
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
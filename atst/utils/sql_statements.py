@@ -0,0 +1,31 @@
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_sql_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.sql_statement_count = getattr(g, "sql_statement_count", 0) + 1
+
+
+def count_sql_statements(app):
+    """
+    Counts the SQL statements executed while handling each request. The
+    count is kept on `g.sql_statement_count` and logged when the request
+    finishes.
+    """
+
+    @app.before_request
+    def _reset_sql_statement_count():
+        g.sql_statement_count = 0
+
+    @app.after_request
+    def _log_sql_statement_count(response):
+        app.logger.debug(
+            "Executed {} SQL statements for {} {}".format(
+                getattr(g, "sql_statement_count", 0), request.method, request.path
+            ),
+            extra={"tags": ["database"]},
+        )
+        return response
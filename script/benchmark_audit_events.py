@@ -0,0 +1,155 @@
+"""
+Counts the SQL statements that bulk deletes issue with audit events written
+one INSERT per audited row, as they used to be, and with the events buffered
+and written in one INSERT when the transaction commits. The data is seeded
+in a transaction that is rolled back when the benchmark ends.
+
+    python script/benchmark_audit_events.py --environments 20 --members 20
+"""
+# Add root application dir to the python path
+import os
+import sys
+import argparse
+import time
+from contextlib import contextmanager
+from unittest.mock import patch
+from uuid import uuid4
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(parent_dir)
+
+from sqlalchemy import event
+
+from atst.app import make_config, make_app
+from atst.database import db
+from atst.domain.applications import Applications
+from atst.domain.environments import Environments
+from atst.models import (
+    Application,
+    ApplicationRole,
+    ApplicationRoleStatus,
+    AuditEvent,
+    Environment,
+    EnvironmentRole,
+    Portfolio,
+    User,
+)
+from atst.models.environment_role import CSPRole
+
+
+def one_insert_per_event(connection, audit_events):
+    for audit_event in audit_events:
+        connection.execute(AuditEvent.__table__.insert(), **audit_event)
+
+
+def seed(environments, members):
+    portfolio = Portfolio(
+        name="Benchmark Portfolio", defense_component="Army, Department of the"
+    )
+    application = Application(portfolio=portfolio, name="Benchmark Application")
+    records = [portfolio, application]
+    roles = []
+    for n in range(members):
+        user = User(dod_id=str(uuid4().int)[:10], first_name="Bench", last_name=str(n))
+        role = ApplicationRole(
+            application=application, user=user, status=ApplicationRoleStatus.ACTIVE
+        )
+        roles.append(role)
+        records.extend([user, role])
+
+    for n in range(environments):
+        environment = Environment(
+            application=application,
+            name="Environment {}".format(n),
+            creator=roles[0].user,
+        )
+        records.append(environment)
+        for role in roles:
+            records.append(
+                EnvironmentRole(
+                    environment=environment,
+                    application_role=role,
+                    role=CSPRole.BASIC_ACCESS.value,
+                )
+            )
+
+    db.session.add_all(records)
+    db.session.commit()
+    return application
+
+
+@contextmanager
+def counted_statements():
+    counts = {"statements": 0, "audit_inserts": 0}
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        counts["statements"] += 1
+        if statement.startswith("INSERT INTO audit_events"):
+            counts["audit_inserts"] += 1
+
+    event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        yield counts
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count)
+
+
+def run(name, operation):
+    with counted_statements() as counts:
+        start = time.perf_counter()
+        operation()
+        elapsed = (time.perf_counter() - start) * 1000
+
+    print(
+        "{:<28} {:6} statements  {:6} audit INSERTs  {:9.2f}ms".format(
+            name, counts["statements"], counts["audit_inserts"], elapsed
+        )
+    )
+
+
+def benchmark(args):
+    for name, insert_many in [
+        ("per-row", one_insert_per_event),
+        ("buffered", AuditEvent.insert_many),
+    ]:
+        print("{} audit event writes:".format(name))
+        with patch.object(AuditEvent, "insert_many", insert_many):
+            application = seed(args.environments, args.members)
+            environment = application.environments[0]
+            run(
+                "  Environments.delete",
+                lambda: Environments.delete(environment, commit=True),
+            )
+
+            application = seed(args.environments, args.members)
+            run("  Applications.delete", lambda: Applications.delete(application))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--environments", type=int, default=20, help="environments per application"
+    )
+    parser.add_argument(
+        "--members",
+        type=int,
+        default=20,
+        help="application members, each with a role in every environment",
+    )
+    args = parser.parse_args()
+
+    config = make_config(
+        {"DISABLE_CRL_CHECK": True, "DEBUG": False, "USE_AUDIT_LOG": True}
+    )
+    app = make_app(config)
+    with app.app_context():
+        # Run everything in one outer transaction, so that the commits the
+        # domain classes make can be rolled back at the end.
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        db.session = db.create_scoped_session(options={"bind": connection, "binds": {}})
+        try:
+            benchmark(args)
+        finally:
+            transaction.rollback()
+            connection.close()
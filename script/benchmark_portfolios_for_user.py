@@ -0,0 +1,262 @@
+"""
+Compares the query PortfoliosQuery.get_for_user used to run (nested IN
+subqueries OR'd together) with the current UNION of two indexed joins. The
+data is seeded in a transaction that is rolled back when the benchmark ends.
+
+    python script/benchmark_portfolios_for_user.py --users 2000 --portfolios 5000
+"""
+# Add root application dir to the python path
+import os
+import sys
+import argparse
+import random
+import statistics
+import time
+from uuid import uuid4
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(parent_dir)
+
+from sqlalchemy import or_, text
+
+from atst.app import make_config, make_app
+from atst.database import db
+from atst.domain.portfolios.query import PortfoliosQuery
+from atst.models import (
+    Application,
+    ApplicationRole,
+    ApplicationRoleStatus,
+    Portfolio,
+    PortfolioRole,
+    PortfolioRoleStatus,
+    User,
+)
+
+
+def legacy_query(user_id):
+    return (
+        db.session.query(Portfolio.id)
+        .filter(
+            or_(
+                Portfolio.id.in_(
+                    db.session.query(Portfolio.id)
+                    .join(Application)
+                    .filter(Portfolio.id == Application.portfolio_id)
+                    .filter(
+                        Application.id.in_(
+                            db.session.query(Application.id)
+                            .join(ApplicationRole)
+                            .filter(ApplicationRole.application_id == Application.id)
+                            .filter(ApplicationRole.user_id == user_id)
+                            .filter(
+                                ApplicationRole.status == ApplicationRoleStatus.ACTIVE
+                            )
+                            .filter(ApplicationRole.deleted == False)
+                            .subquery()
+                        )
+                    )
+                ),
+                Portfolio.id.in_(
+                    db.session.query(Portfolio.id)
+                    .join(PortfolioRole)
+                    .filter(PortfolioRole.user_id == user_id)
+                    .filter(PortfolioRole.status == PortfolioRoleStatus.ACTIVE)
+                    .subquery()
+                ),
+            )
+        )
+        .filter(Portfolio.deleted == False)
+        .order_by(Portfolio.name.asc())
+    )
+
+
+class _User:
+    def __init__(self, id_):
+        self.id = id_
+
+
+def union_query(user_id):
+    return PortfoliosQuery._for_user(_User(user_id), Portfolio.id)
+
+
+def _insert(table, rows, batch_size=5000):
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(table.insert(), rows[start : start + batch_size])
+
+
+def seed(users, portfolios, applications, portfolio_roles, application_roles):
+    user_ids = [uuid4() for _ in range(users)]
+    _insert(
+        User.__table__,
+        [
+            {
+                "id": id_,
+                "dod_id": str(1000000000 + n),
+                "first_name": "Bench",
+                "last_name": "User {}".format(n),
+            }
+            for n, id_ in enumerate(user_ids)
+        ],
+    )
+
+    portfolio_ids = [uuid4() for _ in range(portfolios)]
+    _insert(
+        Portfolio.__table__,
+        [
+            {
+                "id": id_,
+                "name": "Portfolio {}".format(n),
+                "defense_component": "Army, Department of the",
+                "deleted": n % 20 == 0,
+            }
+            for n, id_ in enumerate(portfolio_ids)
+        ],
+    )
+
+    application_ids = []
+    application_rows = []
+    for portfolio_id in portfolio_ids:
+        for n in range(applications):
+            id_ = uuid4()
+            application_ids.append(id_)
+            application_rows.append(
+                {
+                    "id": id_,
+                    "portfolio_id": portfolio_id,
+                    "name": "Application {}".format(n),
+                }
+            )
+    _insert(Application.__table__, application_rows)
+
+    statuses = list(PortfolioRoleStatus)
+    _insert(
+        PortfolioRole.__table__,
+        [
+            {
+                "id": uuid4(),
+                "user_id": user_id,
+                "portfolio_id": portfolio_id,
+                "status": random.choice(statuses),
+            }
+            for user_id in user_ids
+            for portfolio_id in random.sample(portfolio_ids, portfolio_roles)
+        ],
+    )
+
+    statuses = list(ApplicationRoleStatus)
+    _insert(
+        ApplicationRole.__table__,
+        [
+            {
+                "id": uuid4(),
+                "user_id": user_id,
+                "application_id": application_id,
+                "status": random.choice(statuses),
+                "deleted": random.random() < 0.1,
+            }
+            for user_id in user_ids
+            for application_id in random.sample(application_ids, application_roles)
+        ],
+    )
+
+    for table in [
+        "users",
+        "portfolios",
+        "applications",
+        "portfolio_roles",
+        "application_roles",
+    ]:
+        db.session.execute(text("ANALYZE {}".format(table)))
+
+    return user_ids
+
+
+def time_query(make_query, user_ids):
+    timings = []
+    results = {}
+    for user_id in user_ids:
+        start = time.perf_counter()
+        results[user_id] = [row.id for row in make_query(user_id).all()]
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return (timings, results)
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    print(
+        "{:<8} mean {:8.2f}ms  median {:8.2f}ms  p95 {:8.2f}ms  max {:8.2f}ms".format(
+            name,
+            statistics.mean(timings),
+            statistics.median(timings),
+            timings[int(len(timings) * 0.95) - 1],
+            timings[-1],
+        )
+    )
+
+
+def explain(make_query, user_id):
+    compiled = make_query(user_id).statement.compile(dialect=db.session.bind.dialect)
+    processors = compiled._bind_processors
+    params = {
+        key: processors[key](value) if key in processors else value
+        for key, value in compiled.params.items()
+    }
+    rows = db.session.connection().execute(
+        "EXPLAIN ANALYZE {}".format(compiled), params
+    )
+    return "\n".join(row[0] for row in rows)
+
+
+def benchmark(args):
+    print("Seeding data...")
+    user_ids = seed(
+        args.users,
+        args.portfolios,
+        args.applications,
+        args.portfolio_roles,
+        args.application_roles,
+    )
+    sample = random.sample(user_ids, min(args.samples, len(user_ids)))
+
+    # warm the caches so neither query pays for the first reads
+    time_query(legacy_query, sample[:10])
+    time_query(union_query, sample[:10])
+
+    legacy_timings, legacy_results = time_query(legacy_query, sample)
+    union_timings, union_results = time_query(union_query, sample)
+
+    assert legacy_results == union_results, "The queries returned different results"
+
+    report("legacy", legacy_timings)
+    report("union", union_timings)
+
+    if args.explain:
+        print("\nlegacy plan:\n{}".format(explain(legacy_query, sample[0])))
+        print("\nunion plan:\n{}".format(explain(union_query, sample[0])))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--portfolios", type=int, default=5000)
+    parser.add_argument(
+        "--applications", type=int, default=4, help="applications per portfolio"
+    )
+    parser.add_argument(
+        "--portfolio-roles", type=int, default=3, help="portfolio roles per user"
+    )
+    parser.add_argument(
+        "--application-roles", type=int, default=10, help="application roles per user"
+    )
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--explain", action="store_true")
+    args = parser.parse_args()
+
+    config = make_config({"DISABLE_CRL_CHECK": True, "DEBUG": False})
+    app = make_app(config)
+    with app.app_context():
+        try:
+            benchmark(args)
+        finally:
+            db.session.rollback()
@@ -0,0 +1,443 @@
+"""
+Measures the provisioning pipeline end to end. Seeds portfolios with funded
+CLINs and environments and environment roles that are pending provisioning,
+runs the provisioning jobs until nothing is left to provision, and reports
+the throughput, the p50/p99 time from the start of the run until each
+resource was provisioned, the number of retries and the number of SQL
+statements per provisioned resource.
+
+By default the jobs run in this process against a MockCloudProvider whose
+latency and failure rates are set from the command line. Retries run
+immediately, without their backoff, so the times measure the work and not
+the waiting. With --broker the jobs are sent to the configured broker for
+the running workers to pick up, and the database is polled for progress;
+the provider options, retries and statement counts then only apply to the
+workers and are not reported.
+
+The seeded data is committed, so run this against a disposable database.
+
+    python script/benchmark_provisioning.py --portfolios 20 --latency-ms 200 --failure-pct 5
+"""
+# Add root application dir to the python path
+import os
+import sys
+import argparse
+import time
+from collections import deque
+from datetime import date, timedelta
+from uuid import uuid4
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(parent_dir)
+
+import pendulum
+from celery import signals
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from atst.app import make_config, make_app
+from atst.database import db
+from atst.domain.csp.cloud import MockCloudProvider
+from atst.domain.csp.throttle import ThrottledCloudProvider
+from atst.domain.environments import Environments
+from atst.domain.environment_roles import EnvironmentRoles
+from atst.models import (
+    Application,
+    ApplicationRole,
+    ApplicationRoleStatus,
+    CLIN,
+    Environment,
+    EnvironmentRole,
+    Portfolio,
+    TaskOrder,
+    User,
+)
+from atst.models.clin import JEDICLINType
+from atst.models.environment_role import CSPRole
+from atst.queue import celery
+from atst.utils.provisioning_queue import ProvisioningQueue
+
+
+class BenchmarkCloudProvider(MockCloudProvider):
+    """
+    A MockCloudProvider with a fixed mean latency per call and configurable
+    failure rates, instead of the mock's default of seconds per call.
+    """
+
+    def __init__(
+        self,
+        config,
+        latency_ms,
+        network_failure_pct,
+        server_failure_pct,
+        failure_pct,
+        unauthorized_pct,
+    ):
+        super().__init__(config, with_delay=latency_ms > 0)
+        self.latency = latency_ms / 1000
+        self.NETWORK_FAILURE_PCT = network_failure_pct
+        self.SERVER_FAILURE_PCT = server_failure_pct
+        self.ENV_CREATE_FAILURE_PCT = failure_pct
+        self.ATAT_ADMIN_CREATE_FAILURE_PCT = failure_pct
+        self.UNAUTHORIZED_RATE = unauthorized_pct
+
+    def _delay(self, min_secs, max_secs):
+        if self._with_delay:
+            self._sleep(self._random.uniform(0, 2 * self.latency))
+
+
+class InProcessProvisioningQueue(ProvisioningQueue):
+    """
+    Holds the jobs that would be sent to the broker so that the benchmark
+    can run them one after another, the way a single worker would.
+    """
+
+    def __init__(self):
+        self.jobs = deque()
+
+    def _send(self, task_name, kwargs):
+        self.jobs.append((task_name, kwargs))
+
+    def run(self):
+        while self.jobs:
+            task_name, kwargs = self.jobs.popleft()
+            celery.tasks[task_name].apply(kwargs=kwargs)
+
+
+class Stats:
+    def __init__(self):
+        self.start = None
+        self.provisioned = {}
+        self.retries = 0
+        self.statements = 0
+
+    def mark(self, key):
+        if key not in self.provisioned:
+            self.provisioned[key] = time.perf_counter() - self.start
+
+
+def _insert(table, rows, batch_size=5000):
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(table.insert(), rows[start : start + batch_size])
+
+
+def seed(portfolios, applications, environments, members):
+    today = date.today()
+    user_rows = []
+    portfolio_rows = []
+    task_order_rows = []
+    clin_rows = []
+    application_rows = []
+    environment_rows = []
+    application_role_rows = []
+    environment_role_rows = []
+
+    def user():
+        id_ = uuid4()
+        user_rows.append(
+            {
+                "id": id_,
+                "dod_id": str(uuid4().int)[:10],
+                "first_name": "Bench",
+                "last_name": "User {}".format(len(user_rows)),
+                "email": "bench{}@example.com".format(len(user_rows)),
+            }
+        )
+        return id_
+
+    for p in range(portfolios):
+        portfolio_id = uuid4()
+        portfolio_rows.append(
+            {
+                "id": portfolio_id,
+                "name": "Benchmark Portfolio {}".format(p),
+                "defense_component": "Army, Department of the",
+            }
+        )
+        task_order_id = uuid4()
+        task_order_rows.append(
+            {
+                "id": task_order_id,
+                "portfolio_id": portfolio_id,
+                "number": str(uuid4().int)[:13],
+                "signer_dod_id": "1234567890",
+                "signed_at": pendulum.now(),
+            }
+        )
+        clin_rows.append(
+            {
+                "id": uuid4(),
+                "task_order_id": task_order_id,
+                "number": "0001",
+                "start_date": today - timedelta(days=1),
+                "end_date": today + timedelta(days=365),
+                "total_amount": 100000,
+                "obligated_amount": 100000,
+                "jedi_clin_type": JEDICLINType.JEDI_CLIN_1,
+            }
+        )
+
+        for a in range(applications):
+            application_id = uuid4()
+            application_rows.append(
+                {
+                    "id": application_id,
+                    "portfolio_id": portfolio_id,
+                    "name": "Application {}".format(a),
+                }
+            )
+            application_role_ids = []
+            for _ in range(members):
+                application_role_id = uuid4()
+                application_role_ids.append(application_role_id)
+                application_role_rows.append(
+                    {
+                        "id": application_role_id,
+                        "application_id": application_id,
+                        "user_id": user(),
+                        "status": ApplicationRoleStatus.ACTIVE,
+                    }
+                )
+
+            for e in range(environments):
+                environment_id = uuid4()
+                environment_rows.append(
+                    {
+                        "id": environment_id,
+                        "application_id": application_id,
+                        "creator_id": user(),
+                        "name": "Environment {}".format(e),
+                    }
+                )
+                for application_role_id in application_role_ids:
+                    environment_role_rows.append(
+                        {
+                            "id": uuid4(),
+                            "environment_id": environment_id,
+                            "application_role_id": application_role_id,
+                            "role": CSPRole.BASIC_ACCESS.value,
+                            "status": EnvironmentRole.Status.PENDING,
+                        }
+                    )
+
+    _insert(User.__table__, user_rows)
+    _insert(Portfolio.__table__, portfolio_rows)
+    _insert(TaskOrder.__table__, task_order_rows)
+    _insert(CLIN.__table__, clin_rows)
+    _insert(Application.__table__, application_rows)
+    _insert(Environment.__table__, environment_rows)
+    _insert(ApplicationRole.__table__, application_role_rows)
+    _insert(EnvironmentRole.__table__, environment_role_rows)
+    db.session.commit()
+
+    return (
+        [row["id"] for row in environment_rows],
+        [row["id"] for row in environment_role_rows],
+    )
+
+
+def pending(environment_ids, environment_role_ids):
+    now = pendulum.now()
+    environments = (
+        Environments.base_provision_query(now)
+        .filter(Environment.id.in_(environment_ids))
+        .filter(Environment.root_user_info == None)
+        .count()
+    )
+    environment_roles = (
+        EnvironmentRoles.pending_creation_query()
+        .filter(EnvironmentRole.id.in_(environment_role_ids))
+        .count()
+    )
+    return environments + environment_roles
+
+
+def record_in_process(stats):
+    @event.listens_for(Engine, "before_cursor_execute")
+    def _count_statement(*args):
+        stats.statements += 1
+
+    @signals.task_retry.connect(weak=False)
+    def _count_retry(**kwargs):
+        stats.retries += 1
+
+    @event.listens_for(db.session, "after_flush")
+    def _mark_provisioned(session, flush_context):
+        for obj in session.dirty:
+            if isinstance(obj, Environment) and obj.root_user_info is not None:
+                stats.mark(obj.id)
+            elif (
+                isinstance(obj, EnvironmentRole)
+                and obj.status == EnvironmentRole.Status.COMPLETED
+            ):
+                stats.mark(obj.id)
+
+
+def run_in_process(args, app, stats, environment_ids, environment_role_ids):
+    app.csp.cloud = BenchmarkCloudProvider(
+        app.config,
+        args.latency_ms,
+        args.network_failure_pct,
+        args.server_failure_pct,
+        args.failure_pct,
+        args.unauthorized_pct,
+    )
+    if not args.no_throttle:
+        app.csp.cloud = ThrottledCloudProvider(
+            app.csp.cloud,
+            app.redis,
+            "benchmark-{}".format(uuid4().hex),
+            max_concurrency=app.config.get("CSP_MAX_CONCURRENCY"),
+            rate=app.config.get("CSP_RATE_LIMIT"),
+            burst=app.config.get("CSP_RATE_BURST"),
+            failure_threshold=app.config.get("CSP_CIRCUIT_FAILURE_THRESHOLD"),
+            cooldown=app.config.get("CSP_CIRCUIT_COOLDOWN"),
+        )
+    app.provisioning_queue = InProcessProvisioningQueue()
+    celery.conf.update(CELERY_ALWAYS_EAGER=True)
+    record_in_process(stats)
+
+    stats.start = time.perf_counter()
+    app.provisioning_queue.create_environments(environment_ids)
+    app.provisioning_queue.run()
+
+    # Anything that ran out of retries is left for the reconcilers, which
+    # are run in rounds the way beat would.
+    for _ in range(args.rounds):
+        if not pending(environment_ids, environment_role_ids):
+            break
+        for name in [
+            "atst.jobs.dispatch_create_environment",
+            "atst.jobs.dispatch_create_atat_admin_user",
+            "atst.jobs.dispatch_provision_user",
+        ]:
+            celery.tasks[name].apply()
+            app.provisioning_queue.run()
+
+
+def run_with_broker(args, app, stats, environment_ids, environment_role_ids):
+    ids = set(environment_ids) | set(environment_role_ids)
+    stats.start = time.perf_counter()
+    app.provisioning_queue.create_environments(environment_ids)
+
+    deadline = time.time() + args.timeout
+    while time.time() < deadline:
+        provisioned = [
+            id_
+            for id_, in db.session.query(Environment.id)
+            .filter(Environment.id.in_(environment_ids))
+            .filter(Environment.root_user_info != None)
+        ] + [
+            id_
+            for id_, in db.session.query(EnvironmentRole.id)
+            .filter(EnvironmentRole.id.in_(environment_role_ids))
+            .filter(EnvironmentRole.status == EnvironmentRole.Status.COMPLETED)
+        ]
+        db.session.rollback()
+        for id_ in provisioned:
+            stats.mark(id_)
+        if len(stats.provisioned) == len(ids):
+            return
+        time.sleep(args.poll_interval)
+
+
+def percentile(timings, pct):
+    return timings[max(0, int(round(len(timings) * pct / 100)) - 1)]
+
+
+def report(args, stats, total, elapsed):
+    timings = sorted(stats.provisioned.values())
+    print("provisioned      {} of {} resources".format(len(timings), total))
+    print("elapsed          {:.2f}s".format(elapsed))
+    if not timings:
+        return
+
+    print("throughput       {:.2f} resources/s".format(len(timings) / elapsed))
+    print("p50 provisioned  {:.2f}s".format(percentile(timings, 50)))
+    print("p99 provisioned  {:.2f}s".format(percentile(timings, 99)))
+    if not args.broker:
+        print("retries          {}".format(stats.retries))
+        print(
+            "SQL statements   {:.1f} per resource".format(
+                stats.statements / len(timings)
+            )
+        )
+
+
+def benchmark(args, app):
+    print("Seeding data...")
+    environment_ids, environment_role_ids = seed(
+        args.portfolios, args.applications, args.environments, args.members
+    )
+    total = len(environment_ids) + len(environment_role_ids)
+    print(
+        "Provisioning {} environments and {} environment roles...".format(
+            len(environment_ids), len(environment_role_ids)
+        )
+    )
+
+    stats = Stats()
+    if args.broker:
+        run_with_broker(args, app, stats, environment_ids, environment_role_ids)
+    else:
+        run_in_process(args, app, stats, environment_ids, environment_role_ids)
+    elapsed = time.perf_counter() - stats.start
+
+    report(args, stats, total, elapsed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--portfolios", type=int, default=10)
+    parser.add_argument(
+        "--applications", type=int, default=2, help="applications per portfolio"
+    )
+    parser.add_argument(
+        "--environments", type=int, default=3, help="environments per application"
+    )
+    parser.add_argument(
+        "--members",
+        type=int,
+        default=5,
+        help="application members, each with a role in every environment",
+    )
+    parser.add_argument(
+        "--latency-ms", type=int, default=50, help="mean latency of each CSP call"
+    )
+    parser.add_argument(
+        "--failure-pct",
+        type=int,
+        default=0,
+        help="percent of provisioning calls that fail",
+    )
+    parser.add_argument("--network-failure-pct", type=int, default=0)
+    parser.add_argument("--server-failure-pct", type=int, default=0)
+    parser.add_argument("--unauthorized-pct", type=int, default=0)
+    parser.add_argument(
+        "--no-throttle",
+        action="store_true",
+        help="call the provider directly instead of through the CSP throttle",
+    )
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=5,
+        help="reconciler rounds for resources that ran out of retries",
+    )
+    parser.add_argument(
+        "--broker",
+        action="store_true",
+        help="send the jobs to the broker for the running workers",
+    )
+    parser.add_argument(
+        "--timeout", type=int, default=600, help="seconds to wait with --broker"
+    )
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    args = parser.parse_args()
+
+    config = make_config({"DISABLE_CRL_CHECK": True, "DEBUG": False})
+    app = make_app(config)
+    with app.app_context():
+        benchmark(args, app)
@@ -0,0 +1,48 @@
+"""
+Downloads the DoD CRLs into `final_location` and writes the revocation index
+that the app maps. See script/sync-crls.
+"""
+# Add root application dir to the python path
+import os
+import sys
+import argparse
+import logging
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(parent_dir)
+
+from atst.domain.authnid.crl.util import sync_crls
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync the DoD CRLs")
+    parser.add_argument("tmp_location")
+    parser.add_argument("final_location")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of CRLs to download concurrently",
+    )
+    parser.add_argument(
+        "--ca-chain", help="CA bundle used to verify CRLs for the revocation index",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="[%(asctime)s]:%(levelname)s: %(message)s"
+    )
+    logger = logging.getLogger()
+    logger.info("Updating CRLs")
+    try:
+        sync_crls(
+            args.tmp_location,
+            args.final_location,
+            logger=logger,
+            max_workers=args.workers,
+            root_location=args.ca_chain,
+        )
+    except Exception:
+        logger.exception("Fatal error encountered, stopping")
+        sys.exit(1)
+    logger.info("Finished updating CRLs")
@@ -11,7 +11,7 @@ from atst.app import make_app, make_config
 from atst.database import db as _db
 import tests.factories as factories
 from tests.mocks import PDF_FILENAME, PDF_FILENAME2
-from tests.utils import FakeLogger, FakeNotificationSender
+from tests.utils import FakeLogger, FakeNotificationSender, FakeProvisioningQueue
 
 from datetime import datetime, timedelta
 from cryptography.hazmat.primitives.asymmetric import rsa
@@ -335,6 +335,16 @@ def notification_sender(app):
     app.notification_sender = real_notification_sender
 
 
+@pytest.fixture(scope="function", autouse=True)
+def provisioning_queue(app):
+    real_provisioning_queue = app.provisioning_queue
+    app.provisioning_queue = FakeProvisioningQueue()
+
+    yield app.provisioning_queue
+
+    app.provisioning_queue = real_provisioning_queue
+
+
 # This is the only effective means I could find to disable logging. Setting a
 # `celery_enable_logging` fixture to return False should work according to the
 # docs, but doesn't:
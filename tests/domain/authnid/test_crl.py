@@ -3,6 +3,9 @@ import pytest
 import re
 import os
 import shutil
+import stat
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.serialization import Encoding
 from OpenSSL import crypto
@@ -13,9 +16,18 @@ from atst.domain.authnid.crl import (
     CRLInvalidException,
     NoOpCRLCache,
 )
+from atst.domain.authnid.crl.index import (
+    MappedRevocationEntry,
+    ParsedRevocationEntry,
+    REVOCATION_INDEX,
+    load_revocation_index,
+)
 from atst.domain.authnid.crl.util import (
+    crl_local_path,
     load_crl_locations_cache,
     serialize_crl_locations_cache,
+    sync_crls,
+    write_crl_version_stamp,
     CRLParseError,
     JSON_CACHE,
 )
@@ -109,6 +121,108 @@ def test_can_dynamically_update_crls(
         assert cache.crl_check(client_pem)
 
 
+def test_reuses_store_until_crl_changes(
+    ca_key,
+    ca_file,
+    crl_file,
+    rsa_key,
+    make_x509,
+    make_crl,
+    serialize_pki_object_to_disk,
+):
+    crl_dir = os.path.dirname(crl_file)
+    client_cert = make_x509(rsa_key(), signer_key=ca_key, cn="chewbacca")
+    client_pem = client_cert.public_bytes(Encoding.PEM)
+    crl_list = make_crl_list(client_cert, crl_file)
+    cache = CRLCache(ca_file, crl_dir, crl_list=crl_list)
+
+    assert cache.crl_check(client_pem)
+    assert cache.crl_check(client_pem)
+    assert cache.store_rebuilds == 1
+    assert cache.store_hits == 1
+
+    # touching the file without changing its content does not rebuild the store
+    os.utime(crl_file, ns=(0, 0))
+    assert cache.crl_check(client_pem)
+    assert cache.store_rebuilds == 1
+    assert cache.store_hits == 2
+
+    revoked_crl = make_crl(ca_key, expired_serials=[client_cert.serial_number])
+    serialize_pki_object_to_disk(revoked_crl, crl_file, encoding=Encoding.DER)
+
+    with pytest.raises(CRLRevocationException):
+        cache.crl_check(client_pem)
+    assert cache.store_rebuilds == 2
+
+
+def test_serializes_revoked_serial_index(
+    ca_key,
+    ca_file,
+    crl_file,
+    rsa_key,
+    make_x509,
+    make_crl,
+    serialize_pki_object_to_disk,
+):
+    good_cert = make_x509(rsa_key(), signer_key=ca_key, cn="luke")
+    bad_cert = make_x509(rsa_key(), signer_key=ca_key, cn="darth")
+    crl = make_crl(ca_key, expired_serials=[bad_cert.serial_number])
+    serialize_pki_object_to_disk(crl, crl_file, encoding=Encoding.DER)
+    crl_dir = os.path.dirname(crl_file)
+    crl_list = make_crl_list(good_cert, crl_file)
+
+    CRLCache(ca_file, crl_dir, crl_list=crl_list)
+    assert os.path.isfile(os.path.join(crl_dir, REVOCATION_INDEX))
+
+    index = load_revocation_index(crl_dir)
+    (entry,) = index.values()
+    assert isinstance(entry, MappedRevocationEntry)
+    assert entry.is_revoked(bad_cert.serial_number)
+    assert not entry.is_revoked(good_cert.serial_number)
+
+    # a second cache maps the existing index instead of parsing the CRL again
+    cache = CRLCache(ca_file, crl_dir, crl_list=crl_list)
+    assert cache.crl_check(good_cert.public_bytes(Encoding.PEM))
+    with pytest.raises(CRLRevocationException):
+        cache.crl_check(bad_cert.public_bytes(Encoding.PEM))
+
+
+def test_reloads_changed_crls_in_the_background(
+    ca_key,
+    ca_file,
+    crl_file,
+    rsa_key,
+    make_x509,
+    make_crl,
+    serialize_pki_object_to_disk,
+):
+    crl_dir = os.path.dirname(crl_file)
+    client_cert = make_x509(rsa_key(), signer_key=ca_key, cn="chewbacca")
+    client_pem = client_cert.public_bytes(Encoding.PEM)
+    crl_list = make_crl_list(client_cert, crl_file)
+    cache = CRLCache(ca_file, crl_dir, crl_list=crl_list, reload_interval=60)
+    assert cache.crl_check(client_pem)
+    assert not cache.is_stale()
+
+    revoked_crl = make_crl(ca_key, expired_serials=[client_cert.serial_number])
+    serialize_pki_object_to_disk(revoked_crl, crl_file, encoding=Encoding.DER)
+
+    # logins keep using the loaded CRLs until the watcher swaps in the new ones
+    assert cache.is_stale()
+    assert cache.crl_check(client_pem)
+
+    assert cache.refresh()
+    with pytest.raises(CRLRevocationException):
+        cache.crl_check(client_pem)
+    assert not cache.refresh()
+
+    # a new version stamp from the sync job also triggers a reload
+    write_crl_version_stamp(crl_dir)
+    assert cache.refresh()
+
+    cache._watcher.stop()
+
+
 def test_throws_error_for_missing_issuer(app):
     cache = CRLCache(
         "ssl/server-certs/ca-chain.pem", app.config["CRL_STORAGE_CONTAINER"]
@@ -127,11 +241,13 @@ def test_throws_error_for_missing_issuer(app):
 
 
 FIXTURE_CRL_CACHE = "tests/fixtures/chain/crl_locations.json"
+FIXTURE_REVOCATION_INDEX = "tests/fixtures/chain/{}".format(REVOCATION_INDEX)
 
 
 def setup_function(test_multistep_certificate_chain):
-    if os.path.isfile(FIXTURE_CRL_CACHE):
-        os.remove(FIXTURE_CRL_CACHE)
+    for fixture_cache in [FIXTURE_CRL_CACHE, FIXTURE_REVOCATION_INDEX]:
+        if os.path.isfile(fixture_cache):
+            os.remove(fixture_cache)
 
 
 def test_multistep_certificate_chain():
@@ -186,3 +302,108 @@ def test_load_crl_locations_cache(crl_file):
     serialize_crl_locations_cache(dir_)
     cache = load_crl_locations_cache(dir_)
     assert isinstance(cache, dict)
+
+
+@pytest.fixture
+def crl_server():
+    """
+    A local HTTP stand-in for the CRL distribution points. It serves whatever
+    is in `responses`, keyed by path, and answers conditional requests with a
+    304.
+    """
+    responses = {}
+
+    class CRLRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = responses.get(self.path)
+            if body is None:
+                self.send_response(404)
+                self.end_headers()
+            elif self.headers.get("If-Modified-Since"):
+                self.send_response(304)
+                self.end_headers()
+            else:
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CRLRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield "http://127.0.0.1:{}".format(server.server_port), responses
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_sync_crls_concurrently(crl_server, tmpdir):
+    base_url, responses = crl_server
+    crl_list = []
+    for i in range(5):
+        path = "/DODIDCA_{}.crl".format(i)
+        responses[path] = os.urandom(300 * 1024)
+        crl_list.append((base_url + path, "{:02x}".format(i)))
+    crl_list.append((base_url + "/MISSING.crl", "ff"))
+
+    crl_dir = str(tmpdir)
+    logger = FakeLogger()
+    sync_crls(crl_dir, crl_dir, logger=logger, max_workers=4, crl_list=crl_list)
+
+    for crl_uri, _ in crl_list[:-1]:
+        with open(crl_local_path(crl_dir, crl_uri), "rb") as crl_file:
+            assert crl_file.read() == responses[crl_uri.replace(base_url, "")]
+    assert not [name for name in os.listdir(crl_dir) if name.endswith(".part")]
+    # the app may run as a different user from the sync
+    for name in os.listdir(crl_dir):
+        assert stat.S_IMODE(os.stat(os.path.join(crl_dir, name)).st_mode) == 0o644
+
+    cache = load_crl_locations_cache(crl_dir)
+    assert len(cache) == len(crl_list)
+    assert cache[bytes.fromhex("ff")] is None
+    assert (
+        len(
+            [msg for msg in logger.messages if "({} bytes in".format(300 * 1024) in msg]
+        )
+        == 5
+    )
+
+    # the CRLs are already on disk, so a second sync only makes conditional requests
+    logger = FakeLogger()
+    sync_crls(crl_dir, crl_dir, logger=logger, max_workers=4, crl_list=crl_list)
+    assert len([msg for msg in logger.messages if "no updates" in msg]) == 5
+
+
+def test_sync_crls_writes_shared_revocation_index(
+    crl_server, ca_key, ca_file, rsa_key, make_x509, make_crl, tmpdir,
+):
+    base_url, responses = crl_server
+    client_cert = make_x509(rsa_key(), signer_key=ca_key, cn="chewbacca")
+    crl = make_crl(ca_key, expired_serials=[client_cert.serial_number])
+    responses["/ATAT.crl"] = crl.public_bytes(Encoding.DER)
+    issuer = crl.issuer.public_bytes(default_backend())
+    crl_list = [(base_url + "/ATAT.crl", issuer.hex())]
+
+    crl_dir = str(tmpdir)
+    sync_crls(crl_dir, crl_dir, crl_list=crl_list, root_location=str(ca_file))
+    index_location = os.path.join(crl_dir, REVOCATION_INDEX)
+    index_mtime = os.path.getmtime(index_location)
+
+    # the app maps the index written by the sync job instead of parsing CRLs
+    cache = CRLCache(ca_file, crl_dir, crl_list=crl_list)
+    assert isinstance(cache.revocation_index[issuer], MappedRevocationEntry)
+    with pytest.raises(CRLRevocationException):
+        cache.crl_check(client_cert.public_bytes(Encoding.PEM))
+
+    # a CRL that changed after the sync is parsed in-process and the shared
+    # index is left for the sync job to rewrite
+    with open(crl_local_path(crl_dir, crl_list[0][0]), "wb") as crl_file:
+        crl_file.write(make_crl(ca_key).public_bytes(Encoding.DER))
+    cache = CRLCache(ca_file, crl_dir, crl_list=crl_list)
+    assert isinstance(cache.revocation_index[issuer], ParsedRevocationEntry)
+    assert cache.crl_check(client_cert.public_bytes(Encoding.PEM))
+    assert os.path.getmtime(index_location) == index_mtime
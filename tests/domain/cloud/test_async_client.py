@@ -0,0 +1,185 @@
+import json
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from types import SimpleNamespace
+from uuid import uuid4
+
+from atst.domain.csp.async_client import (
+    AsyncAzureClient,
+    AsyncJobRunner,
+    OAuthTokenCache,
+)
+from atst.domain.csp.cloud import UnknownServerException
+
+
+class FakeAzureHandler(BaseHTTPRequestHandler):
+    """A local stand-in for the Azure token, graph and management endpoints."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self._handle()
+
+    def do_PUT(self):
+        self._handle()
+
+    def _handle(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server.connections.add(self.client_address)
+        server.requests.append((self.command, self.path))
+
+        if self.path.endswith("/oauth2/token"):
+            server.token_requests += 1
+            self._respond(200, {"access_token": "token", "expires_in": "3600"})
+        elif self.headers.get("Authorization") != "Bearer token":
+            self._respond(401, {"error": "unauthorized"})
+        elif self.path.startswith("/fail"):
+            self._respond(500, {"error": "server error"})
+        elif "/users" in self.path:
+            self._respond(201, {"objectId": str(uuid4())})
+        elif "/roleAssignments/" in self.path:
+            assert json.loads(body)["properties"]["principalId"]
+            self._respond(201, {"id": self.path})
+        else:
+            self._respond(404, {})
+
+    def _respond(self, status, body):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_azure():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeAzureHandler)
+    server.connections = set()
+    server.requests = []
+    server.token_requests = 0
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(fake_azure):
+    url = "http://127.0.0.1:{}".format(fake_azure.server_port)
+    client = AsyncAzureClient(
+        "tenant",
+        "client",
+        "secret",
+        pool_size=4,
+        authority_url=url,
+        management_url=url,
+        graph_url=url + "/graph",
+    )
+
+    yield client
+
+    client.close()
+
+
+def _environment_role(csp_user_id=None):
+    return SimpleNamespace(
+        csp_user_id=csp_user_id,
+        role="Basic Access",
+        application_role=SimpleNamespace(user_name="Amanda Adamson"),
+    )
+
+
+def test_provisions_concurrently_over_pooled_connections(client, fake_azure):
+    roles = [_environment_role() for _ in range(20)] + [_environment_role("existing")]
+
+    results = AsyncJobRunner(concurrency=8).run(
+        [
+            lambda role=role: client.create_or_update_user("subscription", role)
+            for role in roles
+        ]
+    )
+
+    assert all(isinstance(result, str) for result in results)
+    assert results[-1] == "existing"
+    # 20 users and 21 role assignments
+    assert len(fake_azure.requests) == 2 + 41
+    # one token for the management endpoint and one for the graph endpoint
+    assert fake_azure.token_requests == 2
+    # the requests were sent over the pool's keep-alive connections
+    assert len(fake_azure.connections) <= 4
+
+
+def test_reports_users_as_soon_as_they_are_created(client):
+    created = []
+
+    [new_user_id, existing_user_id] = AsyncJobRunner().run(
+        [
+            lambda role=role: client.create_or_update_user(
+                "subscription", role, on_user_created=created.append
+            )
+            for role in [_environment_role(), _environment_role("existing")]
+        ]
+    )
+
+    assert created == [new_user_id]
+    assert existing_user_id == "existing"
+
+
+def test_tokens_are_reused_across_runs(client, fake_azure):
+    runner = AsyncJobRunner()
+    runner.run([lambda: client.create_role_assignment("sub", "user", "role")])
+    runner.run([lambda: client.create_role_assignment("sub", "user", "role")])
+
+    assert fake_azure.token_requests == 1
+
+
+def test_errors_are_mapped_to_csp_exceptions(client):
+    [result] = AsyncJobRunner().run(
+        [lambda: client.request("PUT", client.management_url, "/fail")]
+    )
+
+    assert isinstance(result, UnknownServerException)
+
+
+def test_token_cache_refreshes_expired_tokens():
+    now = [0]
+    fetched = []
+
+    async def fetch_token(resource):
+        fetched.append(resource)
+        return ("token-{}".format(len(fetched)), 600)
+
+    cache = OAuthTokenCache(fetch_token, expiry_margin=60, clock=lambda: now[0])
+    runner = AsyncJobRunner()
+
+    assert runner.run([lambda: cache.get("graph")]) == ["token-1"]
+    now[0] = 500
+    assert runner.run([lambda: cache.get("graph")]) == ["token-1"]
+    now[0] = 550
+    assert runner.run([lambda: cache.get("graph")]) == ["token-2"]
+
+
+def test_runner_limits_concurrency():
+    import asyncio
+
+    in_progress = []
+    peak = []
+
+    async def operation():
+        in_progress.append(1)
+        peak.append(len(in_progress))
+        await asyncio.sleep(0.01)
+        in_progress.pop()
+
+    AsyncJobRunner(concurrency=3).run([operation for _ in range(10)])
+
+    assert max(peak) == 3
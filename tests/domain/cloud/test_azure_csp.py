@@ -1,11 +1,17 @@
 import pytest
 
+from unittest.mock import Mock
 from uuid import uuid4
 
-from atst.domain.csp.cloud import AzureCloudProvider
+from atst.domain.csp.async_client import AsyncAzureClient
+from atst.domain.csp.cloud import (
+    AzureCloudProvider,
+    ConnectionException,
+    PartialUserProvisioningException,
+)
 
 from tests.mock_azure import mock_azure, AUTH_CREDENTIALS
-from tests.factories import EnvironmentFactory
+from tests.factories import EnvironmentFactory, EnvironmentRoleFactory
 
 
 def test_create_environment_succeeds(mock_azure: AzureCloudProvider):
@@ -36,3 +42,104 @@ def test_create_atat_admin_user_succeeds(mock_azure: AzureCloudProvider):
     result = mock_azure.create_atat_admin_user(AUTH_CREDENTIALS, environment_id)
 
     assert result.get("csp_user_id") == csp_user_id
+
+
+def test_create_or_update_users_shares_clients(mock_azure: AzureCloudProvider):
+    environment = EnvironmentFactory.create(cloud_id=str(uuid4()))
+    existing_role = EnvironmentRoleFactory.create(
+        environment=environment, csp_user_id="existing"
+    )
+    new_role = EnvironmentRoleFactory.create(environment=environment)
+
+    new_user_id = str(uuid4())
+    graph_client = mock_azure.sdk.graphrbac.GraphRbacManagementClient.return_value
+    graph_client.users.create.return_value.object_id = new_user_id
+
+    result = mock_azure.create_or_update_users(
+        AUTH_CREDENTIALS, [existing_role, new_role]
+    )
+
+    assert result == ["existing", new_user_id]
+    # only the role without a CSP user needed one to be created
+    assert graph_client.users.create.call_count == 1
+    # one authorization client was used for every role assignment
+    auth_client = mock_azure.sdk.authorization.AuthorizationManagementClient
+    assert auth_client.call_count == 1
+    assert auth_client.return_value.role_assignments.create.call_count == 2
+
+
+def test_create_or_update_users_reports_partial_progress(
+    mock_azure: AzureCloudProvider,
+):
+    environment = EnvironmentFactory.create(cloud_id=str(uuid4()))
+    roles = [EnvironmentRoleFactory.create(environment=environment) for _ in range(3)]
+
+    graph_client = mock_azure.sdk.graphrbac.GraphRbacManagementClient.return_value
+    graph_client.users.create.side_effect = [
+        Mock(object_id="user-1"),
+        Mock(object_id="user-2"),
+    ]
+    auth_client = mock_azure.sdk.authorization.AuthorizationManagementClient
+    error = ConnectionException("connection reset")
+    auth_client.return_value.role_assignments.create.side_effect = [None, error]
+
+    with pytest.raises(PartialUserProvisioningException) as exc_info:
+        mock_azure.create_or_update_users(AUTH_CREDENTIALS, roles)
+
+    assert exc_info.value.error is error
+    # the second user was created before its role assignment failed
+    assert exc_info.value.csp_user_ids == ["user-1", "user-2", None]
+    assert exc_info.value.provisioned == [True, False, False]
+
+
+class FakeAsyncClient(AsyncAzureClient):
+    """Provisions through the real create_or_update_user, without HTTP."""
+
+    def __init__(self, failing_users=()):
+        self.failing_users = failing_users
+        self.role_assignments = []
+
+    async def create_user(self, display_name):
+        return "user-{}".format(display_name)
+
+    async def create_role_assignment(
+        self, subscription_id, principal_id, role_definition_id
+    ):
+        if principal_id in self.failing_users:
+            raise ConnectionException("connection reset")
+        self.role_assignments.append((subscription_id, principal_id))
+
+
+def test_create_or_update_users_with_async_client(mock_azure: AzureCloudProvider):
+    environment = EnvironmentFactory.create(cloud_id=str(uuid4()))
+    roles = [EnvironmentRoleFactory.create(environment=environment) for _ in range(3)]
+    roles[0].csp_user_id = "existing"
+    mock_azure.async_client = FakeAsyncClient()
+
+    result = mock_azure.create_or_update_users(AUTH_CREDENTIALS, roles)
+
+    expected = ["existing"] + [
+        "user-{}".format(role.application_role.user_name) for role in roles[1:]
+    ]
+    assert result == expected
+    assert mock_azure.async_client.role_assignments == [
+        (environment.cloud_id, csp_user_id) for csp_user_id in expected
+    ]
+    mock_azure.sdk.authorization.AuthorizationManagementClient.assert_not_called()
+
+
+def test_create_or_update_users_with_async_client_reports_partial_progress(
+    mock_azure: AzureCloudProvider,
+):
+    environment = EnvironmentFactory.create(cloud_id=str(uuid4()))
+    roles = [EnvironmentRoleFactory.create(environment=environment) for _ in range(3)]
+    csp_user_ids = ["user-{}".format(role.application_role.user_name) for role in roles]
+    mock_azure.async_client = FakeAsyncClient(failing_users=[csp_user_ids[1]])
+
+    with pytest.raises(PartialUserProvisioningException) as exc_info:
+        mock_azure.create_or_update_users(AUTH_CREDENTIALS, roles, concurrency=3)
+
+    assert isinstance(exc_info.value.error, ConnectionException)
+    # the user whose role assignment failed was still created
+    assert exc_info.value.csp_user_ids == csp_user_ids
+    assert exc_info.value.provisioned == [True, False, True]
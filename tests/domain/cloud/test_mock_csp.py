@@ -38,3 +38,18 @@ def test_create_or_update_user(mock_csp: MockCloudProvider):
 
 def test_disable_user(mock_csp: MockCloudProvider):
     assert mock_csp.disable_user(CREDENTIALS, "csp_user_id")
+
+
+def test_create_or_update_users(mock_csp: MockCloudProvider):
+    environment = EnvironmentFactory.create()
+    existing_role = EnvironmentRoleFactory.create(
+        environment=environment, csp_user_id="existing"
+    )
+    new_role = EnvironmentRoleFactory.create(environment=environment)
+
+    csp_user_ids = mock_csp.create_or_update_users(
+        CREDENTIALS, [existing_role, new_role]
+    )
+
+    assert csp_user_ids[0] == "existing"
+    assert isinstance(csp_user_ids[1], str)
@@ -0,0 +1,203 @@
+import pytest
+import random
+from unittest.mock import Mock
+from uuid import uuid4
+
+from atst.domain.csp import MockCloudProvider
+from atst.domain.csp.cloud import (
+    AuthorizationException,
+    ConnectionException,
+    PartialUserProvisioningException,
+    UnknownServerException,
+)
+from atst.domain.csp.throttle import (
+    CircuitOpenException,
+    ConcurrencyLimitedException,
+    RateLimitedException,
+    ThrottledCloudProvider,
+    retry_countdown,
+)
+
+CREDENTIALS = MockCloudProvider(config={})._auth_credentials
+
+
+@pytest.fixture
+def failing_csp():
+    csp = MockCloudProvider(config={}, with_delay=False, with_authorization=False)
+    # Every call fails the first network check
+    csp.NETWORK_FAILURE_PCT = 100
+    return csp
+
+
+@pytest.fixture
+def healthy_csp():
+    return MockCloudProvider(config={}, with_delay=False, with_failure=False)
+
+
+@pytest.fixture
+def throttle(app):
+    def _throttle(csp, **kwargs):
+        return ThrottledCloudProvider(
+            csp, app.redis, "test-{}".format(uuid4().hex), **kwargs
+        )
+
+    return _throttle
+
+
+def test_circuit_opens_after_repeated_failures(throttle, failing_csp):
+    csp = throttle(Mock(wraps=failing_csp), failure_threshold=3, cooldown=60)
+
+    for _ in range(3):
+        with pytest.raises(ConnectionException):
+            csp.create_atat_admin_user(CREDENTIALS, "env_id")
+
+    assert csp.circuit_open
+    with pytest.raises(CircuitOpenException) as exc_info:
+        csp.create_atat_admin_user(CREDENTIALS, "env_id")
+
+    assert 0 < exc_info.value.retry_after <= 60
+    # the open circuit stopped the last call from reaching the CSP
+    assert csp.provider.create_atat_admin_user.call_count == 3
+
+
+def test_authorization_failures_do_not_open_the_circuit(throttle, failing_csp):
+    failing_csp.NETWORK_FAILURE_PCT = 0
+    failing_csp.SERVER_FAILURE_PCT = 0
+    failing_csp.ATAT_ADMIN_CREATE_FAILURE_PCT = 0
+    failing_csp.UNAUTHORIZED_RATE = 100
+    csp = throttle(failing_csp, failure_threshold=1)
+
+    with pytest.raises(AuthorizationException):
+        csp.create_atat_admin_user(CREDENTIALS, "env_id")
+
+    assert not csp.circuit_open
+
+
+def test_successes_reset_the_failure_count(throttle, healthy_csp):
+    csp = throttle(healthy_csp, failure_threshold=2)
+    healthy_csp._with_failure = True
+    healthy_csp.NETWORK_FAILURE_PCT = 100
+
+    with pytest.raises(ConnectionException):
+        csp.create_atat_admin_user(CREDENTIALS, "env_id")
+
+    healthy_csp._with_failure = False
+    csp.create_atat_admin_user(CREDENTIALS, "env_id")
+
+    healthy_csp._with_failure = True
+    with pytest.raises(ConnectionException):
+        csp.create_atat_admin_user(CREDENTIALS, "env_id")
+
+    assert not csp.circuit_open
+
+
+def test_rate_limit(throttle, healthy_csp):
+    csp = throttle(healthy_csp, rate=0.5, burst=2)
+
+    csp.create_atat_admin_user(CREDENTIALS, "env_id")
+    csp.create_atat_admin_user(CREDENTIALS, "env_id")
+    with pytest.raises(RateLimitedException) as exc_info:
+        csp.create_atat_admin_user(CREDENTIALS, "env_id")
+
+    assert 0 < exc_info.value.retry_after <= 2
+
+
+def test_concurrency_limit(throttle, healthy_csp):
+    csp = throttle(healthy_csp, max_concurrency=1)
+
+    def nested_call(*args):
+        # a second call while the first is still in progress
+        return csp.create_atat_admin_user(CREDENTIALS, "env_id")
+
+    healthy_csp.create_or_update_user = nested_call
+
+    with pytest.raises(ConcurrencyLimitedException):
+        csp.create_or_update_user(CREDENTIALS, None, "role")
+
+    # the slot was released when the call finished
+    assert csp.create_atat_admin_user(CREDENTIALS, "env_id")
+
+
+def test_calls_turned_away_for_a_slot_do_not_use_tokens(throttle, healthy_csp):
+    csp = throttle(healthy_csp, max_concurrency=1, rate=0.01, burst=2)
+
+    def nested_call(*args):
+        with pytest.raises(ConcurrencyLimitedException):
+            csp.create_atat_admin_user(CREDENTIALS, "env_id")
+        return "csp_user_id"
+
+    healthy_csp.create_or_update_user = nested_call
+    csp.create_or_update_user(CREDENTIALS, None, "role")
+
+    # the nested call was turned away before it took the second token
+    assert csp.create_atat_admin_user(CREDENTIALS, "env_id")
+
+
+def test_user_batches_take_a_token_for_each_role(throttle, healthy_csp):
+    csp = throttle(healthy_csp, rate=0.01, burst=3)
+    roles = [Mock(csp_user_id=None) for _ in range(5)]
+
+    with pytest.raises(PartialUserProvisioningException) as exc_info:
+        csp.create_or_update_users(CREDENTIALS, roles)
+
+    err = exc_info.value
+    assert isinstance(err.error, RateLimitedException)
+    assert err.provisioned == [True, True, True, False, False]
+    assert all(err.csp_user_ids[:3])
+    assert err.csp_user_ids[3:] == [None, None]
+    # the batch used up every token
+    with pytest.raises(RateLimitedException):
+        csp.create_or_update_users(CREDENTIALS, roles[3:])
+
+
+def test_concurrent_user_batches_take_a_slot_for_each_call(throttle, healthy_csp):
+    csp = throttle(healthy_csp, max_concurrency=3)
+    healthy_csp.batch_concurrency = 10
+    roles = [Mock(csp_user_id=None) for _ in range(5)]
+
+    def concurrent_call(auth_credentials, environment_roles, concurrency=1):
+        # every slot is held while the batch is in progress
+        with pytest.raises(ConcurrencyLimitedException):
+            csp.create_atat_admin_user(CREDENTIALS, "env_id")
+        return [str(concurrency)] * len(environment_roles)
+
+    healthy_csp.create_or_update_users = concurrent_call
+
+    assert csp.create_or_update_users(CREDENTIALS, roles) == ["3"] * 5
+    # the slots were released when the batch finished
+    assert csp.create_atat_admin_user(CREDENTIALS, "env_id")
+
+
+def test_other_methods_are_not_throttled(throttle, healthy_csp):
+    csp = throttle(healthy_csp, rate=0.01, burst=1)
+
+    for _ in range(3):
+        assert csp.get_calculator_url() == healthy_csp.get_calculator_url()
+
+
+def test_retry_countdown_depends_on_the_exception():
+    rand = random.Random(0)
+    connection = [
+        retry_countdown(ConnectionException("down"), 0, rand) for _ in range(20)
+    ]
+    authorization = [
+        retry_countdown(AuthorizationException("no"), 0, rand) for _ in range(20)
+    ]
+
+    assert all(2.5 <= delay <= 5 for delay in connection)
+    assert all(30 <= delay <= 60 for delay in authorization)
+    # the delays are jittered
+    assert len(set(connection)) > 1
+
+
+def test_retry_countdown_grows_up_to_a_cap():
+    rand = random.Random(0)
+    exc = UnknownServerException("oops")
+
+    assert 30 <= retry_countdown(exc, 2, rand) <= 60
+    assert 300 <= retry_countdown(exc, 20, rand) <= 600
+
+
+def test_retry_countdown_waits_for_the_throttle():
+    rand = random.Random(0)
+    assert retry_countdown(CircuitOpenException("open", 30), 0, rand) >= 30
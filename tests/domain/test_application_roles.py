@@ -39,6 +39,15 @@ def test_enabled_application_role():
     assert app_role.status == ApplicationRoleStatus.ACTIVE
 
 
+def test_enable_enqueues_environment_role_provisioning(provisioning_queue):
+    app_role = ApplicationRoleFactory.create(status=ApplicationRoleStatus.PENDING)
+    env_role = EnvironmentRoleFactory.create(application_role=app_role)
+
+    ApplicationRoles.enable(app_role, app_role.user)
+
+    provisioning_queue.provision_users.assert_called_once_with([env_role.id])
+
+
 def test_get():
     user = UserFactory.create()
     application = ApplicationFactory.create()
@@ -2,6 +2,7 @@ import pytest
 
 from atst.domain.applications import Applications
 from atst.domain.audit_log import AuditLog
+from atst.domain.common import KeysetPaginator
 from atst.domain.exceptions import UnauthorizedError
 from atst.domain.permission_sets import PermissionSets
 from atst.domain.portfolios import Portfolios
@@ -35,8 +36,25 @@ def test_paginate_audit_log():
     for _ in range(100):
         AuditLog.log_system_event(user, action="create")
 
-    events = AuditLog.get_all_events(pagination_opts={"per_page": 25, "page": 2})
-    assert len(events) == 25
+    first_page = AuditLog.get_all_events(pagination_opts={"per_page": 25})
+    assert len(first_page) == 25
+    assert first_page.has_next
+    assert not first_page.has_prev
+
+    second_page = AuditLog.get_all_events(
+        pagination_opts={"per_page": 25, "after": first_page.next_cursor}
+    )
+    assert len(second_page) == 25
+    assert second_page.has_prev
+    assert not {e.id for e in first_page} & {e.id for e in second_page}
+    assert [e.time_created for e in first_page.items + second_page.items] == sorted(
+        (e.time_created for e in first_page.items + second_page.items), reverse=True
+    )
+
+    back_to_first_page = AuditLog.get_all_events(
+        pagination_opts={"per_page": 25, "before": second_page.prev_cursor}
+    )
+    assert [e.id for e in back_to_first_page] == [e.id for e in first_page]
 
 
 @pytest.mark.audit_log
@@ -48,10 +66,20 @@ def test_paginate_ws_audit_log():
             resource=application, action="create", portfolio=portfolio
         )
 
+    first_page = AuditLog.get_portfolio_events(
+        portfolio, pagination_opts={"per_page": 25}
+    )
     events = AuditLog.get_portfolio_events(
-        portfolio, pagination_opts={"per_page": 25, "page": 2}
+        portfolio, pagination_opts={"per_page": 25, "after": first_page.next_cursor}
     )
     assert len(events) == 25
+    assert all(event.portfolio_id == portfolio.id for event in events)
+
+
+def test_keyset_paginator_ignores_malformed_cursors():
+    assert KeysetPaginator.decode_cursor(None) is None
+    assert KeysetPaginator.decode_cursor("not a cursor") is None
+    assert KeysetPaginator.decode_cursor("bm90IGEgY3Vyc29y") is None
 
 
 @pytest.mark.audit_log
@@ -43,6 +43,28 @@ def test_has_portfolio_permission():
     )
 
 
+def test_portfolio_permissions_are_cached_for_the_request(app):
+    port_role = PortfolioRoleFactory.create(
+        permission_sets=[PermissionSets.get(PermissionSets.VIEW_PORTFOLIO_FUNDING)]
+    )
+    user, portfolio = port_role.user, port_role.portfolio
+
+    with app.test_request_context():
+        permissions = Authorization.portfolio_permissions(user, portfolio)
+        assert isinstance(permissions, frozenset)
+        assert Authorization.portfolio_permissions(user, portfolio) is permissions
+        assert not Authorization.has_portfolio_permission(
+            user, portfolio, Permissions.VIEW_PORTFOLIO_REPORTS
+        )
+
+        PortfolioRoles.update(port_role, [PermissionSets.VIEW_PORTFOLIO_REPORTS])
+
+        assert Authorization.portfolio_permissions(user, portfolio) is not permissions
+        assert Authorization.has_portfolio_permission(
+            user, portfolio, Permissions.VIEW_PORTFOLIO_REPORTS
+        )
+
+
 def test_has_application_permission():
     role_one = PermissionSets.get(PermissionSets.EDIT_APPLICATION_TEAM)
     role_two = PermissionSets.get(PermissionSets.EDIT_APPLICATION_ENVIRONMENTS)
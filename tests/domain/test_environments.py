@@ -25,6 +25,14 @@ def test_create_environments():
         assert env.cloud_id is None
 
 
+def test_create_enqueues_environment_creation(provisioning_queue):
+    application = ApplicationFactory.create()
+    environment = Environments.create(
+        application.portfolio.owner, application, "Staging"
+    )
+    provisioning_queue.create_environments.assert_called_once_with([environment.id])
+
+
 def test_update_env_role():
     env_role = EnvironmentRoleFactory.create(role=CSPRole.BASIC_ACCESS.value)
     new_role = CSPRole.TECHNICAL_READ.value
@@ -34,6 +42,18 @@ def test_update_env_role():
     assert env_role.role == new_role
 
 
+def test_update_env_role_enqueues_provisioning(provisioning_queue):
+    environment = EnvironmentFactory.create()
+    application_role = ApplicationRoleFactory.create(
+        application=environment.application
+    )
+    Environments.update_env_role(
+        environment, application_role, CSPRole.BASIC_ACCESS.value
+    )
+    env_role = EnvironmentRoles.get(application_role.id, environment.id)
+    provisioning_queue.provision_users.assert_called_once_with([env_role.id])
+
+
 def test_update_env_role_no_access():
     env_role = EnvironmentRoleFactory.create(role=CSPRole.BASIC_ACCESS.value)
     Environments.update_env_role(env_role.environment, env_role.application_role, None)
@@ -171,6 +171,37 @@ def test_for_user_returns_all_portfolios_for_ccpo(portfolio, portfolio_owner):
     assert len(sams_portfolios) == 2
 
 
+def test_for_sidebar_returns_portfolio_summaries(portfolio, portfolio_owner):
+    PortfolioFactory.create()
+
+    portfolios, has_next = Portfolios.for_sidebar(portfolio_owner)
+    assert [(p.id, p.name) for p in portfolios] == [(str(portfolio.id), portfolio.name)]
+    assert not has_next
+
+
+def test_for_sidebar_is_invalidated_when_portfolios_change(portfolio, portfolio_owner):
+    Portfolios.for_sidebar(portfolio_owner)
+    Portfolios.update(portfolio, {"name": "renamed portfolio"})
+
+    portfolios, _ = Portfolios.for_sidebar(portfolio_owner)
+    assert portfolios[0].name == "renamed portfolio"
+
+
+def test_for_sidebar_paginates_portfolios_for_ccpo(monkeypatch, portfolio):
+    monkeypatch.setattr("atst.domain.portfolios.portfolios.SIDEBAR_PAGE_SIZE", 1)
+    sam = UserFactory.create_ccpo()
+    PortfolioFactory.create()
+
+    first_page, has_next = Portfolios.for_sidebar(sam)
+    assert len(first_page) == 1
+    assert has_next
+
+    second_page, has_next = Portfolios.for_sidebar(sam, page=2)
+    assert len(second_page) == 1
+    assert second_page[0].id != first_page[0].id
+    assert not has_next
+
+
 def test_can_create_portfolios_with_matching_names():
     portfolio_name = "Great Portfolio"
     PortfolioFactory.create(name=portfolio_name)
@@ -177,3 +177,28 @@ def test_delete_task_order_with_clins(session):
     assert not session.query(
         session.query(TaskOrder).filter_by(id=task_order.id).exists()
     ).scalar()
+
+
+def test_sign_enqueues_pending_environments(provisioning_queue):
+    today = date.today()
+    portfolio = PortfolioFactory.create(
+        applications=[{"environments": [{}, {"cloud_id": "cloud_id"}]}],
+        task_orders=[
+            {
+                "create_clins": [
+                    {
+                        "start_date": today - timedelta(days=1),
+                        "end_date": today + timedelta(days=1),
+                    }
+                ]
+            }
+        ],
+    )
+    pending_environment = portfolio.applications[0].environments[0]
+    task_order = portfolio.task_orders[0]
+
+    TaskOrders.sign(task_order, "1234567890")
+
+    provisioning_queue.create_environments.assert_called_once_with(
+        [pending_environment.id]
+    )
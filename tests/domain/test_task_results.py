@@ -0,0 +1,62 @@
+import pendulum
+import pytest
+from celery import states
+from celery.backends.database.models import TaskExtended
+from uuid import uuid4
+
+from atst.domain.task_results import TaskResults, celery_taskmeta
+from atst.models import EnvironmentJobFailure
+
+from tests.factories import EnvironmentFactory
+
+
+@pytest.fixture
+def task_results(session):
+    # Celery creates its result table when a result is first stored, which
+    # may not have happened in the test database.
+    TaskExtended.__table__.create(bind=session.connection(), checkfirst=True)
+
+    def _create(status, days_ago):
+        task_id = str(uuid4())
+        session.execute(
+            TaskExtended.__table__.insert().values(
+                task_id=task_id,
+                status=status,
+                date_done=pendulum.now().subtract(days=days_ago),
+            )
+        )
+        return task_id
+
+    return _create
+
+
+def _remaining(session, task_ids):
+    return {
+        task_id
+        for task_id, in session.execute(
+            celery_taskmeta.select()
+            .with_only_columns([celery_taskmeta.c.task_id])
+            .where(celery_taskmeta.c.task_id.in_(task_ids))
+        )
+    }
+
+
+def test_delete_expired(session, task_results):
+    old_success = task_results(states.SUCCESS, 40)
+    old_failure = task_results(states.FAILURE, 40)
+    linked_failure = task_results(states.FAILURE, 40)
+    recent_success = task_results(states.SUCCESS, 1)
+    old_retry = task_results(states.RETRY, 40)
+    session.add(
+        EnvironmentJobFailure(
+            environment_id=EnvironmentFactory.create().id, task_id=linked_failure
+        )
+    )
+    session.commit()
+
+    deleted = TaskResults.delete_expired(pendulum.now().subtract(days=30), batch_size=1)
+
+    assert deleted == 2
+    assert _remaining(
+        session, [old_success, old_failure, linked_failure, recent_success, old_retry],
+    ) == {linked_failure, recent_success, old_retry}
@@ -1,6 +1,21 @@
+import pytest
+from sqlalchemy import event
+
 from atst.database import db
-from tests.factories import UserFactory
-from atst.models.mixins.auditable import AuditableMixin
+from atst.models import ApplicationRoleStatus, AuditEvent
+from tests.factories import (
+    ApplicationFactory,
+    ApplicationRoleFactory,
+    EnvironmentFactory,
+    EnvironmentRoleFactory,
+    UserFactory,
+)
+from atst.models.mixins.auditable import (
+    AUDIT_EVENT_BUFFER,
+    AuditableMixin,
+    AuditLookup,
+)
+from atst.domain.application_roles import ApplicationRoles
 from atst.domain.users import Users
 
 
@@ -51,3 +66,130 @@ def test_logging_audit_event_on_update(mock_logger):
     assert event_log["action"] == "update"
 
     assert "update" in mock_logger.extras[1]["tags"]
+
+
+@pytest.mark.audit_log
+def test_audit_events_are_written_in_one_insert_at_commit(session):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        users = [UserFactory.build() for _ in range(3)]
+        session.add_all(users)
+        session.flush()
+
+        for user in users:
+            user.first_name = "Greedo"
+        session.commit()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+
+    audit_inserts = [
+        statement
+        for statement in statements
+        if statement.startswith("INSERT INTO audit_events")
+    ]
+    assert len(audit_inserts) == 1
+    for user in users:
+        assert sorted(
+            audit_event.action
+            for audit_event in session.query(AuditEvent).filter(
+                AuditEvent.resource_id == user.id
+            )
+        ) == ["create", "update"]
+
+
+@pytest.mark.audit_log
+def test_audit_events_are_discarded_on_rollback(session):
+    session.add(UserFactory.build())
+    session.flush()
+    assert len(session.info[AUDIT_EVENT_BUFFER]) == 1
+
+    session.rollback()
+
+    assert AUDIT_EVENT_BUFFER not in session.info
+
+
+@pytest.mark.audit_log
+def test_audit_events_are_discarded_with_their_savepoint(session):
+    kept = UserFactory.build()
+    session.add(kept)
+    session.flush()
+
+    session.begin_nested()
+    session.add(UserFactory.build())
+    session.flush()
+    assert len(session.info[AUDIT_EVENT_BUFFER]) == 2
+    session.rollback()
+
+    assert [
+        audit_event["resource_id"] for audit_event in session.info[AUDIT_EVENT_BUFFER]
+    ] == [kept.id]
+    session.commit()
+    assert (
+        session.query(AuditEvent).filter(AuditEvent.resource_id == kept.id).count() == 1
+    )
+
+
+def test_environment_role_audit_fields_match_its_relationships():
+    environment_role = EnvironmentRoleFactory.create()
+    lookup = AuditLookup(db.session, db.session.connection())
+
+    fields = environment_role.audit_fields(lookup)
+
+    assert fields["portfolio_id"] == environment_role.portfolio_id
+    assert fields["application_id"] == environment_role.application_id
+    assert fields["display_name"] == environment_role.displayname
+    assert fields["event_details"] == environment_role.event_details
+
+
+def _statements_flushed_when_disabling(environment_count):
+    application = ApplicationFactory.create()
+    member_role = ApplicationRoleFactory.create(
+        application=application, status=ApplicationRoleStatus.ACTIVE
+    )
+    for _ in range(environment_count):
+        EnvironmentRoleFactory.create(
+            application_role=member_role,
+            environment=EnvironmentFactory.create(application=application),
+        )
+    db.session.expire_all()
+
+    session = db.session()
+    flushing = []
+    statements = []
+
+    def start_flush(session, flush_context, instances):
+        flushing.append(True)
+
+    def end_flush(session, flush_context):
+        flushing.pop()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if flushing:
+            statements.append(statement)
+
+    event.listen(session, "before_flush", start_flush)
+    event.listen(session, "after_flush_postexec", end_flush)
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        # Commits after each environment role, which expires every loaded row.
+        ApplicationRoles.disable(member_role)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+        event.remove(session, "after_flush_postexec", end_flush)
+        event.remove(session, "before_flush", start_flush)
+
+    return len(statements)
+
+
+def test_audit_events_do_not_load_parents_for_every_row():
+    # Each environment role adds only its own UPDATE to the flushes. Any
+    # lookup made while auditing it, of any table, would add more.
+    assert (
+        _statements_flushed_when_disabling(5) - _statements_flushed_when_disabling(1)
+        == 4
+    )
@@ -1,7 +1,12 @@
 import pytest
 from flask import url_for
+from redis.exceptions import ConnectionError as RedisConnectionError
+from unittest.mock import Mock
+from uuid import uuid4
 
 from atst.app import make_config, make_app
+from atst.routes.errors import UNMATCHED_ROUTE, notify
+from atst.utils.error_notifier import ErrorNotifier
 
 from tests.factories import UserFactory
 
@@ -30,6 +35,9 @@ def test_csrf_error(csrf_enabled_app, client):
 def blowup_app(notification_sender):
     _blowup_app = make_app(make_config(direct_config={"DEBUG": False}))
     _blowup_app.notification_sender = notification_sender
+    _blowup_app.error_notifier = ErrorNotifier(
+        _blowup_app.redis, key_prefix="test_errors_{}".format(uuid4())
+    )
 
     @_blowup_app.route("/throw")
     def throw():
@@ -51,3 +59,43 @@ def test_errors_generate_notifications(
     blowup_client.get("/throw")
 
     notification_sender.send.assert_called_once()
+
+
+def test_repeated_errors_are_aggregated(
+    blowup_client, client, user_session, notification_sender
+):
+    user_session(UserFactory.create())
+
+    for _ in range(3):
+        blowup_client.get("/throw")
+
+    notification_sender.send.assert_called_once()
+    assert "ValueError on /throw" in notification_sender.send.call_args[0][0]
+
+
+def test_errors_are_shown_when_notifying_fails(
+    blowup_app, blowup_client, client, user_session, notification_sender
+):
+    user_session(UserFactory.create())
+    blowup_app.error_notifier = Mock()
+    blowup_app.error_notifier.notify.side_effect = RedisConnectionError()
+
+    response = blowup_client.get("/throw")
+
+    assert response.status_code == 500
+    assert "An Unexpected Error Occurred" in response.data.decode()
+    notification_sender.send.assert_not_called()
+
+
+def test_errors_without_a_route_share_a_fingerprint(app, monkeypatch):
+    error_notifier = Mock()
+    monkeypatch.setattr(app, "error_notifier", error_notifier)
+    error = ValueError()
+
+    for path in ["/one/path", "/another/path"]:
+        with app.test_request_context(path):
+            notify(error, "An error", 500)
+
+    assert [call[0] for call in error_notifier.notify.call_args_list] == [
+        (error, UNMATCHED_ROUTE, "An error")
+    ] * 2
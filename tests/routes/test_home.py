@@ -2,7 +2,7 @@ import pytest
 
 from flask import url_for
 
-from tests.factories import UserFactory
+from tests.factories import PortfolioFactory, UserFactory
 from atst.utils.localization import translate
 
 
@@ -14,3 +14,26 @@ def test_home_route(client, user_session):
 
     assert response.status_code == 200
     assert translate("home.add_portfolio_button_text").encode("utf8") in response.data
+
+
+@pytest.mark.parametrize("page", ["zero", "0", "-3"])
+def test_home_route_with_invalid_portfolios_page(client, user_session, page):
+    user_session(UserFactory.create())
+
+    response = client.get(url_for("atst.home", portfoliosPage=page))
+
+    assert response.status_code == 200
+
+
+def test_portfolios_pages_keep_the_query_string(client, user_session, monkeypatch):
+    monkeypatch.setattr("atst.domain.portfolios.portfolios.SIDEBAR_PAGE_SIZE", 1)
+    PortfolioFactory.create()
+    PortfolioFactory.create()
+    user_session(UserFactory.create_ccpo())
+
+    response = client.get(url_for("atst.home", after="cursor", portfoliosPage=1))
+
+    body = response.data.decode()
+    assert "portfoliosPage=2" in body
+    assert "portfoliosPage=1" not in body
+    assert "after=cursor" in body
@@ -64,6 +64,9 @@ def test_all_protected_routes_have_access_control(
     """
     # monkeypatch any object lookups that might happen in the access decorator
     monkeypatch.setattr("atst.domain.portfolios.Portfolios.for_user", lambda *a: [])
+    monkeypatch.setattr(
+        "atst.domain.portfolios.Portfolios.for_sidebar", lambda *a, **k: ([], False)
+    )
     monkeypatch.setattr("atst.domain.portfolios.Portfolios.get", lambda *a: None)
     monkeypatch.setattr("atst.domain.task_orders.TaskOrders.get", lambda *a: Mock())
     monkeypatch.setattr("atst.domain.applications.Applications.get", lambda *a: Mock())
@@ -4,7 +4,14 @@ from uuid import uuid4
 from unittest.mock import Mock
 from threading import Thread
 
-from atst.domain.csp.cloud import MockCloudProvider
+from celery.exceptions import Retry
+
+from atst.domain.csp.cloud import (
+    ConnectionException,
+    MockCloudProvider,
+    PartialUserProvisioningException,
+)
+from atst.domain.csp.throttle import RateLimitedException
 from atst.jobs import (
     RecordEnvironmentFailure,
     RecordEnvironmentRoleFailure,
@@ -15,8 +22,14 @@ from atst.jobs import (
     create_environment,
     dispatch_provision_user,
     do_provision_user,
+    do_create_environments,
+    create_environments,
+    do_create_atat_admin_users,
+    do_provision_users,
+    do_work,
 )
-from atst.models.utils import claim_for_update
+from atst.domain.environments import Environments
+from atst.models.utils import claim_for_update, claim_many_for_update
 from atst.domain.exceptions import ClaimFailedException
 from tests.factories import (
     EnvironmentFactory,
@@ -24,7 +37,7 @@ from tests.factories import (
     PortfolioFactory,
     ApplicationRoleFactory,
 )
-from atst.models import EnvironmentRole, ApplicationRoleStatus
+from atst.models import Environment, EnvironmentRole, ApplicationRoleStatus
 
 
 @pytest.fixture(autouse=True, scope="function")
@@ -50,6 +63,41 @@ def test_environment_job_failure(celery_app, celery_worker):
     assert job_failure.task == task
 
 
+def test_failed_chunks_record_failures_for_unfinished_environments(
+    app, csp, session, monkeypatch
+):
+    portfolio = PortfolioFactory.create(
+        applications=[{"environments": [{}, {}]}],
+        task_orders=[
+            {
+                "create_clins": [
+                    {
+                        "start_date": pendulum.now().subtract(days=1),
+                        "end_date": pendulum.now().add(days=1),
+                    }
+                ]
+            }
+        ],
+    )
+    environments = portfolio.applications[0].environments
+    # the second environment of the chunk fails
+    csp.create_environment.side_effect = ["cloud_id", ValueError("boom")]
+    monkeypatch.setattr(app.csp, "cloud", csp)
+
+    task = create_environments.apply(
+        kwargs={"environment_ids": [e.id for e in environments]}
+    )
+    with pytest.raises(ValueError):
+        task.get()
+
+    for environment in environments:
+        session.refresh(environment)
+    [created] = [e for e in environments if e.cloud_id]
+    [failed] = [e for e in environments if not e.cloud_id]
+    assert created.job_failures == []
+    assert [failure.task_id for failure in failed.job_failures] == [task.id]
+
+
 def test_environment_role_job_failure(celery_app, celery_worker):
     @celery_app.task(bind=True, base=RecordEnvironmentRoleFailure)
     def _fail_hard(self, environment_role_id=None):
@@ -118,14 +166,14 @@ def test_dispatch_create_environment(session, monkeypatch):
     session.commit()
 
     mock = Mock()
-    monkeypatch.setattr("atst.jobs.create_environment", mock)
+    monkeypatch.setattr("atst.jobs.create_environments", mock)
 
     # When dispatch_create_environment is called
     dispatch_create_environment.run()
 
-    # It should cause the create_environment task to be called once with the
+    # It should cause the create_environments task to be called once with the
     # non-deleted environment
-    mock.delay.assert_called_once_with(environment_id=e1.id)
+    mock.delay.assert_called_once_with(environment_ids=[e1.id])
 
 
 def test_dispatch_create_atat_admin_user(session, monkeypatch):
@@ -145,12 +193,12 @@ def test_dispatch_create_atat_admin_user(session, monkeypatch):
         ],
     )
     mock = Mock()
-    monkeypatch.setattr("atst.jobs.create_atat_admin_user", mock)
+    monkeypatch.setattr("atst.jobs.create_atat_admin_users", mock)
     environment = portfolio.applications[0].environments[0]
 
     dispatch_create_atat_admin_user.run()
 
-    mock.delay.assert_called_once_with(environment_id=environment.id)
+    mock.delay.assert_called_once_with(environment_ids=[environment.id])
 
 
 def test_create_environment_no_dupes(session, celery_app, celery_worker):
@@ -275,13 +323,13 @@ def test_dispatch_provision_user(csp, session, celery_app, celery_worker, monkey
     )
 
     mock = Mock()
-    monkeypatch.setattr("atst.jobs.provision_user", mock)
+    monkeypatch.setattr("atst.jobs.provision_users", mock)
 
     # When I dispatch the user provisioning task
     dispatch_provision_user.run()
 
     # I expect it to dispatch only one call, to EnvironmentRole D
-    mock.delay.assert_called_once_with(environment_role_id=er_d.id)
+    mock.delay.assert_called_once_with(environment_role_ids=[er_d.id])
 
 
 def test_do_provision_user(csp, session):
@@ -306,3 +354,338 @@ def test_do_provision_user(csp, session):
     )
     # I expect that the EnvironmentRole now has a csp_user_id
     assert environment_role.csp_user_id
+
+
+def test_claim_many_for_update(session):
+    environments = [EnvironmentFactory.create() for _ in range(3)]
+    ids = [environment.id for environment in environments]
+    query = session.query(Environment).filter(Environment.id.in_(ids))
+
+    with claim_many_for_update(query, limit=2) as first_claim:
+        assert len(first_claim) == 2
+        assert all(environment.claimed_until for environment in first_claim)
+
+        with claim_many_for_update(query) as second_claim:
+            # only the environment that was not already claimed is returned
+            assert len(second_claim) == 1
+            assert second_claim[0] not in first_claim
+
+    for environment in environments:
+        session.refresh(environment)
+        assert environment.claimed_until is None
+
+
+def test_claim_limit_counts_resources_not_joined_rows(session):
+    active_clin = {
+        "start_date": pendulum.now().subtract(days=1),
+        "end_date": pendulum.now().add(days=1),
+    }
+    portfolio = PortfolioFactory.create(
+        applications=[{"environments": [{}, {}, {}]}],
+        # every environment matches the pending query once for each CLIN
+        task_orders=[{"create_clins": [active_clin, active_clin, active_clin]}],
+    )
+    query = Environments.pending_creation_query(pendulum.now())
+
+    with claim_many_for_update(query, limit=2) as claimed:
+        assert len(claimed) == 2
+        assert len(set(claimed)) == 2
+
+    for environment in portfolio.applications[0].environments:
+        session.refresh(environment)
+        assert environment.claimed_until is None
+
+
+def test_do_create_environments_with_limit(csp, session):
+    portfolio = PortfolioFactory.create(
+        applications=[{"environments": [{}, {}, {}]}],
+        task_orders=[
+            {
+                "create_clins": [
+                    {
+                        "start_date": pendulum.now().subtract(days=1),
+                        "end_date": pendulum.now().add(days=1),
+                    }
+                ]
+            }
+        ],
+    )
+    environments = portfolio.applications[0].environments
+
+    do_create_environments(csp, limit=2)
+    for environment in environments:
+        session.refresh(environment)
+    assert len([e for e in environments if e.cloud_id]) == 2
+
+    do_create_environments(csp, environment_ids=[e.id for e in environments])
+    for environment in environments:
+        session.refresh(environment)
+    assert all(environment.cloud_id for environment in environments)
+    assert csp.create_environment.call_count == 3
+    # the root credentials are looked up once for each batch
+    assert csp.root_creds.call_count == 2
+
+
+def test_do_provision_users(csp, session):
+    credentials = MockCloudProvider(())._auth_credentials
+    provisioned_environment = EnvironmentFactory.create(
+        cloud_id="cloud_id", root_user_info={"credentials": credentials}
+    )
+    environment_roles = [
+        EnvironmentRoleFactory.create(
+            environment=provisioned_environment,
+            application_role=ApplicationRoleFactory.create(
+                status=ApplicationRoleStatus.ACTIVE
+            ),
+            status=EnvironmentRole.Status.PENDING,
+            role="my_role",
+        )
+        for _ in range(2)
+    ]
+
+    do_provision_users(csp, environment_role_ids=[r.id for r in environment_roles])
+
+    for environment_role in environment_roles:
+        session.refresh(environment_role)
+        assert environment_role.csp_user_id
+        assert environment_role.status == EnvironmentRole.Status.COMPLETED
+
+
+def test_do_provision_users_batches_roles_by_environment(csp, session):
+    credentials = MockCloudProvider(())._auth_credentials
+    environments = [
+        EnvironmentFactory.create(
+            cloud_id="cloud_id", root_user_info={"credentials": credentials}
+        )
+        for _ in range(2)
+    ]
+    environment_roles = [
+        EnvironmentRoleFactory.create(
+            environment=environment,
+            application_role=ApplicationRoleFactory.create(
+                status=ApplicationRoleStatus.ACTIVE
+            ),
+            status=EnvironmentRole.Status.PENDING,
+        )
+        for environment in environments
+        for _ in range(3)
+    ]
+
+    do_provision_users(csp, environment_role_ids=[r.id for r in environment_roles])
+
+    assert csp.create_or_update_users.call_count == 2
+    batches = [call[0][1] for call in csp.create_or_update_users.call_args_list]
+    assert sorted(len(batch) for batch in batches) == [3, 3]
+    for batch in batches:
+        assert len({role.environment_id for role in batch}) == 1
+
+
+def test_do_provision_users_saves_partial_progress(csp, session):
+    credentials = MockCloudProvider(())._auth_credentials
+    environment = EnvironmentFactory.create(
+        cloud_id="cloud_id", root_user_info={"credentials": credentials}
+    )
+    environment_roles = [
+        EnvironmentRoleFactory.create(
+            environment=environment,
+            application_role=ApplicationRoleFactory.create(
+                status=ApplicationRoleStatus.ACTIVE
+            ),
+            status=EnvironmentRole.Status.PENDING,
+        )
+        for _ in range(3)
+    ]
+    error = ConnectionException("connection reset")
+    csp.create_or_update_users.side_effect = PartialUserProvisioningException(
+        error, ["user-1", "user-2", None], [True, False, False]
+    )
+
+    with pytest.raises(ConnectionException):
+        do_provision_users(csp, environment_role_ids=[r.id for r in environment_roles])
+
+    done, created, untouched = csp.create_or_update_users.call_args[0][1]
+    for environment_role in (done, created, untouched):
+        session.refresh(environment_role)
+    assert done.csp_user_id == "user-1"
+    assert done.status == EnvironmentRole.Status.COMPLETED
+    # the user was created, so a retry only has to assign its role
+    assert created.csp_user_id == "user-2"
+    assert created.status == EnvironmentRole.Status.PENDING
+    assert untouched.csp_user_id is None
+    assert untouched.status == EnvironmentRole.Status.PENDING
+
+
+def test_do_create_environments_skips_environments_not_pending(csp, session):
+    environment = EnvironmentFactory.create(cloud_id="cloud_id")
+
+    do_create_environments(csp, environment_ids=[environment.id])
+
+    csp.create_environment.assert_not_called()
+
+
+def test_created_environments_enqueue_the_next_step(csp, session, provisioning_queue):
+    portfolio = PortfolioFactory.create(
+        applications=[{"environments": [{}]}],
+        task_orders=[
+            {
+                "create_clins": [
+                    {
+                        "start_date": pendulum.now().subtract(days=1),
+                        "end_date": pendulum.now().add(days=1),
+                    }
+                ]
+            }
+        ],
+    )
+    environment = portfolio.applications[0].environments[0]
+    environment_role = EnvironmentRoleFactory.create(
+        environment=environment,
+        application_role=ApplicationRoleFactory.create(
+            status=ApplicationRoleStatus.ACTIVE
+        ),
+        status=EnvironmentRole.Status.PENDING,
+    )
+
+    do_create_environments(csp, environment_ids=[environment.id])
+    provisioning_queue.create_atat_admin_users.assert_called_once_with([environment.id])
+
+    do_create_atat_admin_users(csp, environment_ids=[environment.id])
+    provisioning_queue.provision_users.assert_called_once_with([environment_role.id])
+
+
+def test_chained_steps_run_as_soon_as_they_are_enqueued(
+    csp, session, provisioning_queue
+):
+    portfolio = PortfolioFactory.create(
+        applications=[{"environments": [{}]}],
+        task_orders=[
+            {
+                "create_clins": [
+                    {
+                        "start_date": pendulum.now().subtract(days=1),
+                        "end_date": pendulum.now().add(days=1),
+                    }
+                ]
+            }
+        ],
+    )
+    environment = portfolio.applications[0].environments[0]
+    environment_role = EnvironmentRoleFactory.create(
+        environment=environment,
+        application_role=ApplicationRoleFactory.create(
+            status=ApplicationRoleStatus.ACTIVE
+        ),
+        status=EnvironmentRole.Status.PENDING,
+    )
+
+    # Run each step as soon as the previous one enqueues it, like a worker
+    # that picks the task up right away.
+    def create_atat_admin_users(environment_ids):
+        do_create_atat_admin_users(csp, environment_ids=environment_ids)
+
+    def provision_users(environment_role_ids):
+        do_provision_users(csp, environment_role_ids=environment_role_ids)
+
+    provisioning_queue.create_atat_admin_users.side_effect = create_atat_admin_users
+    provisioning_queue.provision_users.side_effect = provision_users
+
+    do_create_environments(csp, environment_ids=[environment.id])
+
+    session.refresh(environment)
+    session.refresh(environment_role)
+    assert environment.cloud_id
+    assert environment.root_user_info
+    assert environment_role.status == EnvironmentRole.Status.COMPLETED
+    assert environment_role.csp_user_id
+
+
+def test_dispatch_skips_environments_in_flight(app, session, monkeypatch):
+    portfolio = PortfolioFactory.create(
+        applications=[{"environments": [{}]}],
+        task_orders=[
+            {
+                "create_clins": [
+                    {
+                        "start_date": pendulum.now().subtract(days=1),
+                        "end_date": pendulum.now().add(days=1),
+                    }
+                ]
+            }
+        ],
+    )
+    environment = portfolio.applications[0].environments[0]
+    mock = Mock()
+    monkeypatch.setattr("atst.jobs.create_environments", mock)
+    dropped = app.in_flight_registry.dropped("create_environment")
+
+    dispatch_create_environment.run()
+    dispatch_create_environment.run()
+
+    mock.delay.assert_called_once_with(environment_ids=[environment.id])
+    assert app.in_flight_registry.dropped("create_environment") == dropped + 1
+
+
+def test_finished_tasks_release_their_resources(app, session):
+    environment = EnvironmentFactory.create(cloud_id="cloud_id")
+    app.in_flight_registry.register("create_environment", [environment.id])
+
+    create_environment.apply(kwargs={"environment_id": environment.id})
+
+    assert not app.in_flight_registry.is_in_flight("create_environment", environment.id)
+
+
+def test_dispatch_publishes_chunks(app, session, monkeypatch):
+    portfolio = PortfolioFactory.create(
+        applications=[{"environments": [{}, {}, {}]}],
+        task_orders=[
+            {
+                "create_clins": [
+                    {
+                        "start_date": pendulum.now().subtract(days=1),
+                        "end_date": pendulum.now().add(days=1),
+                    }
+                ]
+            }
+        ],
+    )
+    environment_ids = {e.id for e in portfolio.applications[0].environments}
+    mock = Mock()
+    monkeypatch.setattr("atst.jobs.create_environments", mock)
+    monkeypatch.setitem(app.config, "PROVISIONING_CHUNK_SIZE", 2)
+
+    dispatch_create_environment.run()
+
+    chunks = [call[1]["environment_ids"] for call in mock.delay.call_args_list]
+    assert sorted(len(chunk) for chunk in chunks) == [1, 2]
+    assert {id_ for chunk in chunks for id_ in chunk} == environment_ids
+
+
+def _task(retries=0):
+    task = Mock()
+    task.request.is_eager = False
+    task.request.retries = retries
+    task.request.args = []
+    task.request.kwargs = {"environment_ids": ["an-id"]}
+    task.retry.side_effect = Retry()
+    return task
+
+
+def test_throttled_work_does_not_use_up_retries(csp):
+    task = _task(retries=2)
+
+    with pytest.raises(Retry):
+        do_work(Mock(side_effect=RateLimitedException("limited", 1)), task, csp)
+
+    task.retry.assert_not_called()
+    assert task.apply_async.call_args[1]["retries"] == 2
+    assert task.apply_async.call_args[1]["kwargs"] == {"environment_ids": ["an-id"]}
+
+
+def test_failed_work_uses_up_retries(csp):
+    task = _task(retries=2)
+
+    with pytest.raises(Retry):
+        do_work(Mock(side_effect=ConnectionException("down")), task, csp)
+
+    task.apply_async.assert_not_called()
+    task.retry.assert_called_once()
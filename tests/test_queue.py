@@ -0,0 +1,62 @@
+import time
+from unittest.mock import Mock
+
+from atst.queue import _record_queue_wait, celery, queue_names, task_routes
+
+
+def test_tasks_are_routed_to_their_own_queues():
+    routes = task_routes("celery-test")
+
+    assert routes["atst.jobs.send_mail"]["queue"] == "celery-test-mail"
+    assert routes["atst.jobs.dispatch_*"]["queue"] == "celery-test-dispatch"
+    assert routes["atst.jobs.create_environment*"]["queue"] == (
+        "celery-test-provisioning"
+    )
+    assert set(route["queue"] for route in routes.values()) < set(
+        queue_names("celery-test")
+    )
+
+
+def test_later_provisioning_steps_have_priority():
+    routes = task_routes("celery")
+
+    # 0 is the highest priority with the Redis broker
+    assert (
+        routes["atst.jobs.provision_user*"]["priority"]
+        < routes["atst.jobs.create_atat_admin_user*"]["priority"]
+        < routes["atst.jobs.create_environment*"]["priority"]
+    )
+
+
+def test_router_uses_the_routes(app):
+    default_queue = app.config.get("CELERY_DEFAULT_QUEUE")
+    route = celery.amqp.router.route({}, "atst.jobs.create_environments")
+
+    assert route["queue"].name == "{}-provisioning".format(default_queue)
+    assert route["priority"] == 6
+
+
+def test_record_queue_wait(app, monkeypatch):
+    record_wait = Mock()
+    monkeypatch.setattr(app.queue_metrics, "record_wait", record_wait)
+    task = Mock()
+    task.request.delivery_info = {"routing_key": "celery-mail"}
+    task.request.sent_at = time.time() - 5
+    task.request.eta = None
+
+    _record_queue_wait(task=task)
+
+    queue, seconds = record_wait.call_args[0]
+    assert queue == "celery-mail"
+    assert 5 <= seconds < 10
+
+
+def test_record_queue_wait_skips_eager_tasks(app, monkeypatch):
+    record_wait = Mock()
+    monkeypatch.setattr(app.queue_metrics, "record_wait", record_wait)
+    task = Mock()
+    task.request.delivery_info = {"is_eager": True}
+
+    _record_queue_wait(task=task)
+
+    record_wait.assert_not_called()
@@ -7,6 +7,7 @@ from cryptography.hazmat.backends import default_backend
 from flask import template_rendered
 
 from atst.utils.notification_sender import NotificationSender
+from atst.utils.provisioning_queue import ProvisioningQueue
 
 
 @contextmanager
@@ -48,6 +49,8 @@ class FakeLogger:
 
 FakeNotificationSender = lambda: Mock(spec=NotificationSender)
 
+FakeProvisioningQueue = lambda: Mock(spec=ProvisioningQueue)
+
 
 def parse_for_issuer_and_next_update(crl):
     with open(crl, "rb") as crl_file:
@@ -6,6 +6,7 @@ from atst.domain.permission_sets import PermissionSets
 from atst.models import Permissions
 from atst.utils.context_processors import (
     get_resources_from_context,
+    get_user_and_resources_from_context,
     user_can_view,
     portfolio as portfolio_context,
 )
@@ -34,6 +35,19 @@ def test_get_resources_from_context():
     )
 
 
+def test_get_user_and_resources_from_context():
+    user = UserFactory.create()
+    application = ApplicationFactory.create()
+
+    assert get_user_and_resources_from_context(
+        user.id, {"application_id": application.id}
+    ) == (user, (application.portfolio, application))
+    assert get_user_and_resources_from_context(user.id, {}) == (user, ())
+    assert get_user_and_resources_from_context(
+        user.id, {"portfolio_id": UserFactory.create().id}
+    ) == (user, None)
+
+
 @pytest.fixture
 def set_g(monkeypatch):
     _g = Mock()
@@ -0,0 +1,99 @@
+import pytest
+from uuid import uuid4
+
+from atst.utils.error_notifier import ErrorNotifier
+
+
+@pytest.fixture
+def error_notifier(app):
+    return ErrorNotifier(
+        app.redis, window=60, key_prefix="test_errors_{}".format(uuid4())
+    )
+
+
+def test_first_error_is_notified(error_notifier, notification_sender):
+    error_notifier.notify(ValueError(), "/portfolios", "An error")
+
+    notification_sender.send.assert_called_once()
+    body = notification_sender.send.call_args[0][0]
+    assert body.startswith("An error")
+    assert "ValueError on /portfolios occurred 1 time " in body
+
+
+def test_errors_are_notified_once_per_window(app, error_notifier, notification_sender):
+    for _ in range(3):
+        error_notifier.notify(ValueError(), "/portfolios", "An error")
+
+    assert notification_sender.send.call_count == 1
+
+    # the window ends
+    fingerprint = error_notifier.fingerprint(ValueError(), "/portfolios")
+    app.redis.delete(error_notifier._key(fingerprint, "notified"))
+    error_notifier.notify(ValueError(), "/portfolios", "An error")
+
+    assert notification_sender.send.call_count == 2
+    assert "occurred 3 times" in notification_sender.send.call_args[0][0]
+
+
+def test_errors_are_fingerprinted_by_type_and_route(
+    error_notifier, notification_sender
+):
+    error_notifier.notify(ValueError(), "/portfolios", "An error")
+    error_notifier.notify(KeyError(), "/portfolios", "An error")
+    error_notifier.notify(ValueError(), "/applications", "An error")
+
+    assert notification_sender.send.call_count == 3
+    assert error_notifier.fingerprint(
+        ValueError("one"), "/portfolios"
+    ) == error_notifier.fingerprint(ValueError("two"), "/portfolios")
+
+
+def test_flush_notifies_errors_after_the_window_closes(
+    app, error_notifier, notification_sender
+):
+    for _ in range(3):
+        error_notifier.notify(ValueError(), "/portfolios", "An error")
+
+    # the window is still open
+    error_notifier.flush()
+    assert notification_sender.send.call_count == 1
+
+    fingerprint = error_notifier.fingerprint(ValueError(), "/portfolios")
+    app.redis.delete(error_notifier._key(fingerprint, "notified"))
+    error_notifier.flush()
+
+    assert notification_sender.send.call_count == 2
+    body = notification_sender.send.call_args[0][0]
+    assert body.startswith("An error")
+    assert "ValueError on /portfolios occurred 2 times" in body
+
+
+def test_flush_does_not_hold_back_the_next_error(
+    app, error_notifier, notification_sender
+):
+    error_notifier.notify(ValueError(), "/portfolios", "An error")
+    fingerprint = error_notifier.fingerprint(ValueError(), "/portfolios")
+    app.redis.delete(error_notifier._key(fingerprint, "notified"))
+
+    # there is nothing new to notify
+    error_notifier.flush()
+    assert notification_sender.send.call_count == 1
+
+    error_notifier.notify(ValueError(), "/portfolios", "An error")
+    assert notification_sender.send.call_count == 2
+
+
+def test_counts_that_were_already_notified_are_not_notified_again(
+    app, error_notifier, notification_sender, monkeypatch
+):
+    getset = app.redis.getset
+
+    def getset_after_another_process(key, value):
+        # another process notifies the count and resets it first
+        getset(key, value)
+        return getset(key, value)
+
+    monkeypatch.setattr(error_notifier.redis, "getset", getset_after_another_process)
+    error_notifier.notify(ValueError(), "/portfolios", "An error")
+
+    notification_sender.send.assert_not_called()
@@ -0,0 +1,44 @@
+import pytest
+from uuid import uuid4
+
+from atst.utils.in_flight_registry import InFlightRegistry
+
+
+@pytest.fixture
+def in_flight_registry(app):
+    return InFlightRegistry(app.redis, key_prefix="test_in_flight_{}".format(uuid4()))
+
+
+def test_register_drops_duplicates(in_flight_registry):
+    first, second = uuid4(), uuid4()
+
+    assert in_flight_registry.register("create_environment", [first]) == [first]
+    assert in_flight_registry.register("create_environment", [first, second]) == [
+        second
+    ]
+    assert in_flight_registry.dropped("create_environment") == 1
+
+    # the registrations are kept separately for each task type
+    assert in_flight_registry.register("provision_user", [first]) == [first]
+    assert in_flight_registry.dropped("provision_user") == 0
+
+
+def test_release(in_flight_registry):
+    resource_id = uuid4()
+    in_flight_registry.register("create_environment", [resource_id])
+    assert in_flight_registry.is_in_flight("create_environment", resource_id)
+
+    in_flight_registry.release("create_environment", [resource_id])
+
+    assert not in_flight_registry.is_in_flight("create_environment", resource_id)
+    assert in_flight_registry.register("create_environment", [resource_id]) == [
+        resource_id
+    ]
+
+
+def test_registrations_expire(app, in_flight_registry):
+    resource_id = uuid4()
+    in_flight_registry.register("create_environment", [resource_id])
+
+    ttl = app.redis.ttl(in_flight_registry._key("create_environment", resource_id))
+    assert 0 < ttl <= in_flight_registry.expiry_seconds
@@ -1,5 +1,16 @@
 import pytest
-from atst.utils.mailer import Mailer, Mailer, MailConnection, RedisConnection
+import smtplib
+import socketserver
+from threading import Thread
+from unittest.mock import Mock
+
+from atst.utils.mailer import (
+    Mailer,
+    Mailer,
+    MailConnection,
+    RedisConnection,
+    SMTPConnection,
+)
 
 
 class MockConnection(MailConnection):
@@ -46,3 +57,155 @@ def test_redis_mailer_can_save_messages(app):
     assert message_data["recipients"][0] in message
     assert message_data["subject"] in message
     assert message_data["body"] in message
+
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    """
+    A local stand-in for an SMTP server that accepts any login. Setting
+    `drop_sessions` on the server makes it close every open session before
+    its next command, the way a server times out idle sessions.
+    """
+
+    def handle(self):
+        server = self.server
+        server.sessions += 1
+        session = server.sessions
+        self._reply("220 fake ESMTP")
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line:
+                return
+            if session <= server.drop_sessions:
+                self._reply("421 Timeout, closing connection")
+                return
+
+            command = line.split(" ")[0].upper()
+            if command == "EHLO":
+                self._reply("250-fake", "250 AUTH PLAIN")
+            elif command == "AUTH":
+                server.logins += 1
+                self._reply("235 Authenticated")
+            elif command in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self._reply("250 OK")
+            elif command == "DATA":
+                self._reply("354 Go ahead")
+                lines = []
+                for data in self.rfile:
+                    if data.rstrip(b"\r\n") == b".":
+                        break
+                    lines.append(data)
+                server.messages.append(b"".join(lines).decode())
+                self._reply("250 Queued")
+            elif command == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Not implemented")
+
+    def _reply(self, *lines):
+        self.wfile.write("".join(line + "\r\n" for line in lines).encode())
+
+
+class PlainSMTPConnection(SMTPConnection):
+    def _open(self):
+        return smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+
+
+@pytest.fixture
+def fake_smtp():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeSMTPHandler)
+    server.daemon_threads = True
+    server.sessions = 0
+    server.logins = 0
+    server.drop_sessions = 0
+    server.messages = []
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def smtp_mailer(fake_smtp, **kwargs):
+    connection = PlainSMTPConnection(
+        "127.0.0.1", fake_smtp.server_address[1], "user", "password", **kwargs
+    )
+    return Mailer(connection, "test@atat.com")
+
+
+def test_smtp_connection_reuses_sessions(fake_smtp):
+    mailer = smtp_mailer(fake_smtp)
+
+    for n in range(5):
+        mailer.send(["ben@tattoine.org"], "message {}".format(n), "hello")
+
+    assert len(fake_smtp.messages) == 5
+    assert fake_smtp.logins == 1
+    assert mailer.connection.stats["sent"] == 5
+    assert mailer.connection.stats["connections"] == 1
+    assert len(mailer.connection.stats["latencies"]) == 5
+
+
+def test_smtp_connection_replaces_sessions_after_max_messages(fake_smtp):
+    mailer = smtp_mailer(fake_smtp, max_messages=2)
+
+    for n in range(5):
+        mailer.send(["ben@tattoine.org"], "message {}".format(n), "hello")
+
+    assert len(fake_smtp.messages) == 5
+    assert fake_smtp.logins == 3
+
+
+def test_smtp_connection_closes_idle_sessions(fake_smtp):
+    now = [0]
+    mailer = smtp_mailer(fake_smtp, idle_timeout=60, clock=lambda: now[0])
+
+    mailer.send(["ben@tattoine.org"], "first", "hello")
+    now[0] = 61
+    mailer.send(["ben@tattoine.org"], "second", "hello")
+
+    assert fake_smtp.logins == 2
+
+
+def test_smtp_connection_reconnects_after_server_timeout(fake_smtp):
+    mailer = smtp_mailer(fake_smtp)
+    mailer.send(["ben@tattoine.org"], "first", "hello")
+
+    # the server times out the open session
+    fake_smtp.drop_sessions = fake_smtp.sessions
+    mailer.send(["ben@tattoine.org"], "second", "hello")
+
+    assert len(fake_smtp.messages) == 2
+    assert "second" in fake_smtp.messages[1]
+    assert mailer.connection.stats["reconnects"] == 1
+    assert mailer.connection.stats["connections"] == 2
+
+
+def test_smtp_connection_closes_the_new_session_if_resending_fails(fake_smtp):
+    mailer = smtp_mailer(fake_smtp)
+    mailer.send(["ben@tattoine.org"], "first", "hello")
+
+    fake_smtp.drop_sessions = fake_smtp.sessions
+    host = Mock()
+    host.send_message.side_effect = smtplib.SMTPServerDisconnected()
+    mailer.connection._open = lambda: host
+    with pytest.raises(smtplib.SMTPServerDisconnected):
+        mailer.send(["ben@tattoine.org"], "second", "hello")
+
+    host.quit.assert_called_once_with()
+    assert mailer.connection._idle == []
+
+
+def test_smtp_connection_closes_the_new_session_if_login_fails(fake_smtp):
+    mailer = smtp_mailer(fake_smtp)
+    host = Mock()
+    host.login.side_effect = smtplib.SMTPAuthenticationError(535, b"Bad login")
+    mailer.connection._open = lambda: host
+
+    with pytest.raises(smtplib.SMTPAuthenticationError):
+        mailer.send(["ben@tattoine.org"], "first", "hello")
+
+    host.close.assert_called_once_with()
+    assert mailer.connection.stats["connections"] == 0
@@ -20,5 +20,27 @@ def test_can_send_notification(monkeypatch, notification_sender):
     notification_sender.send(email_body)
 
     job_mock.assert_called_once_with(
-        ("test@example.com",), notification_sender.EMAIL_SUBJECT, email_body
+        ["test@example.com"], notification_sender.EMAIL_SUBJECT, email_body
     )
+
+
+def test_recipients_are_cached(monkeypatch):
+    now = [0]
+    notification_sender = NotificationSender(recipients_ttl=60, clock=lambda: now[0])
+    job_mock = Mock()
+    monkeypatch.setattr("atst.jobs.send_notification_mail.delay", job_mock)
+
+    NotificationRecipientFactory.create(email="first@example.com")
+    notification_sender.send("first")
+    NotificationRecipientFactory.create(email="second@example.com")
+    notification_sender.send("second")
+
+    assert job_mock.call_args[0][0] == ["first@example.com"]
+
+    now[0] = 61
+    notification_sender.send("third")
+
+    assert sorted(job_mock.call_args[0][0]) == [
+        "first@example.com",
+        "second@example.com",
+    ]
@@ -0,0 +1,67 @@
+import pytest
+
+from atst.domain.authz import Authorization
+from atst.domain.permission_sets import PermissionSets
+from atst.domain.portfolio_roles import PortfolioRoles
+from atst.models.permissions import Permissions
+from atst.utils.permission_cache import PermissionCache
+
+from tests.factories import PortfolioRoleFactory, UserFactory
+
+
+@pytest.fixture
+def permission_cache(app):
+    permission_cache = PermissionCache(app.redis, key_prefix="test_permissions")
+    yield permission_cache
+    for key in app.redis.scan_iter(match="test_permissions:*"):
+        app.redis.delete(key)
+
+
+def test_write_and_read_snapshot(permission_cache):
+    snapshot = {"atat": ["view_audit_log"], "portfolios": {}, "applications": {}}
+    permission_cache.write("a-user", snapshot)
+    assert permission_cache.read("a-user") == snapshot
+
+    permission_cache.invalidate("a-user")
+    assert permission_cache.read("a-user") is None
+
+
+def test_snapshot_built_before_an_invalidation_is_not_served(permission_cache):
+    version = permission_cache.version("a-user")
+    permission_cache.invalidate("a-user")
+    permission_cache.write("a-user", {"atat": ["view_audit_log"]}, version)
+
+    assert permission_cache.read("a-user") is None
+
+
+def test_invalidate_all(permission_cache):
+    permission_cache.write("user-one", {"atat": []})
+    permission_cache.write("user-two", {"atat": []})
+    permission_cache.invalidate_all()
+
+    assert permission_cache.read("user-one") is None
+    assert permission_cache.read("user-two") is None
+
+
+def test_snapshot_is_stored_and_reused(app):
+    user = UserFactory.create_ccpo()
+    snapshot = Authorization.permission_snapshot(user)
+
+    assert app.permission_cache.read(user.id) == snapshot
+    assert Permissions.VIEW_AUDIT_LOG in snapshot["atat"]
+
+
+def test_role_changes_invalidate_snapshot(app):
+    port_role = PortfolioRoleFactory.create(
+        permission_sets=[PermissionSets.get(PermissionSets.VIEW_PORTFOLIO_FUNDING)]
+    )
+    user, portfolio = port_role.user, port_role.portfolio
+    Authorization.permission_snapshot(user)
+    assert app.permission_cache.read(user.id) is not None
+
+    PortfolioRoles.update(port_role, [PermissionSets.VIEW_PORTFOLIO_REPORTS])
+
+    assert app.permission_cache.read(user.id) is None
+    assert Authorization.has_portfolio_permission(
+        user, portfolio, Permissions.VIEW_PORTFOLIO_REPORTS
+    )
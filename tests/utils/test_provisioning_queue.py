@@ -0,0 +1,87 @@
+import pytest
+from unittest.mock import Mock
+from uuid import uuid4
+
+from atst.utils.provisioning_queue import ProvisioningQueue
+
+
+@pytest.fixture
+def provisioning_queue():
+    return ProvisioningQueue()
+
+
+def test_enqueues_tasks_by_name(monkeypatch, provisioning_queue):
+    send_task = Mock()
+    monkeypatch.setattr("atst.queue.celery.send_task", send_task)
+    environment_id = uuid4()
+
+    provisioning_queue.create_environments([environment_id])
+
+    send_task.assert_called_once_with(
+        "atst.jobs.create_environments",
+        kwargs={"environment_ids": [str(environment_id)]},
+    )
+
+
+def test_does_not_enqueue_without_ids(monkeypatch, provisioning_queue):
+    send_task = Mock()
+    monkeypatch.setattr("atst.queue.celery.send_task", send_task)
+
+    provisioning_queue.provision_users([])
+
+    send_task.assert_not_called()
+
+
+def test_logs_enqueue_failures(monkeypatch, mock_logger, provisioning_queue):
+    monkeypatch.setattr(
+        "atst.queue.celery.send_task", Mock(side_effect=ConnectionError("down"))
+    )
+
+    provisioning_queue.provision_users([uuid4()])
+
+    assert "atst.jobs.provision_users" in mock_logger.messages[-1]
+
+
+def test_does_not_enqueue_resources_in_flight(app, monkeypatch, provisioning_queue):
+    send_task = Mock()
+    monkeypatch.setattr("atst.queue.celery.send_task", send_task)
+    in_flight_id, new_id = uuid4(), uuid4()
+
+    provisioning_queue.create_environments([in_flight_id])
+    provisioning_queue.create_environments([in_flight_id, new_id])
+
+    assert send_task.call_args_list[-1][1] == {
+        "kwargs": {"environment_ids": [str(new_id)]}
+    }
+
+
+def test_falls_back_to_the_reconciler_when_redis_fails(
+    app, monkeypatch, mock_logger, provisioning_queue
+):
+    send_task = Mock()
+    monkeypatch.setattr("atst.queue.celery.send_task", send_task)
+    monkeypatch.setattr(
+        app.in_flight_registry,
+        "register",
+        Mock(side_effect=ConnectionError("redis is down")),
+    )
+
+    provisioning_queue.create_environments([uuid4()])
+
+    send_task.assert_not_called()
+    assert "atst.jobs.create_environments" in mock_logger.messages[-1]
+
+
+def test_repeated_ids_are_enqueued_once(app, monkeypatch, provisioning_queue):
+    send_task = Mock()
+    monkeypatch.setattr("atst.queue.celery.send_task", send_task)
+    environment_id = uuid4()
+    dropped = app.in_flight_registry.dropped("create_environment")
+
+    provisioning_queue.create_environments([environment_id, environment_id])
+
+    send_task.assert_called_once_with(
+        "atst.jobs.create_environments",
+        kwargs={"environment_ids": [str(environment_id)]},
+    )
+    assert app.in_flight_registry.dropped("create_environment") == dropped
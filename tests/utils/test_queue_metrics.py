@@ -0,0 +1,53 @@
+import pytest
+from uuid import uuid4
+
+from atst.utils.queue_metrics import QueueMetrics
+
+
+@pytest.fixture
+def queue_metrics(app):
+    return QueueMetrics(
+        app.redis, sample_size=5, key_prefix="test_queue_metrics_{}".format(uuid4())
+    )
+
+
+@pytest.fixture
+def queue(app, queue_metrics):
+    name = "test-queue-{}".format(uuid4())
+    yield name
+    app.redis.delete(
+        queue_metrics._key(name),
+        *[
+            queue_metrics._priority_list(name, step)
+            for step in QueueMetrics.PRIORITY_STEPS
+        ],
+    )
+
+
+def test_depth_counts_every_priority(app, queue_metrics, queue):
+    app.redis.lpush(queue, "a", "b")
+    app.redis.lpush(queue_metrics._priority_list(queue, 6), "c")
+
+    assert queue_metrics.depth(queue) == 3
+
+
+def test_wait_times_keep_the_most_recent_samples(queue_metrics, queue):
+    for seconds in range(8):
+        queue_metrics.record_wait(queue, seconds)
+
+    assert queue_metrics.wait_times(queue) == [3, 4, 5, 6, 7]
+
+
+def test_summary(queue_metrics, queue):
+    assert queue_metrics.summary(queue) == {
+        "depth": 0,
+        "wait_p50": None,
+        "wait_p99": None,
+    }
+
+    for seconds in [0.5, 1, 2, 4, 30]:
+        queue_metrics.record_wait(queue, seconds)
+
+    summary = queue_metrics.summary(queue)
+    assert summary["wait_p50"] == 2
+    assert summary["wait_p99"] == 30
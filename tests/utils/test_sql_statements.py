@@ -0,0 +1,12 @@
+from flask import g
+
+from atst.database import db
+from atst.models import User
+
+
+def test_counts_sql_statements_per_request(app):
+    with app.test_request_context():
+        g.sql_statement_count = 0
+        db.session.query(User).all()
+        db.session.query(User).count()
+        assert g.sql_statement_count == 2